@@ -1,147 +1,124 @@
+import startup_profiler # ต้อง import ก่อนโมดูลอื่น เพื่อจับเวลาเริ่มต้นทั้งหมด
 import logging
 import os
-from datetime import datetime
-from openpyxl import Workbook, load_workbook
+from datetime import datetime, timedelta
 from telegram import Update
 from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes, CommandHandler
-import cv2 
-import pytesseract 
-from PIL import Image 
 import re
-import numpy as np 
-import sqlite3
 import shutil
 import threading
 import asyncio
+import time
 import glob
+startup_profiler.mark("import telegram + stdlib")
 
 # --- Import Modules ---
+# cv2 / numpy / pytesseract / openpyxl ไม่ถูก import ที่นี่ โมดูลที่ใช้จะโหลดเองเมื่อต้องใช้ครั้งแรก
 import logging_manager
 import excel_manager
 import resume_manager
+import job_queue_manager
+import sequence_manager
+import auth_manager
+import ocr_manager
+import sqlite_manager
+import dedup_manager
+import metrics_manager
+import report_manager
+import storage_manager
+import shard_manager
+startup_profiler.mark("import bot modules")
 
 # --- Constants and Configuration ---
 IMAGE_FOLDER = "image_folder"
 ALLOWED_USERS_FILE = "User.txt"
+ADMIN_USERS_FILE = "Admin.txt" # ผู้ใช้ที่สั่ง /reloadusers ได้ (หนึ่งชื่อต่อบรรทัด)
 MAX_DAILY_IMAGES = 99999
 BOT_TOKEN = "" # BOT TOKEN ของคุณถูกใส่ไว้ตรงนี้แล้ว
 
 ML_FEEDBACK_DB = "ml_feedback.db"
+JOB_QUEUE_DB = "job_queue.db"
 LOG_FILENAME = "bot_activity.log"
+LOG_LEVEL = "INFO" # "WARNING" = ไม่บันทึกข้อความ INFO รายรูปภาพ
+
+# --- Job Queue Configuration ---
+PROCESS_PHOTO_JOB = "process_photo"
+PROCESS_ALBUM_JOB = "process_album"
+JOB_WORKER_COUNT = max(4, ocr_manager.OCR_POOL_SIZE) # จำนวน worker ที่ประมวลผลรูปภาพพร้อมกัน แต่ละตัวรอ OCR ทีละรูป จึงต้องไม่น้อยกว่าขนาด OCR pool
+JOB_SUBMIT_TIMEOUT_SECONDS = 5 # เวลารอสูงสุดเมื่อคิวเต็ม ก่อนตอบผู้ใช้ว่าระบบไม่ว่าง
+SHUTDOWN_DRAIN_SECONDS = 30 # เมื่อได้ SIGTERM/Ctrl+C รองานที่กำลังทำให้เสร็จนานสุดเท่านี้ งานที่เหลือจะทำต่อเมื่อเริ่มใหม่
+
+# --- OCR Configuration ---
+OCR_ENABLED = True
+OCR_TIMEOUT_SECONDS = 20 # ต่อรูปภาพ เกินเวลานี้จะใช้ bot_timestamp แทน
+TESSERACT_CMD_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+OCR_BACKEND = "auto" # "tesserocr" (engine โหลดครั้งเดียวต่อ process), "pytesseract" หรือ "auto"
+
+# --- Duplicate Photo Configuration ---
+DEDUP_ENABLED = True
+DEDUP_MODE = "flag" # "flag" = แจ้งผู้ใช้และไม่บันทึกซ้ำ, "store" = บันทึกซ้ำแต่ใช้ผล OCR เดิม
+
+# --- Album / Telegram HTTP Configuration ---
+ALBUM_COLLECT_SECONDS = 1.5 # รอรูปถัดไปในอัลบั้มเดียวกันนานสุดเท่านี้ก่อนเริ่มประมวลผล
+PHOTO_DOWNLOAD_CONCURRENCY = 4 # จำนวนรูปที่ดาวน์โหลดพร้อมกัน
+BOT_CONNECTION_POOL_SIZE = 16 # ต้องมากกว่า PHOTO_DOWNLOAD_CONCURRENCY + จำนวนข้อความตอบกลับที่ส่งพร้อมกัน
+BOT_POOL_TIMEOUT_SECONDS = 10
+BOT_READ_TIMEOUT_SECONDS = 30 # ดาวน์โหลดรูปขนาดใหญ่
+BOT_API_BASE_URL = None # None = api.telegram.org หรือใส่ URL ของ Bot API server ที่รันเอง เช่น "http://127.0.0.1:8081"
+
+# --- Sharding Configuration ---
+SHARD_COUNT = 1 # >1 = แยกงานของผู้ใช้ไปยัง worker process ตามจำนวนนี้ (process นี้รับข้อความและตอบรับอย่างเดียว)
+
+# --- Metrics Configuration ---
+METRICS_HTTP_PORT = 9108 # http://127.0.0.1:9108/metrics (None = ปิด)
+METRICS_DUMP_FILE = "metrics.json" # None = ไม่เขียนไฟล์
+METRICS_DUMP_INTERVAL_SECONDS = 60
+
+# --- Report Configuration ---
+REPORT_FOLDER = "Reports" # ไฟล์รายงานชั่วคราวก่อนส่งผ่านบอท (ลบหลังส่ง)
+REPORT_DEFAULT_DAYS = 7
+REPORT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024 # ขนาดไฟล์สูงสุดที่ Bot API รับ ใหญ่กว่านี้ให้ใช้ report_manager.py จาก command line
+BOT_MEDIA_WRITE_TIMEOUT_SECONDS = 120 # อัปโหลดไฟล์รายงาน
+
+# --- Stats / History Configuration ---
+STATS_DEFAULT_DAYS = 7
+STATS_MAX_DAYS = 31
+HISTORY_DEFAULT_LIMIT = 10
+HISTORY_MAX_LIMIT = 50
+STATS_MAX_USERS_SHOWN = 30 # /stats all
+
+# --- Image Storage Configuration ---
+STORAGE_TIERING_ENABLED = True # บีบอัดรูปเก่าและรวมเป็น zip รายเดือน ตั้งค่าเกณฑ์ได้ใน storage_manager.py
 
 # --- Excel Files Configuration ---
 EXCEL_BASE_FOLDER = "Excel Files" # โฟลเดอร์สำหรับเก็บไฟล์ Excel ในเครื่อง
 
 # --- Setup Logging ---
-logging_manager.setup_logging(log_filename=LOG_FILENAME)
-
-tesseract_cmd_path = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-
-try:
-    if os.path.exists(tesseract_cmd_path):
-        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd_path
-    else:
-        logging.warning(f"Tesseract executable not found at '{tesseract_cmd_path}'. Trying system PATH.")
-        pytesseract.pytesseract.tesseract_cmd = 'tesseract'
-except pytesseract.TesseractNotFoundError:
-    logging.error("Tesseract is not installed or not found in system PATH. OCR will not work.")
-except Exception as e:
-    logging.error(f"Error setting Tesseract path: {e}")
-
-DATE_TIME_PATTERNS = [
-    (r'(\d{2}[-./]\d{2}[-./]\d{4})\s+(\d{2}:\d{2}:\d{2})',
-     ['%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d.%m.%Y %H:%M:%S'],
-     lambda d, t: f"{str(int(d[6:10]) - 543) if int(d[6:10]) > datetime.now().year + 50 and len(d) == 10 and d[6:10].isdigit() else d[6:10]}{d[2:6]}{d[0:2]} {t}"),
-    (r'(\d{2}[-./]\d{2}[-./]\d{4})\s+(\d{2}:\d{2})',
-     ['%d-%m-%Y %H:%M', '%d/%m/%Y %H:%M', '%d.%m.%Y %H:%M'],
-     lambda d, t: f"{str(int(d[6:10]) - 543) if int(d[6:10]) > datetime.now().year + 50 and len(d) == 10 and d[6:10].isdigit() else d[6:10]}{d[2:6]}{d[0:2]} {t}"),
-    (r'(\d{4}[-./]\d{2}[-./]\d{2})\s+(\d{2}:\d{2}:\d{2})',
-     ['%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y.%m.%d %H:%M:%S'],
-     lambda d, t: f"{d} {t}"),
-    (r'(\d{4}[-./]\d{2}[-./]\d{2})\s+(\d{2}:\d{2})',
-     ['%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M', '%Y.%m-%d %H:%M'],
-     lambda d, t: f"{d} {t}"),
-    (r'(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2}:\d{2})', ['%m/%d/%Y %H:%M:%S'], lambda d, t: f"{d} {t}"),
-    (r'(\d{2}[-./]\d{2}[-./]\d{2})\s+(\d{2}:\d{2}:\d{2})',
-     ['%d-%m-%y %H:%M:%S', '%d/%m/%y %H:%M:%S', '%d.%m.%y %H:%M:%S'],
-     lambda d, t: f"{d} {t}"),
-    (r'(\d{2}[-./]\d{2}[-./]\d{2})\s+(\d{2}:\d{2})',
-     ['%d-%m-%y %H:%M', '%d/%m/%y %H:%M', '%d.%m.%y %H:%M'],
-     lambda d, t: f"{d} {t}"),
-    (r'(\d{2}:\d{2}:\d{2})\s+(\d{2}[-./]\d{2}[-./]\d{4})',
-     ['%H:%M:%S %d-%m-%Y', '%H:%M:%S %d/%m-%Y', '%H:%M:%S %d.%m.%Y'],
-     lambda t, d: f"{str(int(d[6:10]) - 543) if int(d[6:10]) > datetime.now().year + 50 and len(d) == 10 and d[6:10].isdigit() else d[6:10]}{d[2:6]}{d[0:2]} {t}"),
-    (r'(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{4}\s+\d{2}:\d{2}:\d{2})',
-     ['%d %b %Y %H:%M:%S'], lambda s: s),
-    (r'(\d{2}[-./]\d{2}[-./]\d{2}\s+\d{1,2}:\d{2}(?::\d{2})?\s*[AP]M)',
-     ['%d/%m/%y %I:%M %p', '%d/%m/%y %I:%M:%S %p', '%d-%m-%y %I:%M %p', '%d-%m-%y %I:%M:%S %p'],
-     lambda s: s),
-    (r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})', ['%Y-%m-%dT%H:%M:%S'], lambda s: s),
-    (r'(\d{1,2})\s+(พ\.ค\.)\s+(\d{4})\s+(\d{2}:\d{2}:\d{2})',
-     ['%d %b %Y %H:%M:%S'],
-     lambda d, m, y, t: f"{d} {m.replace('พ.ค.', 'May')} {str(int(y) - 543) if int(y) > datetime.now().year + 50 else y} {t}"),
-    (r'(\d{1,2}[-./]\d{1,2}[-./]\d{2,4})\s+เวลา\s+(\d{1,2}:\d{2}(?::\d{2})?)\s*น\.',
-     ['%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M'],
-     lambda d_str, t_str: f"{str(int(d_str[-4:]) - 543) if len(d_str) >= 4 and int(d_str[-4:]) > datetime.now().year + 50 else d_str[-4:]}{d_str[2:6]}{d[0:2]} {t_str}" if len(d_str) >= 4 and d_str[-4:].isdigit() else f"{d_str} {t_str}"
-    )
-]
-
-# --- #OCR-related functions #
-def preprocess_image_for_ocr(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    enhanced_gray = clahe.apply(gray)
-    blurred_image = cv2.GaussianBlur(enhanced_gray, (3, 3), 0)
-    thresh_image = cv2.adaptiveThreshold(blurred_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                         cv2.THRESH_BINARY_INV, 15, 5)
-
-    coords = np.column_stack(np.where(thresh_image > 0))
-    if coords.size > 0:
-        rect = cv2.minAreaRect(coords)
-        angle = rect[-1]
-        if angle < -45:
-            angle = -(90 + angle)
-        else:
-            angle = -angle
-        (h, w) = thresh_image.shape[:2]
-        center = (w // 2, h // 2)
-        M = cv2.getRotationMatrix2D(center, angle, 1.0)
-        thresh_image = cv2.warpAffine(thresh_image, M, (w, h),
-                                      flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-
-    kernel_dilate = np.ones((1,1), np.uint8)
-    kernel_erode = np.ones((1,1), np.uint8)
-    denoised_image = cv2.dilate(thresh_image, kernel_dilate, iterations=1)
-    denoised_image = cv2.erode(denoised_image, kernel_erode, iterations=1)
-    return denoised_image
-
-def find_timestamp_roi(image):
-    h, w, _ = image.shape
-    rois = []
-
-    rois.append((int(w * 0.5), int(h * 0.75), int(w * 0.5), int(h * 0.25)))
-    rois.append((0, int(h * 0.75), int(w * 0.5), int(h * 0.25)))
-    rois.append((int(w * 0.5), 0, int(w * 0.5), int(h * 0.25)))
-    rois.append((0, 0, int(w * 0.5), int(h * 0.25)))
-
-    rois.append((int(w * 0.65), int(h * 0.85), int(w * 0.35), int(h * 0.15)))
-    rois.append((0, int(h * 0.85), int(w * 0.35), int(h * 0.15)))
-    rois.append((int(w * 0.65), 0, int(w * 0.35), int(h * 0.15)))
-    rois.append((0, 0, int(w * 0.35), int(h * 0.15)))
-
-    rois.append((int(w * 0.25), int(h * 0.25), int(w * 0.5), int(h * 0.5)))
-    rois.append((int(w * 0.1), int(h * 0.8), int(w * 0.8), int(h * 0.2)))
-    rois.append((int(w * 0.1), 0, int(w * 0.8), int(h * 0.2)))
-    rois.append((0, int(h * 0.1), int(w * 0.2), int(h * 0.8)))
-    rois.append((int(w * 0.8), int(h * 0.1), int(w * 0.2), int(h * 0.8)))
-    rois.append((int(w * 0.05), int(h * 0.05), int(w * 0.9), int(h * 0.9)))
-
-    return rois
-
-def extract_timestamp_from_image_ocr(image_path):
-    # TODO
-    logging.info(f"Attempting to extract timestamp from: {image_path} (OCR is disabled).")
-    return None # Return None เพราะ OCR ถูกปิดการใช้งาน
+if __name__ != "__mp_main__": # process ลูกที่ import สคริปต์นี้ (shard worker) ตั้งค่าไฟล์ log ของตัวเองใน run_shard_worker
+    logging_manager.setup_logging(log_filename=LOG_FILENAME, level=LOG_LEVEL)
+startup_profiler.mark("setup logging")
+
+def extract_timestamp_from_image_ocr(image_path, username=None, resolution=None, image_bytes=None):
+    """
+    Returns the timestamp read from the image, or None when OCR is disabled, finds nothing or times out.
+    Blocks the calling worker thread only; the OCR itself runs in the ocr_manager process pool.
+    ROIs are tried in the order learned from this user's previous hits (see roi_stats).
+    If image_bytes is given it is decoded in memory instead of re-reading image_path.
+    """
+    if not OCR_ENABLED:
+        return None
+    logging.info(f"Attempting to extract timestamp from: {image_path}")
+    roi_order = None
+    if username:
+        roi_order = ocr_manager.get_learned_roi_order(sqlite_manager.get_roi_stats(username, resolution))
+    result = ocr_manager.extract_timestamp(image_path, roi_order=roi_order, timeout=OCR_TIMEOUT_SECONDS,
+                                           image_bytes=image_bytes)
+    if username:
+        sqlite_manager.record_roi_attempts(username, result["resolution"], result["tried_rois"], result["roi_index"])
+    if result["timestamp"]:
+        logging.info(f"OCR found timestamp '{result['timestamp']}' in ROI {result['roi_index']} "
+                     f"after {len(result['tried_rois'])} attempt(s) for {image_path}")
+    return result["timestamp"]
 
 
 def initialize_directories():
@@ -150,93 +127,174 @@ def initialize_directories():
     logging.info(f"Directory '{IMAGE_FOLDER}' ensured to exist.")
     logging.info(f"Directory '{EXCEL_BASE_FOLDER}' ensured to exist.")
 
-def initialize_sqlite_db():
-    conn = None
-    try:
-        conn = sqlite3.connect(ML_FEEDBACK_DB)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS missed_timestamps (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                image_filename TEXT NOT NULL UNIQUE,
-                timestamp_from_bot TEXT NOT NULL,
-                ml_correct_timestamp TEXT,
-                notes TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        logging.info(f"SQLite database '{ML_FEEDBACK_DB}' and table 'missed_timestamps' initialized.")
-    except sqlite3.Error as e:
-        logging.error(f"Error initializing SQLite database: {e}")
-    finally:
-        if conn:
-            conn.close()
-
-def insert_missed_timestamp_record(image_filename, timestamp_from_bot):
-    conn = None
-    try:
-        conn = sqlite3.connect(ML_FEEDBACK_DB)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR IGNORE INTO missed_timestamps (image_filename, timestamp_from_bot)
-            VALUES (?, ?)
-        ''', (image_filename, timestamp_from_bot))
-        conn.commit()
-        if cursor.rowcount > 0:
-            logging.info(f"Inserted missed timestamp record for '{image_filename}' into SQLite.")
-        else:
-            logging.info(f"Record for '{image_filename}' already exists in SQLite (ignored).")
-    except sqlite3.Error as e:
-        logging.error(f"Error inserting into missed_timestamps: {e}")
-    finally:
-        if conn:
-            conn.close()
-
 def load_allowed_users(filename=ALLOWED_USERS_FILE):
-    if not os.path.exists(filename):
-        logging.warning(f"'{filename}' not found. No users will be allowed unless created.")
-        return set()
-    try:
-        with open(filename, "r", encoding="utf-8") as f:
-            allowed_users = {line.strip().lower() for line in f if line.strip()}
-        logging.info(f"Loaded {len(allowed_users)} allowed users from '{filename}'.")
-        return allowed_users
-    except Exception as e:
-        logging.error(f"Error loading allowed users from '{filename}': {e}")
-        return set()
+    # Cached: the file is only re-read when its mtime/size changes
+    return auth_manager.get_users(filename)
+
+def is_admin_user(username):
+    return auth_manager.is_user_in_file(username, ADMIN_USERS_FILE)
+
+# --- Downloaded Image Buffers ---
+# เก็บ bytes ของรูปที่เพิ่งดาวน์โหลดไว้ให้ job ใช้ทำ OCR โดยไม่ต้องอ่านไฟล์จากดิสก์ซ้ำ
+MAX_BUFFERED_IMAGES = 200 # เกินจำนวนนี้ job จะอ่านรูปจากดิสก์แทน
+downloaded_image_bytes = {}  # filename -> bytes
+downloaded_image_bytes_lock = threading.Lock()
+
+def buffer_downloaded_image(filename, image_bytes):
+    with downloaded_image_bytes_lock:
+        if len(downloaded_image_bytes) < MAX_BUFFERED_IMAGES:
+            downloaded_image_bytes[filename] = image_bytes
+
+def pop_downloaded_image(filename):
+    with downloaded_image_bytes_lock:
+        return downloaded_image_bytes.pop(filename, None)
+
+def find_duplicate_photo(username, image_bytes):
+    """
+    Hashes the downloaded bytes and looks them up in the dedup cache.
+    Returns (content_hash, perceptual_hash, earlier record or None).
+    """
+    content_hash = dedup_manager.compute_content_hash(image_bytes)
+    perceptual_hash = None
+    if dedup_manager.PERCEPTUAL_HASH_ENABLED:
+        perceptual_hash = dedup_manager.compute_perceptual_hash(image_bytes)
+    return content_hash, perceptual_hash, dedup_manager.find_duplicate(username, content_hash, perceptual_hash)
+
+def write_image_file(full_path, image_bytes):
+    with metrics_manager.timed("handle_photo_stage_seconds", stage="write_file"):
+        with open(full_path, "wb") as f:
+            f.write(image_bytes)
+
+async def send_acknowledgement(message, text, received_at):
+    with metrics_manager.timed("handle_photo_stage_seconds", stage="ack_reply"):
+        await message.reply_text(text)
+    metrics_manager.observe("ack_latency_seconds", time.perf_counter() - received_at)
+
+# --- Process Photo Thread Target (Main logic for saving) ---
+# ค่าเหล่านี้ถูกกำหนดใน post_init เมื่อ event loop ของบอทเริ่มทำงาน
+bot_event_loop = None
+bot_instance_for_jobs = None
+photo_download_semaphore = asyncio.Semaphore(PHOTO_DOWNLOAD_CONCURRENCY)
+
+def resolve_photo_timestamp(full_image_path, filename_with_suffix, username, bot_timestamp,
+                            resolution=None, content_hash=None, known_timestamp=None):
+    """
+    Returns (timestamp to record, OCR result or None) for a stored photo. The timestamp is the OCR result
+    (or the earlier result for a duplicate), else bot_timestamp, in which case the photo is also recorded
+    in missed_timestamps.
+    """
+    image_bytes = pop_downloaded_image(filename_with_suffix) # None หลังรีสตาร์ทหรือตอน retry -> อ่านจากดิสก์
+    if known_timestamp:
+        return known_timestamp, None # รูปซ้ำ ใช้ผล OCR เดิม
+    with metrics_manager.timed("process_photo_stage_seconds", stage="ocr"):
+        ocr_timestamp = extract_timestamp_from_image_ocr(full_image_path, username=username, resolution=resolution,
+                                                         image_bytes=image_bytes)
+    if ocr_timestamp is None:
+        sqlite_manager.insert_missed_timestamp_record(filename_with_suffix, bot_timestamp)
+        metrics_manager.increment("ocr_missed_total")
+        return bot_timestamp, None # OCR อ่านไม่ได้ ใช้ bot_timestamp แทน
+    return ocr_timestamp, ocr_timestamp
+
+def remember_ocr_timestamp(username, content_hash, ocr_timestamp):
+    """
+    Stores the OCR result in the photo's dedup record so a resent copy can reuse it. Called only once the
+    row is saved: a dedup record with a timestamp is taken as final (see dedup_manager.find_duplicate).
+    """
+    if ocr_timestamp and content_hash:
+        dedup_manager.set_extracted_timestamp(username, content_hash, ocr_timestamp)
+
+def send_message_from_thread(loop, bot_instance, chat_id, text):
+    async def send_reply_async():
+        await bot_instance.send_message(chat_id=chat_id, text=text)
+    
+    asyncio.run_coroutine_threadsafe(send_reply_async(), loop)
 
-# --- Process Photo Thread Target (Main logic for saving, no OCR) ---
-def process_photo_thread_target(loop, bot_instance, file_path_no_filename, filename_with_suffix, username, bot_timestamp, chat_id):
+def process_photo_thread_target(loop, bot_instance, file_path_no_filename, filename_with_suffix, username, bot_timestamp, chat_id,
+                                resolution=None, content_hash=None, known_timestamp=None):
     logging.info(f"[THREAD] Starting processing for {filename_with_suffix} from {username}")
     
     full_image_path = os.path.join(file_path_no_filename, filename_with_suffix) 
-    extracted_image_timestamp = bot_timestamp # ใช้ bot_timestamp เป็น extracted_image_timestamp
+    extracted_image_timestamp, ocr_timestamp = resolve_photo_timestamp(full_image_path, filename_with_suffix, username,
+                                                                       bot_timestamp, resolution=resolution,
+                                                                       content_hash=content_hash, known_timestamp=known_timestamp)
     
     try:
         # Save data to local Excel only (Google Sheets integration removed)
-        excel_manager.append_to_local_excel(
-            username, bot_timestamp, filename_with_suffix, extracted_image_timestamp,
-            current_datetime=datetime.now(),
-            base_folder=EXCEL_BASE_FOLDER
-        )
+        with metrics_manager.timed("process_photo_stage_seconds", stage="excel_append"):
+            excel_manager.append_to_local_excel(
+                username, bot_timestamp, filename_with_suffix, extracted_image_timestamp,
+                current_datetime=datetime.now(),
+                base_folder=EXCEL_BASE_FOLDER
+            )
+        remember_ocr_timestamp(username, content_hash, ocr_timestamp)
 
         reply_message = f"✅ บันทึกข้อมูลเรียบร้อยแล้ว\nชื่อไฟล์: {filename_with_suffix}\n"
         reply_message += f"เวลาที่บันทึก: {extracted_image_timestamp}"
-            
-        async def send_reply_async():
-            await bot_instance.send_message(chat_id=chat_id, text=reply_message)
-        
-        asyncio.run_coroutine_threadsafe(send_reply_async(), loop)
+        send_message_from_thread(loop, bot_instance, chat_id, reply_message)
 
     except Exception as e:
         logging.error(f"[THREAD] ❌ Error saving data for '{filename_with_suffix}': {e}")
-        async def send_error_reply_async():
-            await bot_instance.send_message(chat_id=chat_id, text="❌ เกิดข้อผิดพลาดในการบันทึกข้อมูล")
-        asyncio.run_coroutine_threadsafe(send_error_reply_async(), loop)
+        raise # ให้ job queue ลองใหม่ตาม backoff
         
     logging.info(f"[THREAD] Finished processing for {filename_with_suffix}")
 
+def process_photo_job(payload):
+    """
+    Job queue handler for PROCESS_PHOTO_JOB.
+    """
+    process_photo_thread_target(
+        bot_event_loop, bot_instance_for_jobs,
+        payload["file_path_no_filename"], payload["filename"], payload["username"],
+        payload["bot_timestamp"], payload["chat_id"], resolution=payload.get("resolution"),
+        content_hash=payload.get("content_hash"), known_timestamp=payload.get("known_timestamp")
+    )
+
+def process_album_job(payload):
+    """
+    Job queue handler for PROCESS_ALBUM_JOB: reads the timestamp of every photo in the album,
+    writes all rows to the ledger in one batch and sends one summary message.
+    """
+    username = payload["username"]
+    logging.info(f"[THREAD] Starting processing for album of {len(payload['items'])} photo(s) from {username}")
+
+    rows = []
+    ocr_timestamps = []  # (content_hash, OCR result) to store in the dedup records once the rows are saved
+    for item in payload["items"]:
+        full_image_path = os.path.join(item["file_path_no_filename"], item["filename"])
+        extracted_image_timestamp, ocr_timestamp = resolve_photo_timestamp(full_image_path, item["filename"], username,
+                                                                           item["bot_timestamp"],
+                                                                           resolution=item.get("resolution"),
+                                                                           content_hash=item.get("content_hash"),
+                                                                           known_timestamp=item.get("known_timestamp"))
+        rows.append((item["bot_timestamp"], item["filename"], extracted_image_timestamp))
+        ocr_timestamps.append((item.get("content_hash"), ocr_timestamp))
+
+    try:
+        with metrics_manager.timed("process_photo_stage_seconds", stage="excel_append"):
+            excel_manager.append_rows_to_local_excel(username, rows, current_datetime=datetime.now(), base_folder=EXCEL_BASE_FOLDER)
+    except Exception as e:
+        logging.error(f"[THREAD] ❌ Error saving album data for {username}: {e}")
+        raise # ให้ job queue ลองใหม่ตาม backoff
+    for content_hash, ocr_timestamp in ocr_timestamps:
+        remember_ocr_timestamp(username, content_hash, ocr_timestamp)
+
+    reply_message = f"✅ บันทึกข้อมูลเรียบร้อยแล้ว {len(rows)} รูป\n"
+    reply_message += "\n".join(f"{filename}: {extracted_image_timestamp}" for _, filename, extracted_image_timestamp in rows)
+    send_message_from_thread(bot_event_loop, bot_instance_for_jobs, payload["chat_id"], reply_message)
+    logging.info(f"[THREAD] Finished processing for album of {len(rows)} photo(s) from {username}")
+
+def process_photo_job_failed(payload, error):
+    """
+    Called by the job queue once a photo or album job has used up its retries.
+    The photos were never saved, so their dedup records are removed: sending them again is not a duplicate.
+    """
+    for item in payload.get("items", [payload]):
+        if item.get("content_hash") and item.get("known_timestamp") is None: # บันทึกไว้ใน remember_stored_photo
+            dedup_manager.forget_image(payload["username"], item["content_hash"], item["filename"])
+    async def send_error_reply_async():
+        await bot_instance_for_jobs.send_message(chat_id=payload["chat_id"], text="❌ เกิดข้อผิดพลาดในการบันทึกข้อมูล")
+    asyncio.run_coroutine_threadsafe(send_error_reply_async(), bot_event_loop)
+
 # --- Bot Handler Functions ---
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
@@ -253,17 +311,126 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "คำสั่งที่มี:\n"
         "/start - เริ่มต้นใช้งานบอท\n"
         "/help - แสดงคำสั่งนี้\n"
+        "/reloadusers - โหลดรายชื่อผู้ใช้ใหม่ (เฉพาะผู้ดูแล)\n"
+        "/stats [วัน] - จำนวนรูปที่บันทึกรายวัน (ผู้ดูแล: /stats <username|all> [วัน])\n"
+        "/history [จำนวน] - รายการรูปล่าสุด (ผู้ดูแล: /history <username> [จำนวน])\n"
+        "/report [จากวันที่] [ถึงวันที่] [user1,user2] [csv] [index] - รายงานรวมเป็นไฟล์เดียว (เฉพาะผู้ดูแล)\n"
         "คุณสามารถส่งรูปภาพที่มี Timestamp เพื่อให้บอทประมวลผลได้"
     )
     logging.info(f"User {update.message.from_user.username} (ID: {update.message.from_user.id}) issued /help command.")
 
+async def reload_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.message.from_user
+    username = user.username if user.username else str(user.id)
+    if not is_admin_user(username):
+        await update.message.reply_text("❌ คำสั่งนี้สำหรับผู้ดูแลระบบเท่านั้น")
+        logging.warning(f"🚫 Non-admin user tried /reloadusers: {username}")
+        return
+    allowed_users = auth_manager.reload_user_file(ALLOWED_USERS_FILE)
+    auth_manager.reload_user_file(ADMIN_USERS_FILE)
+    await update.message.reply_text(f"✅ โหลดรายชื่อผู้ใช้ใหม่แล้ว ({len(allowed_users)} คน)")
+    logging.info(f"User {username} (ID: {user.id}) reloaded allowed users.")
+
+def get_sender_username(message):
+    user = message.from_user
+    return user.username if user.username else str(user.id)
+
+async def download_photo_bytes(bot, photo):
+    waiting_since = time.perf_counter()
+    async with photo_download_semaphore: # จำกัดจำนวนการดาวน์โหลดพร้อมกัน (อัลบั้ม)
+        metrics_manager.observe("lock_wait_seconds", time.perf_counter() - waiting_since, lock="download_slot")
+        with metrics_manager.timed("handle_photo_stage_seconds", stage="download"):
+            file_obj = await bot.get_file(photo.file_id)
+            return bytes(await file_obj.download_as_bytearray())
+
+async def prepare_photo(username, chat_id, photo, image_bytes, now, album_hashes=None):
+    """
+    Checks a downloaded photo for duplicates and allocates its filename.
+    Returns (job payload, None) for a photo to store, or (None, reply text) when it is skipped.
+    album_hashes collects the content hashes already seen in the same album.
+    """
+    date_str = now.strftime("%Y-%m-%d")
+
+    content_hash = None
+    perceptual_hash = None
+    known_timestamp = None
+    if DEDUP_ENABLED:
+        with metrics_manager.timed("handle_photo_stage_seconds", stage="dedup"):
+            content_hash, perceptual_hash, duplicate = await asyncio.to_thread(find_duplicate_photo, username, image_bytes)
+        if album_hashes is not None:
+            if content_hash in album_hashes:
+                return None, "⚠️ ภาพนี้ซ้ำกับภาพอื่นในอัลบั้มเดียวกัน ไม่ได้บันทึกซ้ำ"
+            album_hashes.add(content_hash)
+        if duplicate is not None:
+            logging.info(f"♻️ Duplicate photo from {username}: same as '{duplicate['image_filename']}'")
+            metrics_manager.increment("photos_duplicate_total")
+            if DEDUP_MODE == "flag":
+                reply_message = f"⚠️ ภาพนี้เคยส่งแล้ว ไม่ได้บันทึกซ้ำ\nชื่อไฟล์เดิม: {duplicate['image_filename']}"
+                if duplicate["extracted_timestamp"]:
+                    reply_message += f"\nเวลาที่บันทึก: {duplicate['extracted_timestamp']}"
+                return None, reply_message
+            known_timestamp = duplicate["extracted_timestamp"] # DEDUP_MODE == "store": บันทึกซ้ำแต่ไม่ต้อง OCR ใหม่
+
+    user_folder_path = os.path.join(IMAGE_FOLDER, username)
+    date_folder_path = os.path.join(user_folder_path, date_str)
+
+    os.makedirs(date_folder_path, exist_ok=True)
+    logging.info(f"Ensured directory exists: {date_folder_path}")
+
+    with metrics_manager.timed("handle_photo_stage_seconds", stage="allocate_filename"):
+        filename_with_suffix = sequence_manager.allocate_daily_filename(date_folder_path, username, date_str, MAX_DAILY_IMAGES)
+    
+    if not filename_with_suffix:
+        logging.error(f"Exceeded max daily images for {username} on {date_str}.")
+        return None, f"❌ เก็บภาพไม่สำเร็จ: เกินจำนวนสูงสุด {MAX_DAILY_IMAGES} ภาพในวันเดียวกัน"
+
+    payload = {
+        "file_path_no_filename": date_folder_path,
+        "filename": filename_with_suffix,
+        "username": username,
+        "bot_timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "chat_id": chat_id,
+        "resolution": ocr_manager.get_resolution_key(photo.width, photo.height),
+        "content_hash": content_hash,
+        "perceptual_hash": perceptual_hash,
+        "known_timestamp": known_timestamp,
+    }
+    return payload, None
+
+def remember_stored_photo(payload, image_bytes):
+    """
+    Called once the photo is on disk: makes it known to the dedup cache and keeps its bytes for the OCR job.
+    """
+    if payload["content_hash"] is not None and payload["known_timestamp"] is None:
+        dedup_manager.remember_image(payload["username"], payload["content_hash"], payload["perceptual_hash"],
+                                     payload["filename"])
+    if SHARD_COUNT <= 1: # shard worker process อ่านรูปจากดิสก์ ไม่เห็นหน่วยความจำของ process นี้
+        buffer_downloaded_image(payload["filename"], image_bytes)
+
+async def submit_photo_job(job_type, payload, filenames, message):
+    try:
+        with metrics_manager.timed("handle_photo_stage_seconds", stage="submit_job"):
+            await asyncio.to_thread(job_queue_manager.submit_job, job_type, payload,
+                                    partition_key=payload["username"], timeout=JOB_SUBMIT_TIMEOUT_SECONDS)
+    except job_queue_manager.JobQueueFull:
+        for filename in filenames:
+            pop_downloaded_image(filename)
+        # รูปถูกบันทึกลงดิสก์แล้ว จะถูกประมวลผลโดย resume ในการเริ่มระบบครั้งถัดไป
+        logging.warning(f"Job queue full, {filenames} left for resume.")
+        await message.reply_text("⚠️ ระบบกำลังมีงานค้างจำนวนมาก รูปภาพถูกเก็บไว้แล้วและจะประมวลผลภายหลัง")
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.media_group_id:
+        collect_album_photo(update, context) # รูปในอัลบั้มจะถูกประมวลผลพร้อมกันทีเดียว
+        return
+
     logging.info("📸 Received a photo message.")
+    received_at = time.perf_counter()
+    metrics_manager.increment("photos_received_total", kind="single")
     
-    user = update.message.from_user
-    username = user.username if user.username else str(user.id)
+    username = get_sender_username(update.message)
     chat_id = update.message.chat_id
-    logging.info(f"👤 Photo from user: {username} (ID: {user.id})")
+    logging.info(f"👤 Photo from user: {username} (ID: {update.message.from_user.id})")
 
     allowed_users = load_allowed_users()
     if username.lower() not in allowed_users:
@@ -272,52 +439,402 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     photo = update.message.photo[-1]
-    
     now = datetime.now()
-    date_str = now.strftime("%Y-%m-%d")
 
-    user_folder_path = os.path.join(IMAGE_FOLDER, username)
-    date_folder_path = os.path.join(user_folder_path, date_str)
+    try:
+        image_bytes = await download_photo_bytes(context.bot, photo)
+        logging.info(f"📥 Downloaded {len(image_bytes)} bytes from {username}")
+    except Exception as e:
+        logging.error(f"❌ Error downloading photo from '{username}': {e}")
+        await update.message.reply_text("❌ โหลดภาพล้มเหลว")
+        return
 
-    os.makedirs(date_folder_path, exist_ok=True)
-    logging.info(f"Ensured directory exists: {date_folder_path}")
+    payload, skip_message = await prepare_photo(username, chat_id, photo, image_bytes, now)
+    if payload is None:
+        await update.message.reply_text(skip_message)
+        return
 
-    base_filename_prefix = f"{username}-log{date_str}"
+    filename_with_suffix = payload["filename"]
+    full_download_path = os.path.join(payload["file_path_no_filename"], filename_with_suffix)
     
-    filename_with_suffix = None
-    for i in range(1, MAX_DAILY_IMAGES + 1):
-        suffix = f"{i:06}"
-        temp_filename = f"{base_filename_prefix}-{suffix}.jpg"
-        temp_file_path = os.path.join(date_folder_path, temp_filename)
-        if not os.path.exists(temp_file_path):
-            filename_with_suffix = temp_filename
-            break
-    
-    if not filename_with_suffix:
-        await update.message.reply_text(
-                f"❌ เก็บภาพไม่สำเร็จ: เกินจำนวนสูงสุด {MAX_DAILY_IMAGES} ภาพในวันเดียวกัน"
+    try:
+        # เขียนไฟล์ลงดิสก์ใน thread แยก พร้อมกับตอบกลับผู้ใช้
+        await asyncio.gather(
+            asyncio.to_thread(write_image_file, full_download_path, image_bytes),
+            send_acknowledgement(update.message, "ได้รับรูปภาพแล้ว กำลังประมวลผล...", received_at)
         )
-        logging.error(f"Exceeded max daily images for {username} on {date_str}.")
+        logging.info(f"💾 Saved file to {full_download_path}")
+    except Exception as e:
+        logging.error(f"❌ Error saving file '{filename_with_suffix}': {e}")
+        await update.message.reply_text("❌ โหลดภาพล้มเหลว")
+        return
+
+    await asyncio.to_thread(remember_stored_photo, payload, image_bytes)
+    await submit_photo_job(PROCESS_PHOTO_JOB, payload, [filename_with_suffix], update.message)
+
+# --- Albums (media groups) ---
+# Telegram ส่งรูปในอัลบั้มมาเป็นข้อความแยกกันที่มี media_group_id เดียวกัน
+# รวบรวมไว้จนไม่มีรูปใหม่เข้ามา ALBUM_COLLECT_SECONDS แล้วประมวลผลเป็นชุดเดียว: ตอบรับครั้งเดียว สรุปผลครั้งเดียว
+pending_albums = {}  # (chat_id, media_group_id) -> {"messages": [...], "last_seen": loop time}
+
+def collect_album_photo(update, context):
+    message = update.message
+    metrics_manager.increment("photos_received_total", kind="album")
+    key = (message.chat_id, message.media_group_id)
+    now = asyncio.get_running_loop().time()
+    album = pending_albums.get(key)
+    if album is None:
+        album = pending_albums[key] = {"messages": [], "last_seen": now, "received_at": time.perf_counter()}
+        context.application.create_task(process_album_when_complete(key, context.bot), update=update)
+    album["messages"].append(message)
+    album["last_seen"] = now
+
+async def process_album_when_complete(key, bot):
+    loop = asyncio.get_running_loop()
+    while True:
+        remaining = pending_albums[key]["last_seen"] + ALBUM_COLLECT_SECONDS - loop.time()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(remaining)
+    album = pending_albums.pop(key)
+    await handle_album(sorted(album["messages"], key=lambda m: m.message_id), bot, album["received_at"])
+
+async def handle_album(messages, bot, received_at):
+    """
+    Handles all photos of one album: concurrent downloads, files written in parallel,
+    one acknowledgement, and a single PROCESS_ALBUM_JOB whose rows are saved in one batch.
+    """
+    first_message = messages[0]
+    username = get_sender_username(first_message)
+    chat_id = first_message.chat_id
+    logging.info(f"🖼️ Received an album of {len(messages)} photo(s) from {username}")
+
+    allowed_users = load_allowed_users()
+    if username.lower() not in allowed_users:
+        await first_message.reply_text("❌ คุณไม่ได้รับอนุญาตให้ส่งภาพเข้าเก็บระบบ")
+        logging.warning(f"🚫 Unauthorized user tried to send an album: {username}")
+        return
+
+    now = datetime.now()
+    downloads = await asyncio.gather(*(download_photo_bytes(bot, message.photo[-1]) for message in messages),
+                                     return_exceptions=True)
+
+    stored = []  # (payload, image_bytes)
+    notes = []
+    album_hashes = set()
+    for number, (message, image_bytes) in enumerate(zip(messages, downloads), start=1):
+        if isinstance(image_bytes, Exception):
+            logging.error(f"❌ Error downloading album photo {number} from '{username}': {image_bytes}")
+            notes.append(f"รูปที่ {number}: ❌ โหลดภาพล้มเหลว")
+            continue
+        payload, skip_message = await prepare_photo(username, chat_id, message.photo[-1], image_bytes, now, album_hashes)
+        if payload is None:
+            notes.append(f"รูปที่ {number}: {skip_message}")
+        else:
+            stored.append((payload, image_bytes))
+
+    if not stored:
+        await first_message.reply_text("\n".join(notes))
+        return
+
+    write_results = await asyncio.gather(
+        *(asyncio.to_thread(write_image_file, os.path.join(payload["file_path_no_filename"], payload["filename"]), image_bytes)
+          for payload, image_bytes in stored),
+        return_exceptions=True
+    )
+    written = []
+    for (payload, image_bytes), result in zip(stored, write_results):
+        if isinstance(result, Exception):
+            logging.error(f"❌ Error saving file '{payload['filename']}': {result}")
+            notes.append(f"{payload['filename']}: ❌ บันทึกไฟล์ล้มเหลว")
+        else:
+            written.append((payload, image_bytes))
+    logging.info(f"💾 Saved {len(written)} album photo(s) from {username}")
+
+    reply_message = f"ได้รับรูปภาพ {len(written)} รูปแล้ว กำลังประมวลผล..."
+    if notes:
+        reply_message += "\n" + "\n".join(notes)
+    await send_acknowledgement(first_message, reply_message, received_at)
+    if not written:
+        return
+
+    for payload, image_bytes in written:
+        await asyncio.to_thread(remember_stored_photo, payload, image_bytes)
+    filenames = [payload["filename"] for payload, _ in written]
+    album_payload = {
+        "username": username,
+        "chat_id": chat_id,
+        "items": [payload for payload, _ in written],
+        "filenames": filenames, # ให้ resume รู้ว่ารูปเหล่านี้ยังค้างอยู่ในคิว
+    }
+    await submit_photo_job(PROCESS_ALBUM_JOB, album_payload, filenames, first_message)
+
+def register_metrics_gauges():
+    metrics_manager.register_gauge("job_queue_depth", job_queue_manager.get_queue_depth)
+    metrics_manager.register_gauge("job_workers_active", job_queue_manager.get_active_job_count)
+    metrics_manager.register_gauge("excel_pending_rows", excel_manager.get_pending_row_count)
+    metrics_manager.register_gauge("sqlite_pending_writes", sqlite_manager.get_pending_write_count)
+    metrics_manager.register_gauge("buffered_images", lambda: len(downloaded_image_bytes))
+    metrics_manager.register_gauge("pending_albums", lambda: len(pending_albums))
+    if SHARD_COUNT > 1:
+        metrics_manager.register_gauge("shard_workers_alive", shard_manager.get_alive_count)
+
+def parse_report_args(args):
+    """
+    Parses /report arguments: [YYYY-MM-DD [YYYY-MM-DD]] [user1,user2] [csv] [index], in any order after the dates.
+    Only YYYY-MM-DD arguments are dates, so numeric-ID usernames are kept as usernames.
+    Returns (start_date, end_date, usernames or None, extension, source). Raises ValueError on a bad date.
+    """
+    dates = [report_manager.parse_date(arg) for arg in args if re.fullmatch(r"\d{4}-\d{2}-\d{2}", arg)]
+    others = [arg for arg in args if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", arg)]
+    keywords = {arg.lower() for arg in others} & {"csv", "index"}
+    extension = "csv" if "csv" in keywords else "xlsx"
+    source = "index" if "index" in keywords else "excel"
+    usernames = [name.strip() for arg in others if arg.lower() not in keywords for name in arg.split(",") if name.strip()]
+
+    end_date = dates[1] if len(dates) > 1 else datetime.now().date()
+    start_date = dates[0] if dates else end_date - timedelta(days=REPORT_DEFAULT_DAYS - 1)
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    return start_date, end_date, usernames or None, extension, source
+
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.message.from_user
+    username = user.username if user.username else str(user.id)
+    if not is_admin_user(username):
+        await update.message.reply_text("❌ คำสั่งนี้สำหรับผู้ดูแลระบบเท่านั้น")
+        logging.warning(f"🚫 Non-admin user tried /report: {username}")
         return
 
-    full_download_path = os.path.join(date_folder_path, filename_with_suffix)
-    
     try:
-        file_obj = await context.bot.get_file(photo.file_id)
-        await file_obj.download_to_drive(full_download_path)
-        logging.info(f"📥 Downloaded file to {full_download_path}")
-        await update.message.reply_text("ได้รับรูปภาพแล้ว กำลังประมวลผล...")
+        start_date, end_date, usernames, extension, source = parse_report_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text("❌ รูปแบบไม่ถูกต้อง ใช้: /report [YYYY-MM-DD] [YYYY-MM-DD] [user1,user2] [csv] [index]")
+        return
+
+    logging.info(f"User {username} (ID: {user.id}) requested a report {start_date}..{end_date} for {usernames or 'all users'}.")
+    await update.message.reply_text(f"⏳ กำลังสร้างรายงาน {start_date} ถึง {end_date}...")
+
+    report_filename = report_manager.get_report_filename(start_date, end_date, extension)
+    report_path = os.path.join(REPORT_FOLDER, f"{update.message.chat_id}-{update.message.message_id}-{report_filename}")
+    try:
+        with metrics_manager.timed("report_seconds"):
+            row_count = await asyncio.to_thread(report_manager.build_report, EXCEL_BASE_FOLDER, report_path,
+                                                start_date, end_date, usernames, source)
+        if row_count == 0:
+            await update.message.reply_text("ไม่พบข้อมูลในช่วงวันที่ที่เลือก")
+            return
+        if os.path.getsize(report_path) > REPORT_MAX_UPLOAD_BYTES:
+            await update.message.reply_text("❌ รายงานมีขนาดใหญ่เกินกว่าจะส่งผ่าน Telegram กรุณาเลือกช่วงวันที่ให้สั้นลง หรือใช้ report_manager.py")
+            return
+        with open(report_path, "rb") as f:
+            await update.message.reply_document(document=f, filename=report_filename,
+                                                caption=f"📊 รายงาน {start_date} ถึง {end_date}: {row_count} รายการ")
     except Exception as e:
-        logging.error(f"❌ Error downloading file '{filename_with_suffix}': {e}")
-        await update.message.reply_text("❌ โหลดภาพล้มเหลว")
+        logging.error(f"❌ Error building report for {username}: {e}")
+        await update.message.reply_text("❌ สร้างรายงานไม่สำเร็จ")
+    finally:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+
+def parse_query_args(args, default_number, max_number):
+    """
+    Parses /stats and /history arguments: [username|all] [number].
+    Only a last all-digit argument no longer than max_number is the number; any other argument is a username,
+    since users without a Telegram username are stored by numeric ID (@123 forces a username).
+    Returns (target username or None, number clamped to 1..max_number).
+    """
+    args = list(args)
+    number = default_number
+    if args and args[-1].isdigit() and len(args[-1]) <= len(str(max_number)):
+        number = min(max(int(args.pop()), 1), max_number)
+    names = [arg.lstrip("@") for arg in args]
+    return (names[0] if names else None), number
+
+async def resolve_query_target(update, command, target):
+    """
+    Returns the username a /stats or /history request may look at, or None after replying with the reason.
+    Allowed users see only their own records; admins may name any user (or "all").
+    """
+    username = get_sender_username(update.message)
+    if target is None or target.lower() == username.lower():
+        if username.lower() in load_allowed_users() or is_admin_user(username):
+            return username
+        await update.message.reply_text("❌ คุณไม่ได้รับอนุญาตให้ใช้คำสั่งนี้")
+        logging.warning(f"🚫 Unauthorized user tried /{command}: {username}")
+        return None
+    if not is_admin_user(username):
+        await update.message.reply_text("❌ ดูข้อมูลของผู้ใช้อื่นได้เฉพาะผู้ดูแลระบบ")
+        logging.warning(f"🚫 Non-admin user {username} tried /{command} for '{target}'")
+        return None
+    return target
+
+def format_user_stats(username, days):
+    today = datetime.now().date()
+    start_day = (today - timedelta(days=days - 1)).isoformat()
+    daily_counts = sqlite_manager.get_daily_image_counts(username, start_day, today.isoformat())
+    if not daily_counts:
+        return f"ไม่พบรูปของ {username} ใน {days} วันล่าสุด"
+    lines = [f"📈 {username} ({days} วันล่าสุด)"]
+    for day, photos, ocr_missed, first_bot_timestamp, last_bot_timestamp in daily_counts:
+        lines.append(f"{day}: {photos} รูป (OCR ไม่ได้ {ocr_missed}) {first_bot_timestamp[11:16]}-{last_bot_timestamp[11:16]}")
+    lines.append(f"รวม {sum(row[1] for row in daily_counts)} รูป, ล่าสุด {daily_counts[-1][4]}")
+    return "\n".join(lines)
+
+def format_all_stats(days):
+    today = datetime.now().date()
+    start_day = (today - timedelta(days=days - 1)).isoformat()
+    totals = sqlite_manager.get_image_count_totals(start_day, today.isoformat())
+    if not totals:
+        return f"ไม่พบรูปใน {days} วันล่าสุด"
+    lines = [f"📈 ผู้ใช้ทั้งหมด ({days} วันล่าสุด): {sum(row[1] for row in totals)} รูป จาก {len(totals)} คน"]
+    for username, photos, ocr_missed, last_bot_timestamp in totals[:STATS_MAX_USERS_SHOWN]:
+        lines.append(f"{username}: {photos} รูป (OCR ไม่ได้ {ocr_missed}) ล่าสุด {last_bot_timestamp}")
+    if len(totals) > STATS_MAX_USERS_SHOWN:
+        lines.append(f"... และอีก {len(totals) - STATS_MAX_USERS_SHOWN} คน")
+    return "\n".join(lines)
+
+def format_user_history(username, limit):
+    history = sqlite_manager.get_image_history(username, limit)
+    if not history:
+        return f"ไม่พบรูปของ {username}"
+    lines = [f"🕘 {len(history)} รูปล่าสุดของ {username}"]
+    for bot_timestamp, image_filename, extracted_timestamp in history:
+        lines.append(f"{bot_timestamp}  {image_filename}  (ในภาพ: {extracted_timestamp or '-'})")
+    return "\n".join(lines)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    target, days = parse_query_args(context.args or [], STATS_DEFAULT_DAYS, STATS_MAX_DAYS)
+    target = await resolve_query_target(update, "stats", target)
+    if target is None:
         return
+    with metrics_manager.timed("query_seconds", command="stats"):
+        if target.lower() == "all":
+            text = await asyncio.to_thread(format_all_stats, days)
+        else:
+            text = await asyncio.to_thread(format_user_stats, target, days)
+    await update.message.reply_text(text)
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    target, limit = parse_query_args(context.args or [], HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT)
+    target = await resolve_query_target(update, "history", target)
+    if target is None:
+        return
+    with metrics_manager.timed("query_seconds", command="history"):
+        text = await asyncio.to_thread(format_user_history, target, limit)
+    await update.message.reply_text(text)
+
+def register_job_handlers():
+    job_queue_manager.register_job_handler(PROCESS_PHOTO_JOB, process_photo_job, on_failure=process_photo_job_failed)
+    job_queue_manager.register_job_handler(PROCESS_ALBUM_JOB, process_album_job, on_failure=process_photo_job_failed)
+    resume_manager.register_resume_job_handler(
+        extract_timestamp_func=extract_timestamp_from_image_ocr,
+        insert_missed_record_func=sqlite_manager.insert_missed_timestamp_record,
+        save_data_to_local_excel_func=excel_manager.save_data_to_local_excel_only,
+        excel_base_folder_param=EXCEL_BASE_FOLDER
+    )
+
+async def post_init(application):
+    """
+    Runs once the bot's event loop is up: starts the job workers (unless they run in shard worker
+    processes) and resumes unprocessed images in the background so polling is not delayed.
+    """
+    global bot_event_loop, bot_instance_for_jobs
+    bot_event_loop = asyncio.get_running_loop()
+    bot_instance_for_jobs = application.bot
 
-    bot_timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    if SHARD_COUNT <= 1:
+        register_job_handlers()
+        job_queue_manager.start_workers(JOB_WORKER_COUNT)
 
-    current_loop = asyncio.get_event_loop()
-    thread = threading.Thread(target=process_photo_thread_target, 
-                              args=(current_loop, context.bot, date_folder_path, filename_with_suffix, username, bot_timestamp, chat_id))
-    thread.start()
+    # --- Resume Unprocessed Tasks ---
+    threading.Thread(target=resume_manager.resume_unprocessed_tasks_init,
+                     args=(IMAGE_FOLDER, EXCEL_BASE_FOLDER),
+                     name="resume-scan", daemon=True).start()
+
+def drain_background_work():
+    """
+    Lets the jobs in progress finish (at most SHUTDOWN_DRAIN_SECONDS), then writes every pending
+    ledger row into its workbook and commits the queued SQLite writes.
+    """
+    logging.info(f"Draining in-flight jobs (up to {SHUTDOWN_DRAIN_SECONDS}s) before shutdown...")
+    if SHARD_COUNT > 1:
+        # worker แต่ละตัวรองานของตัวเองภายใน SHUTDOWN_DRAIN_SECONDS แล้วเขียน Excel ก่อนออก
+        shard_manager.stop_shard_workers()
+    else:
+        job_queue_manager.stop_workers(timeout=SHUTDOWN_DRAIN_SECONDS)
+    excel_manager.stop_write_behind_flusher()
+    sqlite_manager.stop_batch_writer()
+    ocr_manager.stop_ocr_pool()
+    logging.info("Background work drained.")
+
+async def post_stop(application):
+    """
+    Runs after polling has stopped (SIGTERM, SIGINT) and PTB has finished the updates in progress,
+    while the event loop still runs, so the replies of the drained jobs can still be sent.
+    """
+    await asyncio.to_thread(drain_background_work)
+
+# --- Shard Worker Process (SHARD_COUNT > 1) ---
+SHARD_WORKER_SETTINGS = ("BOT_TOKEN", "BOT_API_BASE_URL", "BOT_CONNECTION_POOL_SIZE", "BOT_POOL_TIMEOUT_SECONDS",
+                         "BOT_READ_TIMEOUT_SECONDS", "ML_FEEDBACK_DB", "JOB_QUEUE_DB", "LOG_FILENAME", "LOG_LEVEL",
+                         "JOB_WORKER_COUNT", "OCR_ENABLED", "OCR_TIMEOUT_SECONDS", "TESSERACT_CMD_PATH", "OCR_BACKEND",
+                         "EXCEL_BASE_FOLDER", "METRICS_DUMP_FILE", "METRICS_DUMP_INTERVAL_SECONDS", "SHARD_COUNT",
+                         "SHUTDOWN_DRAIN_SECONDS")
+
+def get_shard_worker_settings():
+    """
+    The configuration a shard worker needs, taken from this process (it may differ from the defaults
+    a freshly spawned process would import).
+    """
+    return {name: globals()[name] for name in SHARD_WORKER_SETTINGS}
+
+def run_shard_worker(shard_index, shard_count, wake_signal, stop_signal, settings):
+    """
+    Entry point of one shard worker process. Runs the jobs of the users that hash to this shard,
+    with its own Excel writers, SQLite batch writer, OCR pool and Bot client for the replies,
+    until the front process asks it to stop or goes away.
+    """
+    global bot_event_loop, bot_instance_for_jobs
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    globals().update(settings)
+    logging_manager.setup_logging(log_filename=shard_manager.get_shard_filename(LOG_FILENAME, shard_index), level=LOG_LEVEL,
+                                  force=True)
+    shard_manager.handle_stop_signals(stop_signal)
+    logging.info(f"Shard worker {shard_index}/{shard_count} starting (pid {os.getpid()}).")
+
+    sqlite_manager.initialize_sqlite_db(ML_FEEDBACK_DB)
+    sqlite_manager.start_batch_writer()
+    if OCR_ENABLED:
+        ocr_manager.start_ocr_pool(pool_size=max(1, ocr_manager.OCR_POOL_SIZE // shard_count),
+                                   tesseract_cmd_path=TESSERACT_CMD_PATH, backend_name=OCR_BACKEND)
+    excel_manager.start_write_behind_flusher(
+        EXCEL_BASE_FOLDER, owns_user=lambda username: shard_manager.get_shard(username, shard_count) == shard_index)
+    job_queue_manager.configure_sharding(shard_count, shard_index=shard_index, wake_signal=wake_signal)
+    job_queue_manager.initialize_job_queue(JOB_QUEUE_DB)
+    if METRICS_DUMP_FILE:
+        metrics_manager.start_metrics_dump(shard_manager.get_shard_filename(METRICS_DUMP_FILE, shard_index),
+                                           METRICS_DUMP_INTERVAL_SECONDS)
+
+    bot_event_loop = asyncio.new_event_loop()
+    threading.Thread(target=bot_event_loop.run_forever, name="bot-replies", daemon=True).start()
+    bot_kwargs = {"base_url": f"{BOT_API_BASE_URL}/bot"} if BOT_API_BASE_URL else {}
+    bot_instance_for_jobs = Bot(BOT_TOKEN, request=HTTPXRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE,
+                                                                pool_timeout=BOT_POOL_TIMEOUT_SECONDS,
+                                                                read_timeout=BOT_READ_TIMEOUT_SECONDS), **bot_kwargs)
+    asyncio.run_coroutine_threadsafe(bot_instance_for_jobs.initialize(), bot_event_loop).result()
+    register_job_handlers()
+    job_queue_manager.start_workers(JOB_WORKER_COUNT)
+
+    shard_manager.wait_for_stop(stop_signal)
+    logging.info(f"Shard worker {shard_index} stopping.")
+    job_queue_manager.stop_workers(timeout=SHUTDOWN_DRAIN_SECONDS)
+    excel_manager.stop_write_behind_flusher()
+    sqlite_manager.stop_batch_writer()
+    ocr_manager.stop_ocr_pool()
+    asyncio.run_coroutine_threadsafe(bot_instance_for_jobs.shutdown(), bot_event_loop).result(timeout=10)
+    bot_event_loop.call_soon_threadsafe(bot_event_loop.stop)
 
 
 if __name__ == "__main__":
@@ -325,26 +842,63 @@ if __name__ == "__main__":
     
     # --- Initializations ---
     initialize_directories() # 
-    initialize_sqlite_db() # Initialize SQLite DB
-    
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    sqlite_manager.initialize_sqlite_db(ML_FEEDBACK_DB) # Initialize SQLite DB
+    sqlite_manager.start_batch_writer()
+    sqlite_manager.initialize_processed_index()
+    sqlite_manager.initialize_roi_stats()
+    sqlite_manager.initialize_image_hashes()
+    sqlite_manager.initialize_image_records()
+    sqlite_manager.initialize_storage_index()
+    startup_profiler.mark("initialize SQLite")
+    if OCR_ENABLED and SHARD_COUNT <= 1:
+        # Tesseract ถูกตั้งค่าใน initializer ของ worker แต่ละตัว process หลักไม่ต้องโหลด pytesseract
+        ocr_manager.start_ocr_pool(tesseract_cmd_path=TESSERACT_CMD_PATH, backend_name=OCR_BACKEND)
+        startup_profiler.mark("start OCR pool")
+    if SHARD_COUNT > 1:
+        # งาน, ไฟล์ Excel และ OCR ของผู้ใช้แต่ละคนอยู่ใน shard worker process ของผู้ใช้นั้น
+        job_queue_manager.configure_sharding(SHARD_COUNT, wake_signals=shard_manager.create_wake_signals(SHARD_COUNT))
+        job_queue_manager.initialize_job_queue(JOB_QUEUE_DB)
+        shard_manager.start_shard_workers(run_shard_worker, (get_shard_worker_settings(),))
+    else:
+        excel_manager.start_write_behind_flusher(EXCEL_BASE_FOLDER)
+        job_queue_manager.initialize_job_queue(JOB_QUEUE_DB)
+    if STORAGE_TIERING_ENABLED:
+        storage_manager.start_storage_tiering(IMAGE_FOLDER)
+    startup_profiler.mark("start Excel flusher + job queue")
+    register_metrics_gauges()
+    if METRICS_HTTP_PORT:
+        metrics_manager.start_metrics_server(METRICS_HTTP_PORT)
+    if METRICS_DUMP_FILE:
+        metrics_manager.start_metrics_dump(METRICS_DUMP_FILE, METRICS_DUMP_INTERVAL_SECONDS)
     
-    # --- Resume Unprocessed Tasks ---
-    resume_manager.resume_unprocessed_tasks_init(
-        bot_instance_param=application.bot,
-        image_folder_param=IMAGE_FOLDER,
-        excel_base_folder_param=EXCEL_BASE_FOLDER,
-        
-        extract_timestamp_func=extract_timestamp_from_image_ocr, # OCR function (จะคืนค่า None เพราะ OCR ถูกปิด)
-        insert_missed_record_func=insert_missed_timestamp_record,
-        # save_data_to_both_formats_func เปลี่ยนเป็น append_to_local_excel
-        save_data_to_local_excel_func=excel_manager.append_to_local_excel
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(BOT_CONNECTION_POOL_SIZE) # ใช้ร่วมกันทั้งการดาวน์โหลดรูปและการตอบกลับ
+        .pool_timeout(BOT_POOL_TIMEOUT_SECONDS)
+        .read_timeout(BOT_READ_TIMEOUT_SECONDS)
+        .media_write_timeout(BOT_MEDIA_WRITE_TIMEOUT_SECONDS)
+        .base_url(f"{BOT_API_BASE_URL}/bot" if BOT_API_BASE_URL else "https://api.telegram.org/bot")
+        .base_file_url(f"{BOT_API_BASE_URL}/file/bot" if BOT_API_BASE_URL else "https://api.telegram.org/file/bot")
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
     )
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("reloadusers", reload_users_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("report", report_command))
     
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     
+    startup_profiler.mark("build application")
+
+    if startup_profiler.is_report_requested():
+        print(startup_profiler.format_report()) # วัดเวลาเริ่มต้นแล้วออก ไม่เริ่ม polling
+        raise SystemExit(0)
+    startup_profiler.log_startup_time()
     logging.info("Bot is ready to poll for updates.")
     application.run_polling()
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+import threading
+
+# --- Authorization Cache ---
+# เก็บรายชื่อผู้ใช้ไว้ในหน่วยความจำ และโหลดไฟล์ใหม่เฉพาะเมื่อ mtime/size เปลี่ยน
+AUTH_RECHECK_SECONDS = 2 # ตรวจสอบไฟล์ซ้ำได้ไม่บ่อยกว่านี้ (สิทธิ์ที่แก้ไขจะมีผลภายในเวลานี้)
+
+_cache_lock = threading.Lock()
+_user_file_cache = {}  # filename -> {"users": set, "signature": (mtime_ns, size) or None, "checked_at": float}
+
+def load_user_file(filename):
+    """
+    Reads a one-username-per-line file into a lowercase set.
+    """
+    if not os.path.exists(filename):
+        logging.warning(f"'{filename}' not found. No users will be allowed unless created.")
+        return set()
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            users = {line.strip().lower() for line in f if line.strip()}
+        logging.info(f"Loaded {len(users)} users from '{filename}'.")
+        return users
+    except Exception as e:
+        logging.error(f"Error loading users from '{filename}': {e}")
+        return set()
+
+def _get_file_signature(filename):
+    try:
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def get_users(filename, force_reload=False):
+    """
+    Returns the cached user set for the file, reloading it only if the file changed
+    (checked at most every AUTH_RECHECK_SECONDS) or when force_reload is set.
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _user_file_cache.get(filename)
+        if entry is not None and not force_reload and now - entry["checked_at"] < AUTH_RECHECK_SECONDS:
+            return entry["users"]
+
+    signature = _get_file_signature(filename)
+    with _cache_lock:
+        entry = _user_file_cache.get(filename)
+        if entry is not None and not force_reload and entry["signature"] == signature:
+            entry["checked_at"] = now
+            return entry["users"]
+
+    users = load_user_file(filename)
+    with _cache_lock:
+        _user_file_cache[filename] = {"users": users, "signature": signature, "checked_at": now}
+    return users
+
+def is_user_in_file(username, filename):
+    """
+    In-memory membership check against a cached user file.
+    """
+    return username.lower() in get_users(filename)
+
+def reload_user_file(filename):
+    """
+    Forces the file to be re-read now (used by the admin reload command).
+    """
+    return get_users(filename, force_reload=True)
@@ -0,0 +1,328 @@
+"""
+End-to-end load test of the photo pipeline against a local fake Telegram Bot API.
+
+Run from the repository root:
+    python -m benchmarks.bench_end_to_end [--users 20 --rate 10 --duration 30 --album-ratio 0.2 --album-size 10
+                                           --workbook-rows 5000 --image-kb 300 --ocr --shards 4]
+
+A small HTTP server on 127.0.0.1 stands in for api.telegram.org: it answers getMe/getFile,
+serves the photo downloads and records every sendMessage. A real telegram.Bot pointed at it
+drives TelegrambotTimestamp.handle_photo with synthetic updates, so downloads, replies, the job
+queue, OCR (with --ocr) and the Excel ledger/flush all run exactly as in production, in a
+temporary working directory. Updates are handled one at a time, like the default Application.
+With --shards N the jobs run in N shard worker processes (SHARD_COUNT = N), which send their
+"saved" replies to the same fake API.
+
+Reported: stored photos/sec (until the last "saved" message), p50/p99 latency from an update
+arriving to its acknowledgement being sent (albums are measured from their first photo and
+include ALBUM_COLLECT_SECONDS), and peak RSS of the bot process and of its OCR workers.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import resource
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cv2
+import numpy as np
+
+FAKE_TOKEN = "123456:BENCHMARK"
+ACK_PREFIX = "ได้รับรูปภาพ"
+SAVED_PREFIX = "✅ บันทึกข้อมูลเรียบร้อยแล้ว"
+
+class FakeBotApi:
+    """Minimal Bot API: getMe, getFile, sendMessage and file downloads, served from memory."""
+    def __init__(self):
+        self.files = {}  # file_id -> bytes
+        self.sent = []   # (monotonic time, chat_id, text)
+        self.lock = threading.Lock()
+        self.message_id = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, so the bot's connection pool is exercised
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                file_id = os.path.splitext(os.path.basename(self.path))[0]
+                data = api.files.get(file_id)
+                if data is None:
+                    self._send(404, b"")
+                else:
+                    self._send(200, data, "image/jpeg")
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                params = {key: json.loads(values[0]) if values[0][:1] in "{[\"" else values[0]
+                          for key, values in parse_qs(body).items()}
+                method = self.path.rsplit("/", 1)[-1]
+                result = api.handle(method, params)
+                self._send(200, json.dumps({"ok": True, "result": result}).encode("utf-8"))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def handle(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                    "file_path": f"photos/{file_id}.jpg"}
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            with self.lock:
+                self.sent.append((time.monotonic(), chat_id, params["text"]))
+                self.message_id += 1
+                message_id = self.message_id
+            return {"message_id": message_id, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}
+        return True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+def make_base_photos(image_kb, count=4):
+    """A few JPEGs of roughly image_kb each, with a timestamp drawn in the bottom-right corner."""
+    rng = np.random.default_rng(0)
+    photos = []
+    side = 400
+    while True:
+        image = cv2.GaussianBlur(rng.integers(0, 256, size=(side * 3 // 4, side, 3), dtype=np.uint8), (5, 5), 0)
+        if len(cv2.imencode(".jpg", image)[1]) >= image_kb * 1024 or side >= 4000:
+            break
+        side += 200
+    for i in range(count):
+        image = cv2.GaussianBlur(rng.integers(0, 256, size=(side * 3 // 4, side, 3), dtype=np.uint8), (5, 5), 0)
+        height, width = image.shape[:2]
+        cv2.putText(image, f"12/05/2024 13:45:{10 + i:02d}", (int(width * 0.62), int(height * 0.95)),
+                    cv2.FONT_HERSHEY_SIMPLEX, width / 1000, (255, 255, 255), max(1, width // 500))
+        photos.append((cv2.imencode(".jpg", image)[1].tobytes(), width, height))
+    return photos
+
+def make_sends(args):
+    """[(start offset seconds, username, photo count)] for the whole run."""
+    rng = random.Random(1)
+    sends = []
+    offset = 0.0
+    photos = 0
+    total_photos = int(args.rate * args.duration)
+    while photos < total_photos:
+        count = args.album_size if rng.random() < args.album_ratio else 1
+        sends.append((offset, f"user{rng.randrange(args.users):03d}", count))
+        photos += count
+        offset += count / args.rate
+    return sends
+
+def prefill_workbooks(excel_manager, usernames, rows, base_folder):
+    if rows <= 0:
+        return
+    from datetime import datetime
+    from openpyxl import Workbook
+    now = datetime.now()
+    for username in usernames:
+        excel_file_path = excel_manager.get_local_excel_file_path(username, now, base_folder)
+        os.makedirs(os.path.dirname(excel_file_path), exist_ok=True)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(excel_manager.SHEET_NAME)
+        ws.append(excel_manager.HEADERS)
+        for i in range(rows):
+            ws.append([username, "2024-01-01 00:00:00", f"{username}-prefill-{i:06d}.jpg", "2024-01-01 00:00:00"])
+        wb.save(excel_file_path)
+
+async def run(args, workdir):
+    os.chdir(workdir)
+    from telegram import Bot, Update
+
+    api = FakeBotApi()
+    api.start()
+    usernames = [f"user{i:03d}" for i in range(args.users)]
+    with open("User.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(usernames))
+
+    import TelegrambotTimestamp as bot_module
+    import excel_manager, sqlite_manager, job_queue_manager, logging_manager, ocr_manager, shard_manager
+    logging_manager.set_log_level(args.log_level)
+    bot_module.OCR_ENABLED = args.ocr
+    bot_module.SHARD_COUNT = args.shards
+    bot_module.LOG_LEVEL = args.log_level
+    bot_module.BOT_TOKEN = FAKE_TOKEN
+    bot_module.BOT_API_BASE_URL = f"http://127.0.0.1:{api.port}"
+    bot_module.TESSERACT_CMD_PATH = args.tesseract_cmd
+
+    bot_module.initialize_directories()
+    sqlite_manager.initialize_sqlite_db(bot_module.ML_FEEDBACK_DB)
+    sqlite_manager.start_batch_writer()
+    sqlite_manager.initialize_processed_index()
+    sqlite_manager.initialize_roi_stats()
+    sqlite_manager.initialize_image_hashes()
+    sqlite_manager.initialize_image_records()
+    if args.ocr and args.shards <= 1:
+        ocr_manager.start_ocr_pool(tesseract_cmd_path=args.tesseract_cmd, backend_name=bot_module.OCR_BACKEND)
+    prefill_workbooks(excel_manager, usernames, args.workbook_rows, bot_module.EXCEL_BASE_FOLDER)
+    if args.shards > 1:
+        job_queue_manager.configure_sharding(args.shards, wake_signals=shard_manager.create_wake_signals(args.shards))
+        job_queue_manager.initialize_job_queue(bot_module.JOB_QUEUE_DB)
+        shard_manager.start_shard_workers(bot_module.run_shard_worker, (bot_module.get_shard_worker_settings(),))
+    else:
+        excel_manager.start_write_behind_flusher(bot_module.EXCEL_BASE_FOLDER)
+        job_queue_manager.initialize_job_queue(bot_module.JOB_QUEUE_DB)
+    bot_module.register_metrics_gauges()
+
+    base_url = f"http://127.0.0.1:{api.port}"
+    async with Bot(FAKE_TOKEN, base_url=f"{base_url}/bot", base_file_url=f"{base_url}/file/bot") as bot:
+        application = SimpleNamespace(bot=bot, create_task=lambda coro, update=None: asyncio.ensure_future(coro))
+        context = SimpleNamespace(bot=bot, application=application)
+        await bot_module.post_init(application)
+
+        base_photos = make_base_photos(args.image_kb)
+        sends = make_sends(args)
+        expected_photos = sum(count for _, _, count in sends)
+        print(f"{len(sends)} send(s), {expected_photos} photo(s) from {args.users} user(s) "
+              f"over ~{sends[-1][0]:.1f}s, photo ~{len(base_photos[0][0]) // 1024} KiB")
+
+        update_queue = asyncio.Queue()
+        ack_started = {}  # chat_id -> [arrival time of each send still waiting for its ack]
+
+        async def handle_updates():
+            while True:
+                update = await update_queue.get()
+                await bot_module.handle_photo(update, context)
+                update_queue.task_done()
+
+        consumer = asyncio.create_task(handle_updates())
+        started = time.monotonic()
+        update_id = 0
+        for send_number, (offset, username, count) in enumerate(sends):
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            chat_id = 1000 + usernames.index(username)
+            ack_started.setdefault(chat_id, []).append(time.monotonic())
+            for i in range(count):
+                update_id += 1
+                photo_bytes, width, height = base_photos[update_id % len(base_photos)]
+                file_id = f"photo{update_id}"
+                api.files[file_id] = photo_bytes + update_id.to_bytes(8, "big") # unique content, same image
+                update_queue.put_nowait(Update.de_json({
+                    "update_id": update_id,
+                    "message": {
+                        "message_id": update_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": username, "username": username},
+                        "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": width, "height": height,
+                                   "file_size": len(api.files[file_id])}],
+                        "media_group_id": f"album{send_number}" if count > 1 else None,
+                    },
+                }, bot))
+
+        deadline = time.monotonic() + args.drain_timeout
+        saved = 0
+        while time.monotonic() < deadline:
+            with api.lock:
+                saved = sum(_count_saved(text) for _, _, text in api.sent)
+            if saved >= expected_photos:
+                break
+            await asyncio.sleep(0.1)
+        consumer.cancel()
+
+    shard_manager.stop_shard_workers()
+    job_queue_manager.stop_workers()
+    excel_manager.stop_write_behind_flusher()
+    sqlite_manager.stop_batch_writer()
+    ocr_manager.stop_ocr_pool()
+    api.stop()
+
+    ack_latencies = []
+    last_saved_at = started
+    for sent_at, chat_id, text in api.sent:
+        if text.startswith(ACK_PREFIX) and ack_started.get(chat_id):
+            ack_latencies.append(sent_at - ack_started[chat_id].pop(0))
+        if _count_saved(text):
+            last_saved_at = max(last_saved_at, sent_at)
+    return expected_photos, saved, last_saved_at - started, ack_latencies
+
+def _count_saved(text):
+    if not text.startswith(SAVED_PREFIX):
+        return 0
+    first_line = text.split("\n", 1)[0]
+    parts = first_line[len(SAVED_PREFIX):].split()
+    return int(parts[0]) if parts and parts[0].isdigit() else 1 # album summary: "... N รูป"
+
+def _percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def _peak_rss_mib(who):
+    return resource.getrusage(who).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+def print_stage_timings():
+    """Per-stage histograms collected by metrics_manager during the run (bucket upper bounds)."""
+    import metrics_manager
+    print("stage timings (p50/p99 are histogram bucket bounds):")
+    for histogram in metrics_manager.snapshot()["histograms"]:
+        label = ",".join(f"{key}={value}" for key, value in histogram["labels"].items())
+        p50, p99 = histogram["p50"], histogram["p99"]
+        print(f"  {histogram['name'] + ('{' + label + '}' if label else ''):<58} n={histogram['count']:<6} "
+              f"avg {histogram['avg'] * 1000:8.1f} ms   p50 <= {p50 * 1000 if p50 else float('inf'):7.1f} ms   "
+              f"p99 <= {p99 * 1000 if p99 else float('inf'):7.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=10.0, help="photos per second, albums included")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--album-ratio", type=float, default=0.2, help="fraction of sends that are albums")
+    parser.add_argument("--album-size", type=int, default=10)
+    parser.add_argument("--workbook-rows", type=int, default=0, help="rows already in each user's weekly workbook")
+    parser.add_argument("--image-kb", type=int, default=300, help="approximate JPEG size")
+    parser.add_argument("--ocr", action="store_true", help="run OCR (needs Tesseract); off by default")
+    parser.add_argument("--shards", type=int, default=1, help="shard worker processes (1 = jobs run in the bot process)")
+    parser.add_argument("--tesseract-cmd", default="tesseract")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="max seconds to wait for all photos")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd()) # repository root, for the bot modules after chdir
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    expected, saved, elapsed, ack_latencies = asyncio.run(run(args, workdir))
+
+    print(f"stored {saved}/{expected} photo(s) in {elapsed:.2f}s: {saved / elapsed if elapsed else 0:.2f} photos/s")
+    print(f"ack latency ({len(ack_latencies)} acks): p50 {_percentile(ack_latencies, 0.5) * 1000:.1f} ms   "
+          f"p99 {_percentile(ack_latencies, 0.99) * 1000:.1f} ms   "
+          f"max {max(ack_latencies, default=float('nan')) * 1000:.1f} ms")
+    print(f"peak RSS: bot {_peak_rss_mib(resource.RUSAGE_SELF):.1f} MiB   "
+          f"child processes (largest) {_peak_rss_mib(resource.RUSAGE_CHILDREN):.1f} MiB")
+    print_stage_timings()
+    if args.keep:
+        print(f"working directory: {workdir}")
+    else:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
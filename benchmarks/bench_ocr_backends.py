@@ -0,0 +1,73 @@
+"""
+OCR throughput per backend on a local image corpus.
+
+Run from the repository root:
+    python -m benchmarks.bench_ocr_backends --corpus image_folder [--backends tesserocr,pytesseract] [--limit 200]
+
+Images are decoded up front, then each backend runs ocr_manager.ocr_image over
+the whole corpus in this process (the same code path one OCR pool worker runs).
+Reports images/sec, Tesseract calls/sec and how many images produced a timestamp.
+"""
+import os
+import time
+import argparse
+
+import cv2
+
+import ocr_manager
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def load_corpus(corpus_dir, limit):
+    paths = []
+    for root, _, files in os.walk(corpus_dir):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    images = []
+    for path in paths[:limit]:
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((path, image))
+    return images
+
+def run_backend(backend_name, images):
+    started = time.perf_counter()
+    ocr_manager._ocr_backend = ocr_manager.OCR_BACKENDS[backend_name]()
+    load_seconds = time.perf_counter() - started
+
+    calls = 0
+    hits = 0
+    started = time.perf_counter()
+    for path, image in images:
+        result = ocr_manager.ocr_image(image, path)
+        calls += len(result["tried_rois"])
+        hits += result["timestamp"] is not None
+    elapsed = time.perf_counter() - started
+    print(f"{backend_name:<12} load {load_seconds * 1000:7.1f} ms   "
+          f"{len(images) / elapsed:7.2f} images/s   {calls / elapsed:7.2f} calls/s   "
+          f"{hits}/{len(images)} timestamps")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="directory of sample photos (searched recursively)")
+    parser.add_argument("--backends", default="tesserocr,pytesseract")
+    parser.add_argument("--limit", type=int, default=200, help="maximum number of images")
+    parser.add_argument("--tesseract-cmd", default=ocr_manager.TESSERACT_CMD_PATH)
+    parser.add_argument("--tessdata", default=ocr_manager.TESSDATA_PATH, help="tessdata folder for tesserocr")
+    args = parser.parse_args()
+
+    ocr_manager.configure_tesseract(args.tesseract_cmd)
+    ocr_manager.TESSDATA_PATH = args.tessdata
+    images = load_corpus(args.corpus, args.limit)
+    if not images:
+        parser.error(f"no images found under '{args.corpus}'")
+    print(f"{len(images)} image(s) from '{args.corpus}'")
+
+    for backend_name in args.backends.split(","):
+        try:
+            run_backend(backend_name.strip(), images)
+        except Exception as e:
+            print(f"{backend_name:<12} unavailable: {e}")
+
+if __name__ == "__main__":
+    main()
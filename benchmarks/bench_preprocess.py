@@ -0,0 +1,102 @@
+"""
+Per-image latency and peak memory of OCR preprocessing, before and after the ROI-only pipeline.
+
+Run from the repository root:
+    python -m benchmarks.bench_preprocess [--width 4000 --height 3000 --runs 5]
+
+"legacy" is the previous preprocess_image_for_ocr applied to the whole frame
+(then cropped to every ROI). "roi-all" is the current pipeline: the deskew angle
+is estimated on a downscaled copy, then every ROI crop is preprocessed.
+"roi-first" stops after the first ROI, which is the steady-state case once the
+learned ROI order hits. Peak memory is measured with tracemalloc, which sees
+NumPy arrays (including OpenCV results) but not OpenCV-internal temporaries.
+"""
+import time
+import argparse
+import statistics
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import ocr_manager
+
+def legacy_preprocess_image_for_ocr(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    enhanced_gray = clahe.apply(gray)
+    blurred_image = cv2.GaussianBlur(enhanced_gray, (3, 3), 0)
+    thresh_image = cv2.adaptiveThreshold(blurred_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                         cv2.THRESH_BINARY_INV, 15, 5)
+
+    coords = np.column_stack(np.where(thresh_image > 0))
+    if coords.size > 0:
+        rect = cv2.minAreaRect(coords)
+        angle = rect[-1]
+        if angle < -45:
+            angle = -(90 + angle)
+        else:
+            angle = -angle
+        (h, w) = thresh_image.shape[:2]
+        center = (w // 2, h // 2)
+        M = cv2.getRotationMatrix2D(center, angle, 1.0)
+        thresh_image = cv2.warpAffine(thresh_image, M, (w, h),
+                                      flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+    kernel_dilate = np.ones((1,1), np.uint8)
+    kernel_erode = np.ones((1,1), np.uint8)
+    denoised_image = cv2.dilate(thresh_image, kernel_dilate, iterations=1)
+    denoised_image = cv2.erode(denoised_image, kernel_erode, iterations=1)
+    return denoised_image
+
+def make_photo(width, height):
+    """A noisy 'phone photo' with a timestamp stamped in the bottom-right corner."""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (31, 31), 0)
+    scale = width / 1000
+    cv2.putText(image, "12/05/2024 13:45:10", (int(width * 0.68), int(height * 0.94)),
+                cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), max(1, int(scale * 2)))
+    return image
+
+def run_legacy(image):
+    processed = legacy_preprocess_image_for_ocr(image)
+    for x, y, w, h in ocr_manager.find_timestamp_roi(image):
+        processed[y:y + h, x:x + w]
+
+def run_roi(image, roi_limit=None):
+    deskew_angle = ocr_manager.estimate_deskew_angle(image)
+    rois = ocr_manager.find_timestamp_roi(image)
+    for roi_index in ocr_manager.DEFAULT_ROI_ORDER[:roi_limit]:
+        x, y, w, h = rois[roi_index]
+        ocr_manager.preprocess_image_for_ocr(image[y:y + h, x:x + w], deskew_angle=deskew_angle)
+
+def measure(name, func, image, runs):
+    func(image) # warm-up (fills reusable buffers)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func(image)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    func(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} median {statistics.median(timings) * 1000:8.1f} ms   peak {peak / 2**20:8.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    image = make_photo(args.width, args.height)
+    print(f"Image {args.width}x{args.height}, {args.runs} run(s) each")
+    measure("legacy", run_legacy, image, args.runs)
+    measure("roi-all", run_roi, image, args.runs)
+    measure("roi-first", lambda img: run_roi(img, roi_limit=1), image, args.runs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Microbenchmark for timestamp_parser.
+
+Run from the repository root:
+    python -m benchmarks.bench_timestamp_parser [--seconds 2]
+
+The parser is timed over a corpus of OCR texts and parses/sec is reported.
+Correctness is covered by tests/test_timestamp_parser.py.
+"""
+import time
+import argparse
+
+import timestamp_parser
+
+# OCR texts: every supported format, plus noise and texts without a valid timestamp
+CORPUS = [
+    "12/05/2024 13:45:10",
+    "12-05-2024 13:45",
+    "12.05.2024 13:45:10",
+    "12/05/2567 13:45:10",
+    "2024-05-12 13:45:10",
+    "2024/05/12 13:45",
+    "2024.05.12 07:05",
+    "2024-05-12T01:02:03",
+    "05/13/2024 13:45:10",
+    "12/05/24 13:45:10",
+    "12-05-24 13:45",
+    "13:45:10 12/05/2024",
+    "13:45:10 12.05.2567",
+    "12 May 2024 10:11:12",
+    "3 Sept 2024 10:11",
+    "12/05/24 01:45 PM",
+    "12/05/24 12:05:09 AM",
+    "5 พ.ค. 2567 08:00:00",
+    "5 ม.ค. 2568 08:00",
+    "21 ธันวาคม 2567 17:30:00",
+    "12/05/2567 เวลา 13:45 น.",
+    "1/5/2567 เวลา 9:05 น.",
+    "GPS 13.7563N 100.5018E\n12/05/2024 13:45:10 Bangkok",
+    "Lat 13.75 ~ 2024-05-12 13:45:10 ~ note",
+    "99/99/2024 13:45:10 then 12/05/2024 13:45:10",
+    "12/05/2024 25:61:00",
+    "no timestamp here",
+    "",
+    "12/05/2024",
+    "13:45",
+]
+
+def benchmark(seconds):
+    parses = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for text in CORPUS:
+            timestamp_parser.parse_timestamp(text)
+        parses += len(CORPUS)
+    elapsed = time.perf_counter() - started
+    print(f"Parsed {parses} texts in {elapsed:.2f}s: {parses / elapsed:,.0f} parses/sec")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="benchmark duration")
+    args = parser.parse_args()
+    benchmark(args.seconds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import sqlite_manager
+
+# --- Duplicate Photo Detection ---
+# ตรวจรูปที่ผู้ใช้ส่งซ้ำ (forward ซ้ำ / ส่งใหม่หลัง timeout) จาก hash ของ bytes ที่ดาวน์โหลดมา
+DEDUP_CACHE_SIZE = 5000 # จำนวนรายการใน LRU ในหน่วยความจำ
+PERCEPTUAL_HASH_ENABLED = False # เปิดเพื่อจับรูปเดียวกันที่ถูกบีบอัดใหม่ (ต้อง decode รูปแบบย่อ)
+PERCEPTUAL_HASH_MAX_DISTANCE = 4 # จำนวนบิตที่ต่างกันได้สูงสุดของ dHash 64 บิต
+
+_cache_lock = threading.Lock()
+_cache = OrderedDict()  # (username, content_hash) -> record dict, most recently used last
+
+def compute_content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def compute_perceptual_hash(image_bytes):
+    """
+    64-bit difference hash (dHash) of the image, or None if it cannot be decoded.
+    Decodes at 1/8 scale, so it costs far less than a full decode.
+    """
+    import cv2
+    import numpy as np
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value - (1 << 63) # เก็บเป็น signed 64 บิตให้ลง SQLite INTEGER ได้
+
+def _hamming_distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+def _remember_in_cache(record):
+    key = (record["username"], record["content_hash"])
+    with _cache_lock:
+        _cache[key] = record
+        _cache.move_to_end(key)
+        while len(_cache) > DEDUP_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def find_duplicate(username, content_hash, perceptual_hash=None):
+    """
+    Returns the earlier record {"username", "content_hash", "perceptual_hash", "image_filename",
+    "extracted_timestamp"} for the same photo from this user, or None.
+    Exact matches are looked up in the LRU, then in SQLite; perceptual matches only among cached records.
+    A cached record still waiting for its OCR result is re-read from SQLite, where shard worker processes store it.
+    """
+    key = (username, content_hash)
+    with _cache_lock:
+        record = _cache.get(key)
+        if record is not None:
+            _cache.move_to_end(key)
+            if record["extracted_timestamp"] is not None:
+                return record
+        elif perceptual_hash is not None:
+            for (cached_username, _), cached in reversed(_cache.items()):
+                if (cached_username == username and cached["perceptual_hash"] is not None
+                        and _hamming_distance(cached["perceptual_hash"], perceptual_hash) <= PERCEPTUAL_HASH_MAX_DISTANCE):
+                    return cached
+
+    # ไม่อยู่ใน cache หรือยังไม่มีผล OCR: job อาจทำงานใน shard worker process ซึ่งบันทึกผลลง SQLite เท่านั้น
+    record = sqlite_manager.get_image_hash_record(username, content_hash)
+    if record is not None:
+        _remember_in_cache(record)
+    else:
+        with _cache_lock:
+            _cache.pop(key, None)
+    return record
+
+def remember_image(username, content_hash, perceptual_hash, image_filename):
+    """
+    Records a newly stored photo so later copies can be recognized.
+    """
+    record = {"username": username, "content_hash": content_hash, "perceptual_hash": perceptual_hash,
+              "image_filename": image_filename, "extracted_timestamp": None}
+    _remember_in_cache(record)
+    sqlite_manager.insert_image_hash_record(record)
+
+def forget_image(username, content_hash, image_filename):
+    """
+    Removes the record of a photo that was never saved (its job failed for good), so sending it again is
+    not flagged as a duplicate. Only a record that points at image_filename is removed.
+    """
+    key = (username, content_hash)
+    with _cache_lock:
+        record = _cache.get(key)
+        if record is not None and record["image_filename"] == image_filename:
+            del _cache[key]
+    sqlite_manager.delete_image_hash_record(username, content_hash, image_filename)
+
+def set_extracted_timestamp(username, content_hash, extracted_timestamp):
+    """
+    Stores the OCR result for a photo so a duplicate can reuse it instead of running OCR again.
+    """
+    with _cache_lock:
+        record = _cache.get((username, content_hash))
+        if record is not None:
+            record["extracted_timestamp"] = extracted_timestamp
+    sqlite_manager.update_image_hash_timestamp(username, content_hash, extracted_timestamp)
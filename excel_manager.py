@@ -1,10 +1,51 @@
 import os
+import io
+import csv
+import zlib
+import queue
+import zipfile
+import atexit
 import logging
 import threading
 from datetime import datetime
-from openpyxl import Workbook, load_workbook
 
-excel_lock = threading.Lock() 
+import sqlite_manager
+import metrics_manager
+
+SHEET_NAME = "ImageMetadata"
+HEADERS = ["ID (username)", "Bot Timestamp", "Image Log Name", "Extracted Image Timestamp"]
+
+# --- Write-behind Configuration ---
+# แถวใหม่จะถูกเขียนลง ledger (append-only) ทันที แล้วค่อยรวมเข้าไฟล์ Excel เป็นชุด
+LEDGER_SUFFIX = ".ledger.csv"
+LEDGER_OFFSET_SUFFIX = ".ledger.offset"
+# workbook ที่สร้างจาก ledger ตั้งแต่แรกเก็บ offset ไว้ในไฟล์ด้วย (บันทึกพร้อมแถวในการ save ครั้งเดียวกัน)
+# workbook เก่าที่มีแถวก่อนมี ledger ไม่มี property นี้ ใช้ offset จากไฟล์ .ledger.offset อย่างเดียว
+LEDGER_OFFSET_PROPERTY = "LedgerOffset"
+LEDGER_COVERED_MARK = "covered" # ใน .ledger.offset: ledger มีทุกแถวของ workbook สร้างใหม่จาก ledger ได้ถ้าไฟล์เสีย
+CORRUPT_WORKBOOK_SUFFIX = ".corrupt"
+WRITE_BEHIND_ENABLED = True
+FLUSH_INTERVAL_SECONDS = 30
+FLUSH_ROW_THRESHOLD = 200
+
+# --- Writer Pool Configuration ---
+# งานเขียนไฟล์ Excel ถูกแบ่ง shard ตาม path ของ workbook ทำให้ผู้ใช้คนละคนเขียนพร้อมกันได้
+WRITER_POOL_SIZE = min(8, os.cpu_count() or 1)
+
+_locks_guard = threading.Lock()
+_workbook_locks = {}  # excel_file_path -> Lock around the .xlsx file
+_ledger_locks = {}  # excel_file_path -> Lock around the ledger file
+
+_pending_lock = threading.Lock()
+_pending_rows = {}  # excel_file_path -> number of ledger rows not yet in the workbook
+_scheduled_flushes = set()  # excel_file_path already queued on a writer shard
+
+_writer_queues = []
+_writer_threads = []
+
+_flush_event = threading.Event()
+_stop_event = threading.Event()
+_flusher_thread = None
 
 # --- Local Excel File Path and Initialization ---
 def get_local_excel_file_path(username, current_datetime, base_folder):
@@ -14,77 +55,461 @@ def get_local_excel_file_path(username, current_datetime, base_folder):
     """
     year = current_datetime.year
     week_number = current_datetime.isocalendar()[1]
-    
+
     user_excel_folder = os.path.join(base_folder, username)
-    os.makedirs(user_excel_folder, exist_ok=True) 
+    os.makedirs(user_excel_folder, exist_ok=True)
 
     excel_filename_weekly = f"{year}-W{week_number:02d}-{username}.xlsx"
     full_path = os.path.join(user_excel_folder, excel_filename_weekly)
     return full_path
 
-def initialize_local_excel_file(username, current_datetime, base_folder):
+def get_workbook_lock(excel_file_path):
     """
-    Initializes the Excel file for a specific user and week, if it doesn't exist.
+    Returns the lock that guards reads and writes of one weekly Excel file.
     """
-    excel_file_path = get_local_excel_file_path(username, current_datetime, base_folder)
-    sheet_name = "ImageMetadata"
-
-    with excel_lock: # Use Lock to prevent concurrent file access
-        if not os.path.exists(excel_file_path):
-            try:
-                wb = Workbook()
-                ws = wb.active
-                ws.title = sheet_name
-                ws.append(["ID (username)", "Bot Timestamp", "Image Log Name", "Extracted Image Timestamp"])
-                wb.save(excel_file_path)
-                logging.info(f"New local Excel file '{excel_file_path}' created with '{sheet_name}' sheet and headers.")
-            except Exception as e:
-                logging.error(f"Failed to create local Excel file '{excel_file_path}': {e}")
+    with _locks_guard:
+        lock = _workbook_locks.get(excel_file_path)
+        if lock is None:
+            lock = _workbook_locks[excel_file_path] = threading.Lock()
+        return lock
+
+def _get_ledger_lock(excel_file_path):
+    with _locks_guard:
+        lock = _ledger_locks.get(excel_file_path)
+        if lock is None:
+            lock = _ledger_locks[excel_file_path] = threading.Lock()
+        return lock
+
+def get_ledger_file_path(excel_file_path):
+    """
+    Returns the append-only ledger path that backs a weekly Excel file.
+    Format: base_folder/username/YYYY-WNN-username.xlsx.ledger.csv
+    """
+    return excel_file_path + LEDGER_SUFFIX
+
+def _get_ledger_offset_path(excel_file_path):
+    return excel_file_path + LEDGER_OFFSET_SUFFIX
+
+def _open_or_create_workbook(excel_file_path):
+    """
+    Loads the workbook (or creates a new one) and makes sure the ImageMetadata sheet and headers exist.
+    A truncated workbook whose rows all come from its ledger is moved aside and a new one is started
+    at ledger offset 0, so the whole ledger is replayed into it. Any other load error is raised:
+    the file may hold rows the ledger does not have (older versions, hand edits).
+    Caller must hold the workbook lock.
+    """
+    from openpyxl import Workbook, load_workbook # loaded on first flush, not at startup
+    from openpyxl.packaging.custom import IntProperty
+    from openpyxl.utils.exceptions import InvalidFileException
+    wb = None
+    if os.path.exists(excel_file_path):
+        try:
+            wb = load_workbook(excel_file_path)
+        except (zipfile.BadZipFile, InvalidFileException) as e:
+            if not _is_covered_by_ledger(excel_file_path):
+                logging.error(f"❌ Local Excel file '{excel_file_path}' is unreadable ({e}) and holds rows that are not "
+                              f"in its ledger, so it is not rebuilt automatically. Restore it, or move it away to "
+                              f"rebuild it from the ledger.")
+                raise
+            corrupt_path = f"{excel_file_path}{CORRUPT_WORKBOOK_SUFFIX}-{datetime.now():%Y%m%d%H%M%S}"
+            os.replace(excel_file_path, corrupt_path)
+            logging.error(f"❌ Local Excel file '{excel_file_path}' is unreadable ({e}); moved to '{corrupt_path}', "
+                          f"rebuilding it from its ledger.")
+            metrics_manager.increment("excel_workbooks_rebuilt_total")
+
+    if wb is None:
+        wb = Workbook()
+        ws = wb.active
+        ws.title = SHEET_NAME
+        ws.append(HEADERS)
+        wb.custom_doc_props.append(IntProperty(name=LEDGER_OFFSET_PROPERTY, value=0))
+        logging.info(f"New local Excel file '{excel_file_path}' created with '{SHEET_NAME}' sheet and headers.")
+        return wb
+
+    if SHEET_NAME not in wb.sheetnames:
+        ws = wb.create_sheet(SHEET_NAME)
+        ws.append(HEADERS)
+        logging.info(f"Created new sheet '{SHEET_NAME}' in local Excel '{excel_file_path}' with headers.")
+    else:
+        ws = wb[SHEET_NAME]
+        headers = [cell.value for cell in ws[1]]
+        if "Extracted Image Timestamp" not in headers:
+            ws.cell(row=1, column=len(headers) + 1, value="Extracted Image Timestamp")
+            logging.info(f"Added 'Extracted Image Timestamp' column to '{SHEET_NAME}' in local Excel '{excel_file_path}'.")
+    return wb
+
+# --- Ledger Functions ---
+def _append_to_ledger(excel_file_path, rows):
+    """
+    Appends rows to the workbook's ledger with one write and one fsync.
+    Cost is constant no matter how many rows the week already has.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    data = buffer.getvalue().encode("utf-8")
+
+    with metrics_manager.timed_lock(_get_ledger_lock(excel_file_path), "ledger"):
+        with metrics_manager.timed("excel_stage_seconds", stage="ledger_append"):
+            with open(get_ledger_file_path(excel_file_path), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        with _pending_lock:
+            _pending_rows[excel_file_path] = _pending_rows.get(excel_file_path, 0) + len(rows)
+            return _pending_rows[excel_file_path]
+
+def _read_ledger_offset_file(excel_file_path):
+    try:
+        with open(_get_ledger_offset_path(excel_file_path), "r", encoding="utf-8") as f:
+            return f.read().split()
+    except FileNotFoundError:
+        return []
+
+def _read_ledger_offset(excel_file_path):
+    try:
+        return int(_read_ledger_offset_file(excel_file_path)[0])
+    except (IndexError, ValueError):
+        return 0
+
+def _is_covered_by_ledger(excel_file_path):
+    """
+    True if the workbook was last saved with a LedgerOffset property, i.e. every row in it came from its ledger.
+    Read from the .ledger.offset file, so it is known even when the workbook itself cannot be opened.
+    """
+    return LEDGER_COVERED_MARK in _read_ledger_offset_file(excel_file_path)[1:]
+
+def _write_ledger_offset(excel_file_path, offset, covered=False):
+    with open(_get_ledger_offset_path(excel_file_path), "w", encoding="utf-8") as f:
+        f.write(f"{offset} {LEDGER_COVERED_MARK}" if covered else str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+def _get_workbook_ledger_offset(wb, excel_file_path):
+    """
+    Ledger offset the workbook's rows correspond to. Workbooks that predate the ledger have no
+    LedgerOffset property and use the .ledger.offset file.
+    """
+    if LEDGER_OFFSET_PROPERTY in wb.custom_doc_props.names:
+        return int(wb.custom_doc_props[LEDGER_OFFSET_PROPERTY].value)
+    return _read_ledger_offset(excel_file_path)
+
+def _save_workbook(wb, excel_file_path, ledger_offset=None):
+    """
+    Saves the workbook atomically: written to a temporary file, fsynced, then swapped in with os.replace,
+    so a crash leaves either the old or the new file, never a truncated one.
+    With ledger_offset, the offset is stored in the same save as the rows it covers (only in workbooks
+    that have the property, i.e. were built from the ledger).
+    """
+    if ledger_offset is not None and LEDGER_OFFSET_PROPERTY in wb.custom_doc_props.names:
+        wb.custom_doc_props[LEDGER_OFFSET_PROPERTY].value = ledger_offset
+    temp_path = excel_file_path + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            wb.save(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, excel_file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _read_ledger_tail(excel_file_path, offset):
+    """
+    Reads complete ledger rows written after the given byte offset.
+    Returns (rows, new_offset). A partially written last line is left for the next flush.
+    """
+    ledger_path = get_ledger_file_path(excel_file_path)
+    if not os.path.exists(ledger_path):
+        return [], offset
+
+    with open(ledger_path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+    end = data.rfind(b"\n")
+    if end < 0:
+        return [], offset
+    data = data[:end + 1]
+    rows = [row for row in csv.reader(io.StringIO(data.decode("utf-8"), newline="")) if row]
+    return rows, offset + len(data)
+
+def iter_ledger_rows(ledger_path):
+    """
+    Yields every complete row stored in a ledger file (materialized or not).
+    """
+    try:
+        with open(ledger_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                if row:
+                    yield row
+    except FileNotFoundError:
+        return
+
+def read_unflushed_rows(excel_file_path, wb=None):
+    """
+    Returns the ledger rows that are not in the .xlsx yet. Caller must hold the workbook lock.
+    Pass the workbook when it is already open, so the offset saved in it is used.
+    """
+    offset = _get_workbook_ledger_offset(wb, excel_file_path) if wb is not None else _read_ledger_offset(excel_file_path)
+    rows, _ = _read_ledger_tail(excel_file_path, offset)
+    return rows
+
+def _record_flushed_rows(rows):
+    """
+    Records the ledger rows a flush is about to move past the ledger offset in the processed index.
+    A job that crashed after its ledger append but before its own record_saved_images commit is then
+    still seen as saved when it is replayed, although its row is no longer in the unflushed tail.
+    """
+    sqlite_manager.record_saved_images([(row[0], row[1], row[2], row[3] if len(row) > 3 and row[3] else None)
+                                        for row in rows if len(row) > 2])
+
+def flush_workbook(excel_file_path):
+    """
+    Materializes pending ledger rows into the weekly Excel file with a single load/save cycle.
+    In a workbook built from the ledger, the rows and the ledger offset they reach are saved together,
+    so after a crash at any point a restart appends exactly the ledger tail that is not in it yet.
+    """
+    with metrics_manager.timed_lock(get_workbook_lock(excel_file_path), "workbook"):
+        if not _read_ledger_tail(excel_file_path, _read_ledger_offset(excel_file_path))[0]:
+            with _pending_lock:
+                _pending_rows.pop(excel_file_path, None)
+            return 0
+
+        try:
+            with metrics_manager.timed("excel_stage_seconds", stage="load_workbook"):
+                wb = _open_or_create_workbook(excel_file_path)
+            # ไฟล์ .ledger.offset อาจตามหลัง workbook ถ้าล่มหลัง save ใช้ offset ใน workbook เป็นหลัก
+            rows, new_offset = _read_ledger_tail(excel_file_path, _get_workbook_ledger_offset(wb, excel_file_path))
+            ws = wb[SHEET_NAME]
+            for row in rows:
+                ws.append(row)
+            if rows:
+                # แถวที่พ้น offset ไปแล้ว _drop_already_saved_rows ไม่เห็นใน ledger tail จึงต้องอยู่ใน processed index ก่อน
+                _record_flushed_rows(rows)
+                with metrics_manager.timed("excel_stage_seconds", stage="save_workbook"):
+                    _save_workbook(wb, excel_file_path, ledger_offset=new_offset)
+            _write_ledger_offset(excel_file_path, new_offset, covered=LEDGER_OFFSET_PROPERTY in wb.custom_doc_props.names)
+            metrics_manager.increment("excel_rows_flushed_total", len(rows))
+        except Exception as e:
+            logging.error(f"❌ Local Excel flush error for '{excel_file_path}': {e}")
+            return 0
+
+    with _pending_lock:
+        remaining = _pending_rows.get(excel_file_path, 0) - len(rows)
+        if remaining > 0:
+            _pending_rows[excel_file_path] = remaining
         else:
-            try:
-                wb = load_workbook(excel_file_path)
-                if sheet_name not in wb.sheetnames:
-                    ws = wb.create_sheet(sheet_name)
-                    ws.append(["ID (username)", "Bot Timestamp", "Image Log Name", "Extracted Image Timestamp"])
-                    logging.info(f"Created new sheet '{sheet_name}' in local Excel '{excel_file_path}' with headers.")
-                else:
-                    ws = wb[sheet_name]
-                    headers = [cell.value for cell in ws[1]]
-                    if "Extracted Image Timestamp" not in headers:
-                        ws.cell(row=1, column=len(headers) + 1, value="Extracted Image Timestamp")
-                        logging.info(f"Added 'Extracted Image Timestamp' column to '{sheet_name}' in local Excel '{excel_file_path}'.")
-                wb.save(excel_file_path)
-            except Exception as e:
-                logging.warning(f"Could not initialize sheet '{sheet_name}' in local Excel '{excel_file_path}': {e}")
+            _pending_rows.pop(excel_file_path, None)
+
+    logging.info(f"✅ Flushed {len(rows)} record(s) into local Excel file: '{excel_file_path}'.")
+    return len(rows)
+
+# --- Sharded Writer Pool ---
+def _get_writer_shard(excel_file_path):
+    """
+    Maps a workbook path to a fixed writer shard, so one workbook is always written by the same thread.
+    """
+    return zlib.crc32(excel_file_path.encode("utf-8")) % len(_writer_queues)
+
+def _writer_loop(work_queue):
+    while True:
+        excel_file_path = work_queue.get()
+        try:
+            if excel_file_path is None:
+                return
+            with _pending_lock:
+                _scheduled_flushes.discard(excel_file_path)
+            flush_workbook(excel_file_path)
+        except Exception as e:
+            logging.error(f"❌ Excel writer error for '{excel_file_path}': {e}")
+        finally:
+            work_queue.task_done()
+
+def start_writer_pool(pool_size=None):
+    """
+    Starts the fixed pool of Excel writer threads.
+    """
+    if _writer_threads:
+        return
+    pool_size = pool_size or WRITER_POOL_SIZE
+    for i in range(pool_size):
+        work_queue = queue.Queue()
+        thread = threading.Thread(target=_writer_loop, args=(work_queue,), name=f"excel-writer-{i}", daemon=True)
+        _writer_queues.append(work_queue)
+        _writer_threads.append(thread)
+        thread.start()
+    logging.info(f"Excel writer pool started with {pool_size} shard(s).")
+
+def stop_writer_pool():
+    """
+    Lets every writer finish its queued flushes, then stops the pool.
+    """
+    for work_queue in _writer_queues:
+        work_queue.put(None)
+    for thread in _writer_threads:
+        thread.join()
+    _writer_queues.clear()
+    _writer_threads.clear()
+
+def schedule_flush(excel_file_path):
+    """
+    Queues a flush of one workbook on its writer shard (inline when the pool is not running).
+    """
+    if not _writer_queues:
+        flush_workbook(excel_file_path)
+        return
+    with _pending_lock:
+        if excel_file_path in _scheduled_flushes:
+            return
+        _scheduled_flushes.add(excel_file_path)
+    _writer_queues[_get_writer_shard(excel_file_path)].put(excel_file_path)
+
+def flush_all_pending(wait=False):
+    """
+    Flushes every workbook that still has rows waiting in its ledger.
+    With wait=True, blocks until the writer shards have finished.
+    """
+    with _pending_lock:
+        paths = list(_pending_rows)
+    for excel_file_path in paths:
+        schedule_flush(excel_file_path)
+    if wait:
+        for work_queue in list(_writer_queues):
+            work_queue.join()
+
+def get_pending_row_count():
+    """
+    Returns how many ledger rows are waiting to be flushed into their workbooks.
+    """
+    with _pending_lock:
+        return sum(_pending_rows.values())
+
+def _discover_unflushed_ledgers(base_folder, owns_user=None):
+    """
+    Finds ledgers with rows past their saved offset (e.g. after a crash) and marks them pending.
+    With owns_user, only the folders of users it returns True for are considered.
+    """
+    if not os.path.isdir(base_folder):
+        return
+    for user_dir in os.listdir(base_folder):
+        user_path = os.path.join(base_folder, user_dir)
+        if not os.path.isdir(user_path) or (owns_user is not None and not owns_user(user_dir)):
+            continue
+        for name in os.listdir(user_path):
+            if not name.endswith(LEDGER_SUFFIX):
+                continue
+            excel_file_path = os.path.join(user_path, name[:-len(LEDGER_SUFFIX)])
+            if os.path.getsize(os.path.join(user_path, name)) > _read_ledger_offset(excel_file_path):
+                with _pending_lock:
+                    _pending_rows.setdefault(excel_file_path, 1)
+
+def _flusher_loop():
+    while not _stop_event.is_set():
+        _flush_event.wait(timeout=FLUSH_INTERVAL_SECONDS)
+        _flush_event.clear()
+        flush_all_pending()
+
+def start_write_behind_flusher(base_folder, owns_user=None):
+    """
+    Starts the writer pool and the background thread that periodically builds the weekly
+    Excel files from their ledgers. Any rows left unflushed by a previous run are picked up on the first pass
+    (only for users owns_user accepts, when given: a shard worker process owns just its users' workbooks).
+    """
+    global _flusher_thread
+    if _flusher_thread is not None:
+        return
+    start_writer_pool()
+    _discover_unflushed_ledgers(base_folder, owns_user)
+    _flusher_thread = threading.Thread(target=_flusher_loop, name="excel-flusher", daemon=True)
+    _flusher_thread.start()
+    _flush_event.set()
+    logging.info(f"Excel write-behind flusher started (interval={FLUSH_INTERVAL_SECONDS}s, threshold={FLUSH_ROW_THRESHOLD} rows).")
+
+def stop_write_behind_flusher():
+    """
+    Stops the flusher thread and writes out everything still pending.
+    """
+    global _flusher_thread
+    if _flusher_thread is not None:
+        _stop_event.set()
+        _flush_event.set()
+        _flusher_thread.join()
+        _flusher_thread = None
+    flush_all_pending(wait=True)
+    stop_writer_pool()
+
+atexit.register(stop_write_behind_flusher)
 
 # --- Append Data Functions ---
+def _drop_already_saved_rows(excel_file_path, rows):
+    """
+    Leaves out ledger rows whose filename is already saved, in the processed index or in the
+    not-yet-flushed ledger tail. A job replayed after a crash (or one that ran past the shutdown
+    deadline) may already have appended its rows; they must not be appended twice.
+    """
+    saved = sqlite_manager.get_processed_filenames(row[2] for row in rows)
+    with _get_ledger_lock(excel_file_path):
+        tail_rows, _ = _read_ledger_tail(excel_file_path, _read_ledger_offset(excel_file_path))
+    saved.update(row[2] for row in tail_rows if len(row) > 2)
+    return [row for row in rows if row[2] not in saved]
+
 def append_to_local_excel(username, bot_timestamp, filename, extracted_image_timestamp_str, current_datetime, base_folder):
     """
-    Appends image metadata to the correct weekly Excel file for the user.
-    It will first ensure the Excel file exists and is initialized.
+    Appends image metadata for the user's weekly Excel file.
+    The row is made durable in the ledger right away; the .xlsx itself is rebuilt in batches
+    by the flusher, or immediately when write-behind is disabled.
     """
     excel_file_path = get_local_excel_file_path(username, current_datetime, base_folder)
-    
-    initialize_local_excel_file(username, current_datetime, base_folder)
 
-    with excel_lock:
-        try:
-            wb = load_workbook(excel_file_path)
-            ws = wb["ImageMetadata"]
-            ws.append([username, bot_timestamp, filename, extracted_image_timestamp_str])
-            wb.save(excel_file_path)
-            logging.info(f"✅ Inserted record for '{filename}' into local Excel file: '{excel_file_path}'.")
-        except Exception as e:
-            logging.error(f"❌ Local Excel write error for '{filename}' to '{excel_file_path}': {e}")
+    row = [username, bot_timestamp, filename, extracted_image_timestamp_str]
+    try:
+        if _drop_already_saved_rows(excel_file_path, [row]):
+            pending = _append_to_ledger(excel_file_path, [row])
+            logging.info(f"✅ Recorded '{filename}' in ledger for local Excel file: '{excel_file_path}'.")
+        else:
+            pending = 0
+            logging.info(f"'{filename}' is already in the ledger for '{excel_file_path}', not appended again.")
+    except Exception as e:
+        logging.error(f"❌ Local Excel write error for '{filename}' to '{excel_file_path}': {e}")
+        raise
+
+    # ให้ resume ไม่ต้องเปิดไฟล์ Excel ทุกไฟล์ และใช้ตอบ /stats และ /history; commit ก่อน job ถูกลบออกจากคิว
+    sqlite_manager.record_saved_images([(username, bot_timestamp, filename, extracted_image_timestamp_str)])
 
+    if not WRITE_BEHIND_ENABLED or _flusher_thread is None or pending >= FLUSH_ROW_THRESHOLD:
+        schedule_flush(excel_file_path)
 
-# 
+def append_rows_to_local_excel(username, rows, current_datetime, base_folder):
+    """
+    Batch version of append_to_local_excel for an album: rows are (bot_timestamp, filename,
+    extracted_image_timestamp_str) tuples, written to the ledger with a single fsync.
+    """
+    excel_file_path = get_local_excel_file_path(username, current_datetime, base_folder)
+
+    try:
+        new_rows = _drop_already_saved_rows(excel_file_path, [[username, *row] for row in rows])
+        pending = _append_to_ledger(excel_file_path, new_rows) if new_rows else 0
+        logging.info(f"✅ Recorded {len(new_rows)} row(s) in ledger for local Excel file: '{excel_file_path}'.")
+        if len(new_rows) < len(rows):
+            logging.info(f"{len(rows) - len(new_rows)} row(s) already in the ledger for '{excel_file_path}', not appended again.")
+    except Exception as e:
+        logging.error(f"❌ Local Excel write error for {len(rows)} row(s) to '{excel_file_path}': {e}")
+        raise
+
+    sqlite_manager.record_saved_images([(username, *row) for row in rows])
+
+    if not WRITE_BEHIND_ENABLED or _flusher_thread is None or pending >= FLUSH_ROW_THRESHOLD:
+        schedule_flush(excel_file_path)
+
+
+#
 def save_data_to_local_excel_only(username, bot_timestamp, filename, extracted_image_timestamp_str, excel_base_folder):
     """
     Saves data to local Excel file only.
     """
     current_dt = datetime.now()
-    
+
     append_to_local_excel(
         username, bot_timestamp, filename, extracted_image_timestamp_str,
         current_datetime=current_dt,
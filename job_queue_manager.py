@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import metrics_manager
+import shard_manager
+
+# --- Job Queue Configuration ---
+# คิวงานแบบถาวร (SQLite) ใช้แทนการสร้าง Thread ใหม่ต่อรูปภาพ งานที่ค้างอยู่จะไม่หายเมื่อโปรแกรมล่ม
+JOB_QUEUE_DB = "job_queue.db"
+WORKER_COUNT = min(8, (os.cpu_count() or 1) * 2)
+MAX_OUTSTANDING_JOBS = 1000 # จำนวนงานสูงสุดที่ค้างในคิวได้ ก่อน submit จะต้องรอ (backpressure)
+RESERVED_LIVE_JOBS = 100 # ช่องที่กันไว้ให้รูปที่ผู้ใช้ส่งเข้ามา งานเบื้องหลัง (resume) ใช้ได้ไม่เกิน MAX_OUTSTANDING_JOBS - ค่านี้
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY_SECONDS = 2
+RETRY_MAX_DELAY_SECONDS = 300
+IDLE_POLL_SECONDS = 1.0
+CLAIM_SCAN_LIMIT = 200
+
+class JobQueueFull(Exception):
+    """Raised by submit_job when the queue stays full for longer than the given timeout."""
+
+_handlers = {}  # job_type -> (handler, on_failure)
+_local = threading.local()
+_condition = threading.Condition()
+_outstanding = 0  # pending + running jobs
+_running_partitions = set()
+_active_jobs = 0  # jobs currently inside a handler
+_workers = []
+_stop_event = threading.Event()
+
+# --- Sharding (SHARD_COUNT > 1) ---
+# process หน้าบ้าน submit อย่างเดียวและปลุก shard ปลายทาง ส่วน worker process แต่ละตัวรับเฉพาะงานใน shard ของตัวเอง
+_shard_count = 1
+_shard_index = None  # None = this process runs jobs of every shard
+_shard_wake_signals = []  # front process: one semaphore per shard, released on submit
+_wake_signal = None  # worker process: released by the front when a job for this shard is submitted
+
+def _get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(JOB_QUEUE_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def configure_sharding(shard_count, shard_index=None, wake_signals=None, wake_signal=None):
+    """
+    Call before initialize_job_queue. The front process passes one wake signal per shard and runs no jobs;
+    a shard worker process passes its shard_index and the event it is woken with.
+    """
+    global _shard_count, _shard_index, _shard_wake_signals, _wake_signal
+    _shard_count = shard_count
+    _shard_index = shard_index
+    _shard_wake_signals = list(wake_signals or [])
+    _wake_signal = wake_signal
+
+def _jobs_run_elsewhere():
+    return bool(_shard_wake_signals)
+
+def initialize_job_queue(db_path=None):
+    """
+    Creates the jobs table and puts jobs left 'running' by a previous (crashed) run back to 'pending'.
+    A shard worker only recovers its own shard; the front process re-assigns every waiting job to
+    its shard for the current shard count.
+    """
+    global JOB_QUEUE_DB, _outstanding
+    if db_path:
+        JOB_QUEUE_DB = db_path
+    conn = _get_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            partition_key TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_run_at REAL NOT NULL,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_id ON jobs (status, id)")
+    if "shard" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+        conn.execute("ALTER TABLE jobs ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_shard_status_id ON jobs (shard, status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_shard_status_partition_id ON jobs (shard, status, partition_key, id)")
+    if _shard_index is None:
+        recovered = conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'").rowcount
+        conn.create_function("shard_of", 1, lambda key: shard_manager.get_shard(key, _shard_count), deterministic=True)
+        conn.execute("UPDATE jobs SET shard = shard_of(partition_key) WHERE status = 'pending'")
+        pending_sql, pending_args = "SELECT COUNT(*) FROM jobs WHERE status = 'pending'", ()
+    else:
+        recovered = conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running' AND shard = ?",
+                                 (_shard_index,)).rowcount
+        pending_sql, pending_args = "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND shard = ?", (_shard_index,)
+    with _condition:
+        _outstanding = conn.execute(pending_sql, pending_args).fetchone()[0]
+    logging.info(f"Job queue '{JOB_QUEUE_DB}' initialized: {_outstanding} pending job(s), {recovered} recovered from a previous run.")
+
+def register_job_handler(job_type, handler, on_failure=None):
+    """
+    Registers the function that runs jobs of the given type.
+    handler(payload) should raise to request a retry; on_failure(payload, error) is called
+    once the job has used up MAX_ATTEMPTS.
+    """
+    _handlers[job_type] = (handler, on_failure)
+
+def submit_job(job_type, payload, partition_key=None, block=True, timeout=None, background=False):
+    """
+    Persists a job and wakes a worker. Jobs sharing a partition_key run one at a time, in submit order.
+    When MAX_OUTSTANDING_JOBS are already queued, waits for room (or raises JobQueueFull).
+    Background jobs (e.g. resume) leave the last RESERVED_LIVE_JOBS slots to live submissions.
+    """
+    global _outstanding
+    limit = MAX_OUTSTANDING_JOBS - RESERVED_LIVE_JOBS if background else MAX_OUTSTANDING_JOBS
+    deadline = time.monotonic() + timeout if block and timeout is not None else None
+    with _condition:
+        while not _has_room(limit):
+            remaining = 0 if not block else (None if deadline is None else deadline - time.monotonic())
+            if remaining is not None and remaining <= 0:
+                raise JobQueueFull(f"Job queue is full ({_outstanding} outstanding jobs).")
+            # jobs finished by shard processes cannot notify us, so look again every IDLE_POLL_SECONDS
+            _condition.wait(timeout=IDLE_POLL_SECONDS if remaining is None else min(remaining, IDLE_POLL_SECONDS))
+        _outstanding += 1
+
+    shard = shard_manager.get_shard(partition_key, _shard_count)
+    try:
+        cursor = _get_connection().execute(
+            "INSERT INTO jobs (job_type, partition_key, payload, next_run_at, shard) VALUES (?, ?, ?, ?, ?)",
+            (job_type, partition_key, json.dumps(payload, ensure_ascii=False), time.time(), shard)
+        )
+    except Exception:
+        with _condition:
+            _outstanding -= 1
+            _condition.notify_all()
+        raise
+
+    if _shard_wake_signals:
+        _shard_wake_signals[shard].release()
+    with _condition:
+        _condition.notify_all()
+    return cursor.lastrowid
+
+def _refresh_outstanding():
+    """
+    Re-reads the outstanding count from the database. Caller must hold _condition.
+    """
+    global _outstanding
+    _outstanding = _get_connection().execute(
+        "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+
+def _has_room(limit):
+    if _outstanding >= limit and _jobs_run_elsewhere():
+        _refresh_outstanding()
+    return _outstanding < limit
+
+def get_outstanding_payload_values(*fields):
+    """
+    Returns the set of payload[field] values, for each of the given fields, of every job that is
+    still pending or running. List values (e.g. the filenames of an album job) are flattened.
+    """
+    values = set()
+    for (payload,) in _get_connection().execute("SELECT payload FROM jobs WHERE status IN ('pending', 'running')"):
+        payload = json.loads(payload)
+        for field in fields:
+            value = payload.get(field)
+            if isinstance(value, list):
+                values.update(value)
+            elif value is not None:
+                values.add(value)
+    return values
+
+def get_queue_depth():
+    """
+    Returns the number of jobs that are pending or running.
+    """
+    with _condition:
+        if _jobs_run_elsewhere():
+            _refresh_outstanding()
+        return _outstanding
+
+def get_active_job_count():
+    """
+    Returns the number of worker threads currently running a job.
+    """
+    with _condition:
+        return _active_jobs
+
+def _claim_next_job():
+    """
+    Picks the oldest runnable job whose partition is not busy and has no older job waiting.
+    Only the oldest pending job of each partition is considered, so a long backlog from one user
+    cannot hide the jobs of other users from the workers.
+    Caller must hold _condition. Returns (job_id, job_type, partition_key, payload, attempts) or None.
+    """
+    now = time.time()
+    conn = _get_connection()
+    # ไม่ได้แบ่ง shard งานทั้งหมดอยู่ใน shard 0 (initialize_job_queue จัด shard ใหม่ให้แล้ว)
+    shard = 0 if _shard_index is None else _shard_index
+    rows = conn.execute(
+        "SELECT id, job_type, partition_key, payload, attempts, next_run_at FROM jobs "
+        "WHERE id IN (SELECT MIN(id) FROM jobs WHERE shard = ? AND status = 'pending' AND partition_key IS NOT NULL "
+        "             GROUP BY partition_key) AND next_run_at <= ? "
+        "UNION ALL "
+        "SELECT id, job_type, partition_key, payload, attempts, next_run_at FROM jobs "
+        "WHERE shard = ? AND status = 'pending' AND partition_key IS NULL AND next_run_at <= ? "
+        "ORDER BY id LIMIT ?", (shard, now, shard, now, CLAIM_SCAN_LIMIT)
+    ).fetchall()
+    for job_id, job_type, partition_key, payload, attempts, next_run_at in rows:
+        if partition_key is not None and partition_key in _running_partitions:
+            continue
+        conn.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+        metrics_manager.observe("job_queue_wait_seconds", now - next_run_at, job_type=job_type)
+        if partition_key is not None:
+            _running_partitions.add(partition_key)
+        return job_id, job_type, partition_key, payload, attempts
+    return None
+
+def _finish_job(job_id, partition_key):
+    global _outstanding
+    _get_connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    with _condition:
+        _outstanding -= 1
+        _running_partitions.discard(partition_key)
+        _condition.notify_all()
+
+def _retry_or_fail_job(job_id, job_type, partition_key, payload, attempts, error, count_attempt=True):
+    global _outstanding
+    conn = _get_connection()
+    attempts = attempts + 1 if count_attempt else attempts
+    if attempts >= MAX_ATTEMPTS:
+        conn.execute("UPDATE jobs SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                     (attempts, str(error), job_id))
+        logging.error(f"[QUEUE] ❌ Job {job_id} ({job_type}) failed after {attempts} attempt(s): {error}")
+        metrics_manager.increment("jobs_failed_total", job_type=job_type)
+        with _condition:
+            _outstanding -= 1
+            _running_partitions.discard(partition_key)
+            _condition.notify_all()
+        on_failure = _handlers.get(job_type, (None, None))[1]
+        if on_failure:
+            try:
+                on_failure(payload, error)
+            except Exception as e:
+                logging.error(f"[QUEUE] Failure callback for job {job_id} ({job_type}) raised: {e}")
+        return
+
+    delay = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** max(attempts - 1, 0)))
+    conn.execute("UPDATE jobs SET status = 'pending', attempts = ?, next_run_at = ?, last_error = ? WHERE id = ?",
+                 (attempts, time.time() + delay, str(error), job_id))
+    if count_attempt:
+        metrics_manager.increment("jobs_retried_total", job_type=job_type)
+    logging.warning(f"[QUEUE] Job {job_id} ({job_type}) will retry in {delay}s (attempt {attempts}/{MAX_ATTEMPTS}): {error}")
+    with _condition:
+        _running_partitions.discard(partition_key)
+        _condition.notify_all()
+
+def _worker_loop():
+    global _active_jobs
+    while not _stop_event.is_set():
+        with _condition:
+            job = _claim_next_job()
+            if job is None:
+                _condition.wait(timeout=IDLE_POLL_SECONDS)
+                continue
+
+        job_id, job_type, partition_key, payload_json, attempts = job
+        payload = json.loads(payload_json)
+        handler = _handlers.get(job_type, (None, None))[0]
+        if handler is None:
+            # Handler not registered yet (e.g. still starting up): put the job back without counting an attempt.
+            _retry_or_fail_job(job_id, job_type, partition_key, payload, attempts,
+                               f"No handler registered for '{job_type}'", count_attempt=False)
+            continue
+
+        with _condition:
+            _active_jobs += 1
+        started = time.perf_counter()
+        try:
+            handler(payload)
+        except Exception as e:
+            _retry_or_fail_job(job_id, job_type, partition_key, payload, attempts, e)
+        else:
+            _finish_job(job_id, partition_key)
+        finally:
+            metrics_manager.observe("job_seconds", time.perf_counter() - started, job_type=job_type)
+            with _condition:
+                _active_jobs -= 1
+
+def _wake_listener_loop():
+    while not _stop_event.is_set():
+        if _wake_signal.acquire(timeout=IDLE_POLL_SECONDS):
+            while _wake_signal.acquire(block=False): # งานที่ส่งมาระหว่างนี้ปลุกรอบเดียวพอ
+                pass
+            with _condition:
+                _condition.notify_all()
+
+def start_workers(worker_count=None):
+    """
+    Starts the fixed pool of queue worker threads (in a shard worker process, only for that shard's jobs).
+    """
+    if _workers:
+        return
+    worker_count = worker_count or WORKER_COUNT
+    _stop_event.clear()
+    for i in range(worker_count):
+        thread = threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True)
+        _workers.append(thread)
+        thread.start()
+    if _wake_signal is not None:
+        thread = threading.Thread(target=_wake_listener_loop, name="job-wake-listener", daemon=True)
+        _workers.append(thread)
+        thread.start()
+    shard_text = f" for shard {_shard_index}/{_shard_count}" if _shard_index is not None else ""
+    logging.info(f"Job queue started with {worker_count} worker(s){shard_text}.")
+
+def stop_workers(timeout=None):
+    """
+    Stops the worker threads after their current job. Pending jobs stay in the database.
+    With a timeout, waits at most that long: jobs still running then stay 'running' in the
+    database and are run again on the next start. Returns True if every worker stopped in time.
+    """
+    _stop_event.set()
+    with _condition:
+        _condition.notify_all()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for thread in _workers:
+        thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+    stopped = not any(thread.is_alive() for thread in _workers)
+    if not stopped:
+        with _condition:
+            logging.warning(f"[QUEUE] {_active_jobs} job(s) still running after {timeout}s, "
+                            f"they will run again on the next start.")
+    _workers.clear()
+    return stopped
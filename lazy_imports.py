@@ -0,0 +1,32 @@
+import importlib
+import threading
+
+# --- Lazy Imports ---
+# โมดูลหนัก (cv2, numpy, pytesseract, openpyxl) ถูกโหลดเมื่อใช้งานครั้งแรก ไม่ใช่ตอนเริ่มโปรแกรม
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+    `cv2 = lazy_import("cv2")` keeps `cv2.imread(...)` working unchanged in the calling module.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -1,18 +1,126 @@
-import logging
 import os
+import queue
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+
+# --- Logging Configuration ---
+LOG_LEVEL = "INFO" # ตั้งเป็น "WARNING" ใน production เพื่อปิดข้อความ INFO รายรูปภาพ
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+QUEUE_LOGGING_ENABLED = True # เขียน log ผ่านคิวและ thread เดียว ไม่ทำ I/O บน event loop
+LOG_ROTATION = "size" # "size", "time" หรือ None (ไม่หมุนไฟล์)
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = "midnight" # ใช้เมื่อ LOG_ROTATION = "time"
+LOG_BACKUP_COUNT = 10
+
+_listener = None
+_output_handlers = []
+_process_log_queue = None  # records from worker processes (OCR pool), see get_process_log_queue
+_process_listener = None
+
+class _ForwardToLoggerHandler(logging.Handler):
+    """Hands a record received from a worker process to this process's logging configuration."""
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+def _create_file_handler(log_filename, rotation):
+    if rotation == "size":
+        return logging.handlers.RotatingFileHandler(log_filename, maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(log_filename, when=LOG_ROTATE_WHEN,
+                                                         backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.FileHandler(log_filename, encoding='utf-8')
 
-def setup_logging(log_filename="bot_activity.log"):
+def setup_logging(log_filename="bot_activity.log", level=None, use_queue=None, rotation=None, force=False):
     """
     Sets up logging to output to both console and a specified log file.
     This function should be called once at the start of the application.
+    With queue logging, the root logger only gets a QueueHandler; one listener thread
+    does the actual console/file writes, so logging calls never block on I/O.
+    force=True replaces any configuration already in place (e.g. in a worker process that
+    must not write to the parent's log file).
     """
+    global _listener, _output_handlers
+    level = level or LOG_LEVEL
+    use_queue = QUEUE_LOGGING_ENABLED if use_queue is None else use_queue
+    rotation = LOG_ROTATION if rotation is None else rotation
+
+    if force:
+        stop_logging()
+        for handler in list(logging.root.handlers):
+            logging.root.removeHandler(handler)
+            handler.close()
+
     if not logging.root.handlers:
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_filename, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
-    logging.info(f"Logging configured. Outputting to console and '{log_filename}'.")
\ No newline at end of file
+        formatter = logging.Formatter(LOG_FORMAT)
+        _output_handlers = [_create_file_handler(log_filename, rotation), logging.StreamHandler()]
+        for handler in _output_handlers:
+            handler.setFormatter(formatter)
+
+        logging.root.setLevel(level)
+        if use_queue:
+            log_queue = queue.SimpleQueue()
+            logging.root.addHandler(logging.handlers.QueueHandler(log_queue))
+            _listener = logging.handlers.QueueListener(log_queue, *_output_handlers, respect_handler_level=True)
+            _listener.start()
+        else:
+            for handler in _output_handlers:
+                logging.root.addHandler(handler)
+    logging.info(f"Logging configured. Outputting to console and '{log_filename}' "
+                 f"(level {logging.getLevelName(logging.root.level)}, queue {'on' if _listener else 'off'}, rotation {rotation}).")
+
+def get_process_log_queue(context=None):
+    """
+    Returns the multiprocessing queue that worker processes log into (see configure_worker_logging),
+    created with the given multiprocessing context. A listener thread in this process passes the
+    records on to the console/file handlers. A forked worker must not keep the inherited QueueHandler:
+    the listener that drains it only runs in the parent, so its records would never be written.
+    """
+    global _process_log_queue, _process_listener
+    if _process_log_queue is None:
+        _process_log_queue = (context or multiprocessing).Queue()
+        _process_listener = logging.handlers.QueueListener(_process_log_queue, _ForwardToLoggerHandler())
+        _process_listener.start()
+    return _process_log_queue
+
+def configure_worker_logging(log_queue, level=None):
+    """
+    Called in a worker process (e.g. a pool initializer): replaces the handlers inherited from the
+    parent with one that sends every record to log_queue from get_process_log_queue.
+    """
+    global _listener
+    _listener = None # สำเนาของ listener จาก process แม่ ไม่มี thread ทำงานใน process นี้
+    for handler in list(logging.root.handlers):
+        logging.root.removeHandler(handler)
+    logging.root.addHandler(logging.handlers.QueueHandler(log_queue))
+    logging.root.setLevel(level or LOG_LEVEL)
+
+def set_log_level(level):
+    """
+    Changes the root log level at runtime, e.g. "WARNING" to silence per-photo INFO messages.
+    """
+    logging.root.setLevel(level)
+
+def stop_logging():
+    """
+    Writes out queued records and stops the listener thread. Later records (e.g. from other
+    shutdown hooks) are written directly by the console/file handlers.
+    """
+    global _listener, _process_log_queue, _process_listener
+    if _process_listener is not None:
+        _process_listener.stop()
+        _process_listener = None
+        _process_log_queue = None
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    for handler in list(logging.root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logging.root.removeHandler(handler)
+    for handler in _output_handlers:
+        logging.root.addHandler(handler)
+
+atexit.register(stop_logging)
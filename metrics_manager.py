@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- Metrics ---
+# ฮิสโตแกรมเวลาแต่ละขั้นตอน + ตัวนับ + gauge เก็บในหน่วยความจำ (ต้นทุนต่ำ: lock + บวกเลขต่อการวัด)
+# ดูได้ที่ http://127.0.0.1:<port>/metrics (รูปแบบ Prometheus) หรือ /metrics.json หรือไฟล์ที่ dump เป็นระยะ
+METRICS_ENABLED = True
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count], sum
+_counters = {}    # (name, labels) -> value
+_gauge_callbacks = {}  # name -> function returning a number, read when metrics are exported
+_server = None
+_dump_thread = None
+_dump_stop = threading.Event()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+def observe(name, seconds, **labels):
+    """
+    Adds one duration (in seconds) to the histogram name{labels}.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(HISTOGRAM_BUCKETS) + 1), 0.0]
+        counts = histogram[0]
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        histogram[1] += seconds
+
+def increment(name, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def register_gauge(name, callback):
+    """
+    Registers a gauge whose value is read from callback() each time metrics are exported
+    (queue depths, active workers...), so the hot path pays nothing for it.
+    """
+    _gauge_callbacks[name] = callback
+
+class timed:
+    """
+    Context manager that records the duration of its block: `with timed("stage_seconds", stage="download"):`.
+    Works around awaits too (it measures wall time).
+    """
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+@contextmanager
+def timed_lock(lock, lock_name):
+    """
+    Acquires lock, recording how long the caller waited for it in lock_wait_seconds{lock=lock_name}.
+    """
+    started = time.perf_counter()
+    with lock:
+        observe("lock_wait_seconds", time.perf_counter() - started, lock=lock_name)
+        yield
+
+def _read_gauges():
+    gauges = {}
+    for name, callback in list(_gauge_callbacks.items()):
+        try:
+            gauges[name] = callback()
+        except Exception as e:
+            logging.debug(f"Metrics gauge '{name}' failed: {e}")
+    return gauges
+
+def snapshot():
+    """
+    Returns all metrics as a JSON-serializable dict.
+    """
+    with _lock:
+        histograms = {key: (list(counts), total) for key, (counts, total) in _histograms.items()}
+        counters = dict(_counters)
+    result = {"timestamp": time.time(), "histograms": [], "counters": [], "gauges": _read_gauges()}
+    for (name, labels), (counts, total) in sorted(histograms.items()):
+        count = sum(counts)
+        result["histograms"].append({
+            "name": name, "labels": dict(labels), "count": count, "sum": total,
+            "avg": total / count if count else 0.0,
+            "p50": _estimate_quantile(counts, 0.5), "p99": _estimate_quantile(counts, 0.99),
+            "buckets": {str(bound): value for bound, value in zip(HISTOGRAM_BUCKETS + ("+Inf",), counts)},
+        })
+    for (name, labels), value in sorted(counters.items()):
+        result["counters"].append({"name": name, "labels": dict(labels), "value": value})
+    return result
+
+def _estimate_quantile(counts, fraction):
+    """
+    Upper bound of the bucket that holds the given quantile (None when empty or beyond the last bucket).
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    target = fraction * total
+    running = 0
+    for bound, value in zip(HISTOGRAM_BUCKETS, counts):
+        running += value
+        if running >= target:
+            return bound
+    return None
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+def render_prometheus():
+    """
+    Returns the metrics in the Prometheus text exposition format.
+    """
+    with _lock:
+        histograms = {key: (list(counts), total) for key, (counts, total) in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for (name, labels), (counts, total) in sorted(histograms.items()):
+        running = 0
+        for bound, value in zip(HISTOGRAM_BUCKETS + ("+Inf",), counts):
+            running += value
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {running}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {running}")
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name, value in sorted(_read_gauges().items()):
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serves /metrics and /metrics.json on host:port from a background thread (local only by default).
+    """
+    global _server
+    if _server is not None:
+        return
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logging.error(f"Could not start metrics endpoint on {host}:{port}: {e}")
+        return
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+
+def _dump_loop(path, interval_seconds):
+    while not _dump_stop.wait(interval_seconds):
+        dump_to_file(path)
+
+def dump_to_file(path):
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(snapshot(), f, ensure_ascii=False, indent=1)
+        os.replace(path + ".tmp", path)
+    except Exception as e:
+        logging.error(f"Error writing metrics to '{path}': {e}")
+
+def start_metrics_dump(path, interval_seconds):
+    """
+    Writes snapshot() as JSON to path every interval_seconds, and once more at exit.
+    """
+    global _dump_thread
+    if _dump_thread is not None:
+        return
+    _dump_stop.clear()
+    _dump_thread = threading.Thread(target=_dump_loop, args=(path, interval_seconds), name="metrics-dump", daemon=True)
+    _dump_thread.start()
+    atexit.register(dump_to_file, path)
+    logging.info(f"Metrics are written to '{path}' every {interval_seconds}s.")
+
+def stop_metrics():
+    global _server, _dump_thread
+    if _server is not None:
+        _server.shutdown()
+        _server = None
+    if _dump_thread is not None:
+        _dump_stop.set()
+        _dump_thread.join()
+        _dump_thread = None
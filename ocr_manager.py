@@ -0,0 +1,398 @@
+import os
+import logging
+import time
+import random
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import timestamp_parser
+import logging_manager
+from lazy_imports import lazy_import
+
+# โหลดเมื่อใช้งานครั้งแรก (ใน OCR worker process) ไม่ใช่ตอน import
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+pytesseract = lazy_import("pytesseract")
+
+# --- OCR Configuration ---
+# OCR ทำงานใน process pool แยกจากบอท เพื่อไม่ให้ event loop และ worker threads ต้องรอ
+OCR_POOL_SIZE = os.cpu_count() or 1
+OCR_TIMEOUT_SECONDS = 20 # เกินเวลานี้จะใช้ bot_timestamp แทน
+OCR_CALL_TIMEOUT_SECONDS = 10 # ต่อการเรียก Tesseract หนึ่งครั้ง (หนึ่ง ROI) ไม่ให้ engine ค้างได้ตลอดไป
+OCR_HUNG_GRACE_SECONDS = 5 # เกิน OCR_TIMEOUT_SECONDS ไปอีกเท่านี้แล้ว worker ยังไม่ตอบ ถือว่าค้าง และสร้าง pool ใหม่
+TESSERACT_CONFIG = "--psm 6"
+TESSERACT_CMD_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# ลำดับการลอง ROI จาก find_timestamp_roi: มุมล่างขวา/ซ้ายแบบแคบก่อน (พบบ่อยและ OCR เร็ว) แล้วค่อยขยายพื้นที่
+DEFAULT_ROI_ORDER = [4, 0, 5, 1, 9, 6, 2, 7, 3, 10, 12, 11, 8, 13]
+ROI_EXPLORATION_RATE = 0.05 # สัดส่วนรูปที่ลอง ROI อื่นก่อน ROI ที่เรียนรู้มา
+
+TIMESTAMP_OUTPUT_FORMAT = "%Y-%m-%d %H:%M:%S"
+MIN_VALID_YEAR = 2000
+
+# --- Preprocessing Configuration ---
+DESKEW_SAMPLE_MAX_SIDE = 800 # ประเมินมุมเอียงจากภาพย่อขนาดนี้ ไม่ใช่ภาพเต็ม 12MP
+MIN_DESKEW_ANGLE = 0.5 # มุมที่น้อยกว่านี้ไม่ต้องหมุน
+MAX_PREPROCESS_BUFFERS = 64
+_preprocess_buffers = {}  # (name, shape) -> reusable uint8 array (per OCR process)
+_clahe = None
+
+# --- OCR Backend Configuration ---
+# "tesserocr" โหลด engine และข้อมูลภาษาครั้งเดียวต่อ worker process (ผ่าน C API)
+# "pytesseract" เรียกโปรแกรม tesseract ใหม่ทุก ROI (ช้ากว่า แต่ไม่ต้องติดตั้ง tesserocr)
+# "auto" ใช้ tesserocr ถ้ามี ไม่เช่นนั้นใช้ pytesseract
+OCR_BACKEND = "auto"
+OCR_LANGUAGE = "eng"
+TESSDATA_PATH = None # โฟลเดอร์ tessdata สำหรับ tesserocr (None = ค่าเริ่มต้นของ Tesseract)
+_ocr_backend = None  # image_to_text function of this process
+
+_ocr_pool = None
+_ocr_pool_settings = None  # (pool_size, tesseract_cmd_path, backend_name) used to restart a broken pool
+_ocr_pool_lock = threading.Lock()
+
+def configure_tesseract(tesseract_cmd_path=TESSERACT_CMD_PATH):
+    try:
+        if os.path.exists(tesseract_cmd_path):
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd_path
+        else:
+            logging.warning(f"Tesseract executable not found at '{tesseract_cmd_path}'. Trying system PATH.")
+            pytesseract.pytesseract.tesseract_cmd = 'tesseract'
+    except pytesseract.TesseractNotFoundError:
+        logging.error("Tesseract is not installed or not found in system PATH. OCR will not work.")
+    except Exception as e:
+        logging.error(f"Error setting Tesseract path: {e}")
+
+# --- OCR-related functions ---
+def _get_buffer(name, shape):
+    """
+    Returns a per-process uint8 scratch array for the given name and shape, reused between calls.
+    ROIs of one camera have the same size, so steady-state preprocessing allocates nothing new.
+    """
+    key = (name, shape)
+    buffer = _preprocess_buffers.get(key)
+    if buffer is None:
+        if len(_preprocess_buffers) >= MAX_PREPROCESS_BUFFERS:
+            _preprocess_buffers.clear()
+        buffer = _preprocess_buffers[key] = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+def _get_clahe():
+    global _clahe
+    if _clahe is None:
+        _clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return _clahe
+
+def _threshold_for_ocr(image, name):
+    """
+    Gray -> CLAHE -> blur -> inverted adaptive threshold, written into reusable buffers.
+    """
+    shape = image.shape[:2]
+    gray = _get_buffer(name + "_gray", shape)
+    cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+    enhanced_gray = _get_buffer(name + "_enhanced", shape)
+    _get_clahe().apply(gray, dst=enhanced_gray)
+    cv2.GaussianBlur(enhanced_gray, (3, 3), 0, dst=gray)
+    thresh_image = _get_buffer(name + "_thresh", shape)
+    cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                          cv2.THRESH_BINARY_INV, 15, 5, dst=thresh_image)
+    return thresh_image
+
+def estimate_deskew_angle(image):
+    """
+    Estimates the skew angle (degrees, within +-45) from a copy downscaled to at most
+    DESKEW_SAMPLE_MAX_SIDE pixels, using cv2.findNonZero instead of building a full-size coordinate array.
+    """
+    h, w = image.shape[:2]
+    scale = min(1.0, DESKEW_SAMPLE_MAX_SIDE / max(h, w))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    points = cv2.findNonZero(_threshold_for_ocr(image, "deskew"))
+    if points is None:
+        return 0.0
+    angle = cv2.minAreaRect(points)[-1]
+    # OpenCV < 4.5 ให้มุมใน [-90, 0) ส่วนเวอร์ชันใหม่ให้ (0, 90] จึงปรับให้อยู่ในช่วง [-45, 45]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return angle
+
+def preprocess_image_for_ocr(image, deskew_angle=None):
+    """
+    Binarizes an ROI crop for Tesseract and rotates it by deskew_angle (estimated from the crop itself when None).
+    The returned array is a reused buffer: it is only valid until the next call in this process.
+    """
+    thresh_image = _threshold_for_ocr(image, "roi")
+    if deskew_angle is None:
+        deskew_angle = estimate_deskew_angle(image)
+    if abs(deskew_angle) < MIN_DESKEW_ANGLE:
+        return thresh_image
+
+    (h, w) = thresh_image.shape[:2]
+    center = (w // 2, h // 2)
+    M = cv2.getRotationMatrix2D(center, deskew_angle, 1.0)
+    rotated = _get_buffer("roi_rotated", (h, w))
+    cv2.warpAffine(thresh_image, M, (w, h), dst=rotated,
+                   flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return rotated
+
+def find_timestamp_roi(image):
+    h, w, _ = image.shape
+    rois = []
+
+    rois.append((int(w * 0.5), int(h * 0.75), int(w * 0.5), int(h * 0.25)))
+    rois.append((0, int(h * 0.75), int(w * 0.5), int(h * 0.25)))
+    rois.append((int(w * 0.5), 0, int(w * 0.5), int(h * 0.25)))
+    rois.append((0, 0, int(w * 0.5), int(h * 0.25)))
+
+    rois.append((int(w * 0.65), int(h * 0.85), int(w * 0.35), int(h * 0.15)))
+    rois.append((0, int(h * 0.85), int(w * 0.35), int(h * 0.15)))
+    rois.append((int(w * 0.65), 0, int(w * 0.35), int(h * 0.15)))
+    rois.append((0, 0, int(w * 0.35), int(h * 0.15)))
+
+    rois.append((int(w * 0.25), int(h * 0.25), int(w * 0.5), int(h * 0.5)))
+    rois.append((int(w * 0.1), int(h * 0.8), int(w * 0.8), int(h * 0.2)))
+    rois.append((int(w * 0.1), 0, int(w * 0.8), int(h * 0.2)))
+    rois.append((0, int(h * 0.1), int(w * 0.2), int(h * 0.8)))
+    rois.append((int(w * 0.8), int(h * 0.1), int(w * 0.2), int(h * 0.8)))
+    rois.append((int(w * 0.05), int(h * 0.05), int(w * 0.9), int(h * 0.9)))
+
+    return rois
+
+def _is_valid_timestamp(dt):
+    return MIN_VALID_YEAR <= dt.year <= datetime.now().year + 1
+
+def parse_timestamp_text(text):
+    """
+    Parses OCR text with timestamp_parser and returns the first plausible timestamp
+    formatted as '%Y-%m-%d %H:%M:%S', or None.
+    """
+    dt = timestamp_parser.parse_timestamp(text)
+    if dt is not None and _is_valid_timestamp(dt):
+        return dt.strftime(TIMESTAMP_OUTPUT_FORMAT)
+    return None
+
+# --- OCR Backends ---
+# Each backend factory returns image_to_text(binary_uint8_image, timeout=None) -> str.
+# On timeout (seconds) the call raises instead of returning.
+def _create_pytesseract_backend():
+    def image_to_text(image, timeout=None):
+        return pytesseract.image_to_string(image, config=TESSERACT_CONFIG, timeout=timeout or 0) # โปรแกรม tesseract ถูก kill เมื่อเกินเวลา
+    return image_to_text
+
+def _create_tesserocr_backend():
+    import tesserocr # optional dependency: pip install tesserocr
+    kwargs = {"lang": OCR_LANGUAGE, "psm": tesserocr.PSM.SINGLE_BLOCK}
+    if TESSDATA_PATH:
+        kwargs["path"] = TESSDATA_PATH
+    api = tesserocr.PyTessBaseAPI(**kwargs) # engine + language data loaded once, kept for the process lifetime
+
+    def image_to_text(image, timeout=None):
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        if not api.Recognize(int(timeout * 1000) if timeout else 0): # Tesseract ยกเลิกการ recognize เองเมื่อเกินเวลา
+            raise RuntimeError(f"tesserocr recognition failed or timed out after {timeout}s")
+        return api.GetUTF8Text()
+    return image_to_text
+
+OCR_BACKENDS = {
+    "tesserocr": _create_tesserocr_backend,
+    "pytesseract": _create_pytesseract_backend,
+}
+
+def load_ocr_backend(backend_name=None):
+    """
+    Creates the image_to_text function for backend_name ("auto", "tesserocr" or "pytesseract").
+    Falls back to pytesseract when tesserocr cannot be loaded.
+    """
+    backend_name = backend_name or OCR_BACKEND
+    candidates = ["tesserocr", "pytesseract"] if backend_name == "auto" else [backend_name, "pytesseract"]
+    for name in candidates:
+        try:
+            image_to_text = OCR_BACKENDS[name]()
+            logging.info(f"OCR backend '{name}' loaded in process {os.getpid()}.")
+            return image_to_text
+        except Exception as e:
+            if backend_name != "auto" or name == "pytesseract":
+                logging.warning(f"OCR backend '{name}' unavailable: {e}")
+    return _create_pytesseract_backend()
+
+def _get_ocr_backend():
+    global _ocr_backend
+    if _ocr_backend is None:
+        _ocr_backend = load_ocr_backend()
+    return _ocr_backend
+
+def _ocr_worker_init(tesseract_cmd_path, backend_name=None, log_queue=None, log_level=None):
+    global _ocr_backend
+    if log_queue is not None:
+        logging_manager.configure_worker_logging(log_queue, log_level)
+    configure_tesseract(tesseract_cmd_path)
+    _ocr_backend = load_ocr_backend(backend_name)
+
+def get_resolution_key(width, height):
+    return f"{width}x{height}"
+
+def get_learned_roi_order(roi_stats, exploration_rate=None):
+    """
+    Orders ROIs by hit rate from roi_stats ({roi_index: (hits, attempts)}); ROIs that never hit
+    keep their DEFAULT_ROI_ORDER position after them. With probability exploration_rate one
+    of the other ROIs is tried first, so a changed camera layout is still discovered.
+    """
+    exploration_rate = ROI_EXPLORATION_RATE if exploration_rate is None else exploration_rate
+    default_position = {roi_index: i for i, roi_index in enumerate(DEFAULT_ROI_ORDER)}
+
+    def sort_key(roi_index):
+        hits, attempts = roi_stats.get(roi_index, (0, 0))
+        hit_rate = hits / attempts if attempts else 0.0
+        return (-hit_rate, default_position[roi_index])
+
+    order = sorted(DEFAULT_ROI_ORDER, key=sort_key)
+    if roi_stats and len(order) > 1 and random.random() < exploration_rate:
+        explored = order.pop(random.randrange(1, len(order)))
+        order.insert(0, explored)
+    return order
+
+def _new_ocr_result():
+    return {"timestamp": None, "roi_index": None, "tried_rois": [], "resolution": None}
+
+def ocr_image_file(image_path, roi_order=None, deadline=None):
+    """
+    Runs in an OCR worker process. Reads and decodes the image from disk, then see ocr_image.
+    """
+    return ocr_image(cv2.imread(image_path), image_path, roi_order, deadline)
+
+def ocr_image_bytes(image_bytes, image_label, roi_order=None, deadline=None):
+    """
+    Runs in an OCR worker process. Decodes the encoded (JPEG) bytes once with cv2.imdecode,
+    straight from the buffer without a disk round trip, then see ocr_image.
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return ocr_image(image, image_label, roi_order, deadline)
+
+def ocr_image(image, image_label, roi_order=None, deadline=None):
+    """
+    Tries ROIs of a decoded image in roi_order and stops at the first one that parses to a valid timestamp.
+    deadline (a time.time() value) stops the search and bounds each backend call, so the worker is free
+    again when the caller gives up waiting.
+    Returns {"timestamp", "roi_index", "tried_rois", "resolution"}; timestamp is None when nothing parsed.
+    """
+    result = _new_ocr_result()
+    if image is None:
+        logging.error(f"Could not decode image '{image_label}' for OCR.")
+        return result
+    result["resolution"] = get_resolution_key(image.shape[1], image.shape[0])
+    deskew_angle = estimate_deskew_angle(image) # ครั้งเดียวต่อรูป ใช้กับทุก ROI
+    rois = find_timestamp_roi(image)
+    for roi_index in roi_order or DEFAULT_ROI_ORDER:
+        if roi_index >= len(rois):
+            continue
+        x, y, w, h = rois[roi_index]
+        if w <= 0 or h <= 0:
+            continue
+        call_timeout = OCR_CALL_TIMEOUT_SECONDS
+        if deadline is not None:
+            call_timeout = min(call_timeout, deadline - time.time())
+            if call_timeout <= 0:
+                logging.warning(f"OCR deadline reached for '{image_label}' after ROIs {result['tried_rois']}.")
+                return result
+        processed = preprocess_image_for_ocr(image[y:y + h, x:x + w], deskew_angle=deskew_angle)
+        result["tried_rois"].append(roi_index)
+        try:
+            text = _get_ocr_backend()(processed, timeout=call_timeout)
+        except Exception as e:
+            # บาง exception ของ OCR backend pickle ไม่ได้ ถ้าปล่อยออกไป process pool จะพังทั้งหมด
+            logging.error(f"Tesseract failed on ROI {roi_index} of '{image_label}': {e}")
+            return result
+        timestamp = parse_timestamp_text(text)
+        if timestamp:
+            result["timestamp"] = timestamp
+            result["roi_index"] = roi_index
+            return result
+    return result
+
+def start_ocr_pool(pool_size=None, tesseract_cmd_path=TESSERACT_CMD_PATH, backend_name=None):
+    """
+    Starts the OCR process pool (one process per core by default). Each worker process
+    loads its OCR backend once in the initializer and keeps it for every ROI it is sent.
+    """
+    global _ocr_pool, _ocr_pool_settings
+    if _ocr_pool is not None:
+        return
+    pool_size = pool_size or OCR_POOL_SIZE
+    backend_name = backend_name or OCR_BACKEND
+    context = multiprocessing.get_context() # ค่าเริ่มต้นของระบบ (fork บน Linux, spawn บน Windows) ใช้สร้างคิว log ด้วย
+    _ocr_pool = ProcessPoolExecutor(max_workers=pool_size, mp_context=context, initializer=_ocr_worker_init,
+                                    initargs=(tesseract_cmd_path, backend_name,
+                                              logging_manager.get_process_log_queue(context), logging.root.level))
+    _ocr_pool_settings = (pool_size, tesseract_cmd_path, backend_name)
+    logging.info(f"OCR process pool started with {pool_size} worker(s), backend '{backend_name}'.")
+
+def _terminate_pool_processes(pool):
+    terminate_workers = getattr(pool, "terminate_workers", None) # Python 3.14+
+    if terminate_workers is not None:
+        terminate_workers()
+        return
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+
+def _restart_ocr_pool(broken_pool, terminate=False):
+    """
+    Replaces broken_pool with a new pool. With terminate, its worker processes are killed first:
+    shutdown() alone never stops a process stuck in a Tesseract call, so it would keep its pool slot.
+    """
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not broken_pool:
+            return # another thread already restarted it
+        _ocr_pool = None
+        if terminate:
+            _terminate_pool_processes(broken_pool)
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        start_ocr_pool(*_ocr_pool_settings)
+
+def stop_ocr_pool():
+    global _ocr_pool
+    if _ocr_pool is not None:
+        _ocr_pool.shutdown(wait=False, cancel_futures=True)
+        _ocr_pool = None
+
+def extract_timestamp(image_path, roi_order=None, timeout=None, image_bytes=None):
+    """
+    Submits the image to the OCR pool and waits (in the calling worker thread) for the result.
+    When image_bytes (the downloaded JPEG) is given, the worker decodes it from memory instead of
+    reading image_path. Only the compressed bytes cross the process boundary, not the decoded array.
+    Returns the ocr_image result dict; its timestamp is None on failure, timeout
+    or when the pool is not running.
+    """
+    pool = _ocr_pool
+    if pool is None:
+        return _new_ocr_result()
+    timeout = timeout or OCR_TIMEOUT_SECONDS
+    deadline = time.time() + timeout # worker หยุดเองเมื่อถึงเวลานี้ (รวมเวลารอคิวใน pool)
+    try:
+        if image_bytes is not None:
+            future = pool.submit(ocr_image_bytes, image_bytes, image_path, roi_order, deadline)
+        else:
+            future = pool.submit(ocr_image_file, image_path, roi_order, deadline)
+    except BrokenProcessPool:
+        _restart_ocr_pool(pool)
+        return _new_ocr_result()
+    try:
+        return future.result(timeout=timeout + OCR_HUNG_GRACE_SECONDS)
+    except FutureTimeoutError:
+        if not future.cancel(): # ยังรันอยู่เกินกำหนด: process ค้างใน Tesseract และจะไม่ว่างอีก
+            logging.error(f"OCR worker hung on '{image_path}' for {timeout + OCR_HUNG_GRACE_SECONDS}s. Restarting OCR pool.")
+            _restart_ocr_pool(pool, terminate=True)
+        else:
+            logging.warning(f"OCR timed out after {timeout}s for '{image_path}'.")
+    except BrokenProcessPool as e:
+        logging.error(f"OCR process pool broke while processing '{image_path}': {e}. Restarting pool.")
+        _restart_ocr_pool(pool)
+    except Exception as e:
+        logging.error(f"OCR failed for '{image_path}': {e}")
+    return _new_ocr_result()
@@ -0,0 +1,145 @@
+import os
+import csv
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+
+import excel_manager
+import sqlite_manager
+
+# --- Reports ---
+# รวมข้อมูลจากไฟล์ Excel รายสัปดาห์ของหลายผู้ใช้ตามช่วงวันที่ เป็นไฟล์เดียว
+# อ่านแบบ read-only ทีละแถวและเขียนแบบ write-only ทำให้ใช้หน่วยความจำคงที่ไม่ว่าข้อมูลจะมากแค่ไหน
+REPORT_FOLDER = "Reports"
+REPORT_HEADERS = excel_manager.HEADERS
+REPORT_SOURCES = ("excel", "index") # "index" อ่านจาก image_records ใน SQLite (เร็วกว่ามาก แต่ไม่เห็นการแก้ไขไฟล์ Excel ด้วยมือ)
+
+def parse_date(text):
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+def _weekly_workbook_names(start_date, end_date):
+    """
+    Returns the YYYY-WNN prefixes of the weekly files that can hold rows in the range
+    (named exactly as excel_manager.get_local_excel_file_path names them).
+    """
+    prefixes = []
+    day = start_date
+    while day <= end_date:
+        prefix = f"{day.year}-W{day.isocalendar()[1]:02d}"
+        if prefix not in prefixes:
+            prefixes.append(prefix)
+        day += timedelta(days=1)
+    return prefixes
+
+def iter_workbook_rows(excel_file_path):
+    """
+    Streams the rows of one weekly workbook followed by its not-yet-flushed ledger rows.
+    The workbook lock is held while the file is read so a concurrent flush cannot change it mid-read.
+    """
+    from openpyxl import load_workbook # only needed when a report is built
+    with excel_manager.get_workbook_lock(excel_file_path):
+        wb = load_workbook(excel_file_path, read_only=True) if os.path.exists(excel_file_path) else None
+        try:
+            if wb is not None and excel_manager.SHEET_NAME in wb.sheetnames:
+                for row in wb[excel_manager.SHEET_NAME].iter_rows(min_row=2, values_only=True):
+                    if row and row[0] is not None:
+                        yield list(row[:len(REPORT_HEADERS)])
+            for row in excel_manager.read_unflushed_rows(excel_file_path, wb):
+                yield row
+        finally:
+            if wb is not None:
+                wb.close()
+
+def iter_report_rows(excel_base_folder, start_date, end_date, usernames=None):
+    """
+    Yields [username, bot_timestamp, filename, extracted_timestamp] rows whose bot timestamp falls
+    within start_date..end_date (inclusive), for the given users (all users when None).
+    Only the weekly files covering the range are opened, one at a time.
+    """
+    if not os.path.isdir(excel_base_folder):
+        return
+    wanted_users = {username.lower() for username in usernames} if usernames else None
+    start_text = start_date.isoformat()
+    end_text = end_date.isoformat()
+    prefixes = _weekly_workbook_names(start_date, end_date)
+
+    for username in sorted(os.listdir(excel_base_folder)):
+        user_folder = os.path.join(excel_base_folder, username)
+        if not os.path.isdir(user_folder) or (wanted_users is not None and username.lower() not in wanted_users):
+            continue
+        for prefix in prefixes:
+            excel_file_path = os.path.join(user_folder, f"{prefix}-{username}.xlsx")
+            if not (os.path.exists(excel_file_path) or os.path.exists(excel_manager.get_ledger_file_path(excel_file_path))):
+                continue
+            for row in iter_workbook_rows(excel_file_path):
+                bot_day = str(row[1])[:10]
+                if start_text <= bot_day <= end_text:
+                    yield row
+
+def write_report(output_path, rows):
+    """
+    Writes the rows to output_path as .xlsx (openpyxl write-only mode) or .csv, depending on the extension.
+    Returns the number of data rows written.
+    """
+    count = 0
+    if output_path.lower().endswith(".csv"):
+        with open(output_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_HEADERS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        return count
+
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(excel_manager.SHEET_NAME)
+    ws.append(REPORT_HEADERS)
+    for row in rows:
+        ws.append(row)
+        count += 1
+    wb.save(output_path)
+    return count
+
+def build_report(excel_base_folder, output_path, start_date, end_date, usernames=None, source="excel"):
+    """
+    Streams the matching rows into a single report file. Returns the number of rows written.
+    source="excel" reads the weekly workbooks; source="index" reads the SQLite image record store.
+    """
+    output_folder = os.path.dirname(output_path)
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+    if source == "index":
+        rows = sqlite_manager.iter_image_records(start_date, end_date, usernames)
+    else:
+        rows = iter_report_rows(excel_base_folder, start_date, end_date, usernames)
+    count = write_report(output_path, rows)
+    logging.info(f"📊 Report '{output_path}' written from {source}: {count} row(s) from {start_date} to {end_date}"
+                 f" for {', '.join(usernames) if usernames else 'all users'}.")
+    return count
+
+def get_report_filename(start_date, end_date, extension="xlsx"):
+    return f"report-{start_date.isoformat()}-to-{end_date.isoformat()}.{extension}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Combine the weekly Excel files into one report.")
+    parser.add_argument("--from", dest="start_date", type=parse_date, default=None, help="YYYY-MM-DD (default: 7 days ago)")
+    parser.add_argument("--to", dest="end_date", type=parse_date, default=None, help="YYYY-MM-DD (default: today)")
+    parser.add_argument("--users", default="", help="comma-separated usernames (default: all)")
+    parser.add_argument("--excel-folder", default="Excel Files")
+    parser.add_argument("--output", default=None, help=".xlsx or .csv (default: Reports/report-<from>-to-<to>.xlsx)")
+    parser.add_argument("--source", choices=REPORT_SOURCES, default="excel",
+                        help="excel = weekly workbooks (default), index = SQLite record store (fast)")
+    parser.add_argument("--db", default=sqlite_manager.ML_FEEDBACK_DB, help="SQLite database for --source index")
+    args = parser.parse_args()
+    sqlite_manager.ML_FEEDBACK_DB = args.db
+
+    end_date = args.end_date or date.today()
+    start_date = args.start_date or end_date - timedelta(days=6)
+    usernames = [name.strip() for name in args.users.split(",") if name.strip()] or None
+    output_path = args.output or os.path.join(REPORT_FOLDER, get_report_filename(start_date, end_date))
+    count = build_report(args.excel_folder, output_path, start_date, end_date, usernames, source=args.source)
+    print(f"{count} row(s) written to '{output_path}'")
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,28 @@ import logging
 import os
 import glob
 import re
+import time
 from datetime import datetime
-import asyncio
-import threading
-from openpyxl import load_workbook 
-from telegram.ext import ContextTypes 
 
 # --- Import modules from the project ---
 import excel_manager # <--- Import excel_manager
+import report_manager
 import sqlite_manager # <--- Import sqlite_manager
+import job_queue_manager
+
+RESUME_JOB = "resume_image"
+INDEX_BOOTSTRAPPED_KEY = "processed_index_bootstrapped"
+IMAGE_RECORDS_BOOTSTRAPPED_KEY = "image_records_bootstrapped"
+IMAGE_RECORDS_BOOTSTRAP_CHUNK = 1000
+DATE_FOLDER_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
 
 
 def get_processed_image_filenames_for_resume(excel_base_folder_param): # ลบ google_sheet_id_param, google_sheets_credentials_file_param, google_sheets_scope_param
     """
     Reads all processed image filenames from local Excel files.
     """
+    from openpyxl import load_workbook # only needed for the one-time index bootstrap
     processed_files = set()
 
     # 1. Read from Local Excel Files
@@ -24,34 +31,171 @@ def get_processed_image_filenames_for_resume(excel_base_folder_param): # ลบ
         user_path = os.path.join(excel_base_folder_param, user_dir)
         if os.path.isdir(user_path):
             for excel_file_name in glob.glob(os.path.join(user_path, '*.xlsx')):
-                with excel_manager.excel_lock: # ใช้ Lock เมื่ออ่านไฟล์ Excel เพื่อป้องกันการ Conflict
+                with excel_manager.get_workbook_lock(excel_file_name): # ใช้ Lock เฉพาะไฟล์ เพื่อไม่ให้บล็อกผู้ใช้อื่น
                     try:
-                        wb = load_workbook(excel_file_name)
+                        wb = load_workbook(excel_file_name, read_only=True)
                         ws = wb["ImageMetadata"]
                         for row in ws.iter_rows(min_row=2, values_only=True):
                             if row and len(row) > 2:
                                 processed_files.add(row[2])
+                        wb.close()
                     except Exception as e:
                         logging.error(f"Error reading processed filenames from local Excel '{excel_file_name}': {e}")
-    
+
+            # 2. Rows recorded in the write-behind ledgers (may not be in the .xlsx yet)
+            for ledger_file_name in glob.glob(os.path.join(user_path, '*' + excel_manager.LEDGER_SUFFIX)):
+                for row in excel_manager.iter_ledger_rows(ledger_file_name):
+                    if len(row) > 2:
+                        processed_files.add(row[2])
+
 
     return processed_files
 
-def find_unprocessed_images_for_resume(image_folder_param, processed_files_set):
+def find_unprocessed_images_for_resume(image_folder_param, processed_files_set, modified_before=None):
     """
     Scans the image_folder for image files that are not in the processed_files set.
     Returns a list of full paths to unprocessed images.
     Expects structure: image_folder/username/date/filename.jpg
+    Files modified after `modified_before` (live photos arriving while resume runs) are skipped.
     """
     unprocessed_images = []
     for root, dirs, files in os.walk(image_folder_param):
         for img_file_name in files:
-            if img_file_name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+            if img_file_name.lower().endswith(IMAGE_EXTENSIONS):
                 if img_file_name not in processed_files_set:
                     full_path = os.path.join(root, img_file_name)
+                    if modified_before is not None and os.path.getmtime(full_path) >= modified_before:
+                        continue
                     unprocessed_images.append(full_path)
     return unprocessed_images
 
+def bootstrap_processed_index(excel_base_folder_param):
+    """
+    One-time migration: fills the processed image index from every existing Excel file and ledger.
+    Later startups read the index instead of opening the workbooks.
+    """
+    if sqlite_manager.get_index_meta(INDEX_BOOTSTRAPPED_KEY) == "1":
+        return
+    logging.info("Building processed image index from existing Excel files (one-time)...")
+    processed_files = get_processed_image_filenames_for_resume(excel_base_folder_param)
+    if not sqlite_manager.mark_images_processed(
+        [(filename, get_username_from_filename(filename)) for filename in processed_files if filename]
+    ):
+        return # ไม่ตั้ง INDEX_BOOTSTRAPPED_KEY ให้สร้างใหม่ในการเริ่มครั้งถัดไป
+    sqlite_manager.set_index_meta(INDEX_BOOTSTRAPPED_KEY, "1")
+    logging.info(f"Processed image index built with {len(processed_files)} filenames.")
+
+def _format_cell_timestamp(value):
+    if isinstance(value, datetime): # แก้ไขด้วยมือใน Excel แล้วกลายเป็นวันที่
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return None if value is None else str(value)
+
+def bootstrap_image_records(excel_base_folder_param):
+    """
+    One-time migration: copies every row of the existing Excel files and ledgers into the image record store
+    that /stats and /history read. Rows recorded while this runs are not counted twice.
+    """
+    if sqlite_manager.get_index_meta(IMAGE_RECORDS_BOOTSTRAPPED_KEY) == "1" or not os.path.isdir(excel_base_folder_param):
+        return
+    logging.info("Building image record store from existing Excel files (one-time)...")
+    total = 0
+    chunk = []
+    for user_dir in os.listdir(excel_base_folder_param):
+        user_path = os.path.join(excel_base_folder_param, user_dir)
+        if not os.path.isdir(user_path):
+            continue
+        excel_file_names = set(glob.glob(os.path.join(user_path, '*.xlsx')))
+        excel_file_names.update(name[:-len(excel_manager.LEDGER_SUFFIX)]
+                                for name in glob.glob(os.path.join(user_path, '*' + excel_manager.LEDGER_SUFFIX)))
+        for excel_file_name in sorted(excel_file_names):
+            try:
+                for row in report_manager.iter_workbook_rows(excel_file_name):
+                    if len(row) < 3 or not row[1] or not row[2]:
+                        continue
+                    extracted = row[3] if len(row) > 3 else None
+                    chunk.append((str(row[0]), _format_cell_timestamp(row[1]), str(row[2]), _format_cell_timestamp(extracted)))
+                    if len(chunk) >= IMAGE_RECORDS_BOOTSTRAP_CHUNK:
+                        sqlite_manager.record_images(chunk)
+                        total += len(chunk)
+                        chunk = []
+            except Exception as e:
+                logging.error(f"Error reading records from local Excel '{excel_file_name}': {e}")
+    if chunk:
+        sqlite_manager.record_images(chunk)
+        total += len(chunk)
+    sqlite_manager.flush_pending_writes()
+    sqlite_manager.set_index_meta(IMAGE_RECORDS_BOOTSTRAPPED_KEY, "1")
+    logging.info(f"Image record store built from {total} Excel row(s).")
+
+def find_unprocessed_images_since_checkpoint(image_folder_param, checkpoints, queued_filenames, modified_before, today_str):
+    """
+    Looks only at image_folder/username/YYYY-MM-DD folders newer than each user's checkpoint.
+    Returns (unprocessed image paths, {username: new checkpoint date}).
+    The checkpoint only moves past days before today whose images are all in the index.
+    """
+    unprocessed_images = []
+    new_checkpoints = {}
+    if not os.path.isdir(image_folder_param):
+        return unprocessed_images, new_checkpoints
+
+    for username in sorted(os.listdir(image_folder_param)):
+        user_path = os.path.join(image_folder_param, username)
+        if not os.path.isdir(user_path):
+            continue
+        checkpoint = checkpoints.get(username, "")
+        new_checkpoint = checkpoint
+        contiguous = True
+
+        for date_str in sorted(os.listdir(user_path)):
+            date_path = os.path.join(user_path, date_str)
+            if not DATE_FOLDER_PATTERN.match(date_str) or date_str <= checkpoint or not os.path.isdir(date_path):
+                continue
+
+            image_names = [name for name in os.listdir(date_path) if name.lower().endswith(IMAGE_EXTENSIONS)]
+            processed = sqlite_manager.get_processed_filenames(image_names)
+            reconciled = True
+            for img_file_name in image_names:
+                if img_file_name in processed:
+                    continue
+                reconciled = False
+                if img_file_name in queued_filenames:
+                    continue
+                full_path = os.path.join(date_path, img_file_name)
+                if modified_before is not None and os.path.getmtime(full_path) >= modified_before:
+                    continue
+                unprocessed_images.append(full_path)
+
+            if contiguous and reconciled and date_str < today_str:
+                new_checkpoint = date_str
+            else:
+                contiguous = False
+
+        if new_checkpoint != checkpoint:
+            new_checkpoints[username] = new_checkpoint
+
+    return unprocessed_images, new_checkpoints
+
+def reconcile_resume_checkpoints(image_folder_param, today_str=None):
+    """
+    Advances each user's checkpoint past the days whose images are all in the processed index,
+    without submitting anything. Called by the storage tiering pass, so checkpoints keep moving
+    while the bot stays up between restarts. Returns {username: new checkpoint date}.
+    """
+    _, new_checkpoints = find_unprocessed_images_since_checkpoint(
+        image_folder_param, sqlite_manager.get_resume_checkpoints(), set(),
+        modified_before=None, today_str=today_str or datetime.now().strftime("%Y-%m-%d")
+    )
+    for username, last_reconciled_date in new_checkpoints.items():
+        sqlite_manager.set_resume_checkpoint(username, last_reconciled_date)
+    return new_checkpoints
+
+def get_username_from_filename(filename_with_suffix):
+    """
+    Extracts the username from a '{username}-logYYYY-MM-DD-NNNNNN.jpg' filename.
+    """
+    username_match = re.match(r'(.+)-log\d{4}-\d{2}-\d{2}-', filename_with_suffix)
+    return username_match.group(1) if username_match else "unknown_user"
+
 def process_single_unprocessed_image_for_resume(loop, bot_instance, full_image_path: str, 
                                                 extract_timestamp_func, insert_missed_record_func, save_data_to_local_excel_func, # เปลี่ยนชื่อ param
                                                 excel_base_folder_param): # ลบ google_sheet_id_param, google_sheets_credentials_file_param, google_sheets_scope_param
@@ -61,12 +205,14 @@ def process_single_unprocessed_image_for_resume(loop, bot_instance, full_image_p
     logging.info(f"[RESUME] Processing unprocessed image: {full_image_path}")
 
     filename_with_suffix = os.path.basename(full_image_path)
-    username_match = re.match(r'(.+)-log\d{4}-\d{2}-\d{2}-', filename_with_suffix)
-    username = username_match.group(1) if username_match else "unknown_user"
+    username = get_username_from_filename(filename_with_suffix)
     
     bot_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    extracted_image_timestamp_for_excel = bot_timestamp 
+    extracted_image_timestamp_for_excel = extract_timestamp_func(full_image_path, username=username)
+    if extracted_image_timestamp_for_excel is None:
+        extracted_image_timestamp_for_excel = bot_timestamp # OCR อ่านไม่ได้ ใช้ bot_timestamp แทน
+        insert_missed_record_func(filename_with_suffix, bot_timestamp)
     
     try:
         # เรียกใช้ฟังก์ชันบันทึกข้อมูลเฉพาะ Local Excel
@@ -77,29 +223,49 @@ def process_single_unprocessed_image_for_resume(loop, bot_instance, full_image_p
         logging.info(f"[RESUME] ✅ Finished inserting record for '{filename_with_suffix}'.")
     except Exception as e:
         logging.error(f"[RESUME] ❌ Error saving data for '{filename_with_suffix}': {e}")
+        raise # ให้ job queue ลองใหม่ตาม backoff
         
     logging.info(f"[RESUME] Finished processing for {filename_with_suffix}")
 
-def resume_unprocessed_tasks_init(bot_instance_param, image_folder_param, excel_base_folder_param, # ลบ google_sheet_id_param, google_sheets_credentials_file_param, google_sheets_scope_param
-                                  extract_timestamp_func, insert_missed_record_func, save_data_to_local_excel_func): # เปลี่ยนชื่อ param
+def register_resume_job_handler(extract_timestamp_func, insert_missed_record_func, save_data_to_local_excel_func,
+                                excel_base_folder_param):
+    """
+    Registers the job queue handler that processes one resumed image per job.
+    Must be called before the job queue workers start, so resume jobs persisted by a previous run can be handled.
+    """
+    def handle_resume_job(payload):
+        process_single_unprocessed_image_for_resume(None, None, payload["full_image_path"],
+                                                    extract_timestamp_func, insert_missed_record_func,
+                                                    save_data_to_local_excel_func, excel_base_folder_param)
+    job_queue_manager.register_job_handler(RESUME_JOB, handle_resume_job)
+
+def resume_unprocessed_tasks_init(image_folder_param, excel_base_folder_param):
     """
-    Initiates the process of finding and processing any unprocessed images.
-    This runs when the bot starts up.
+    Initiates the process of finding any unprocessed images and submits one job per image.
+    This runs in the background when the bot starts up; submitting blocks while the job queue is full.
     """
     logging.info("Checking for any unprocessed images from previous sessions...")
+    resume_started_at = time.time()
     
-    processed_files_set = get_processed_image_filenames_for_resume(excel_base_folder_param) # ลบ params
+    bootstrap_processed_index(excel_base_folder_param)
+    bootstrap_image_records(excel_base_folder_param)
+    queued_filenames = job_queue_manager.get_outstanding_payload_values("filename", "filenames") # งานที่ยังค้างอยู่ในคิว
     
-    unprocessed_images = find_unprocessed_images_for_resume(image_folder_param, processed_files_set)
+    unprocessed_images, new_checkpoints = find_unprocessed_images_since_checkpoint(
+        image_folder_param, sqlite_manager.get_resume_checkpoints(), queued_filenames,
+        modified_before=resume_started_at, today_str=datetime.now().strftime("%Y-%m-%d")
+    )
+    for username, last_reconciled_date in new_checkpoints.items():
+        sqlite_manager.set_resume_checkpoint(username, last_reconciled_date)
     
     if unprocessed_images:
-        logging.info(f"Found {len(unprocessed_images)} unprocessed images. Starting background processing...")
-        current_loop = asyncio.get_event_loop()
+        logging.info(f"Found {len(unprocessed_images)} unprocessed images. Submitting them to the job queue...")
         for img_path in unprocessed_images:
-            thread = threading.Thread(target=process_single_unprocessed_image_for_resume,
-                                      args=(current_loop, bot_instance_param, img_path,
-                                            extract_timestamp_func, insert_missed_record_func, save_data_to_local_excel_func,
-                                            excel_base_folder_param)) # ลบ params
-            thread.start()
+            filename_with_suffix = os.path.basename(img_path)
+            job_queue_manager.submit_job(RESUME_JOB,
+                                         {"full_image_path": img_path, "filename": filename_with_suffix},
+                                         partition_key=get_username_from_filename(filename_with_suffix),
+                                         background=True) # ไม่แย่งช่องในคิวของรูปที่ผู้ใช้ส่งเข้ามา
+        logging.info(f"All {len(unprocessed_images)} unprocessed images submitted.")
     else:
-        logging.info("No unprocessed images found. All tasks are up-to-date.")
\ No newline at end of file
+        logging.info("No unprocessed images found. All tasks are up-to-date.")
@@ -0,0 +1,56 @@
+import os
+import re
+import logging
+import threading
+
+# --- Daily Filename Sequence Allocator ---
+# เก็บเลขลำดับล่าสุดของแต่ละ (username, วันที่) ไว้ในหน่วยความจำ อ่านโฟลเดอร์เพียงครั้งเดียวต่อวัน
+_sequence_lock = threading.Lock()
+_last_sequence = {}  # (username, date_str) -> last allocated suffix number
+
+def _scan_highest_suffix(date_folder_path, base_filename_prefix):
+    """
+    Returns the highest NNNNNN suffix already used in the folder (0 if none).
+    """
+    pattern = re.compile(re.escape(base_filename_prefix) + r'-(\d{6})\.jpg$')
+    highest = 0
+    try:
+        for name in os.listdir(date_folder_path):
+            match = pattern.match(name)
+            if match:
+                highest = max(highest, int(match.group(1)))
+    except FileNotFoundError:
+        pass
+    return highest
+
+def allocate_daily_filename(date_folder_path, username, date_str, max_daily_images):
+    """
+    Hands out the next '{username}-log{date}-{NNNNNN}.jpg' name for the user and day.
+    The folder is scanned once to seed the counter; afterwards allocation is a dict lookup under a lock,
+    so concurrent photos from the same user never get the same name.
+    Returns None when max_daily_images has been reached.
+    """
+    key = (username, date_str)
+    base_filename_prefix = f"{username}-log{date_str}"
+
+    with _sequence_lock:
+        last_number = _last_sequence.get(key)
+    if last_number is None:
+        highest = _scan_highest_suffix(date_folder_path, base_filename_prefix)
+
+    with _sequence_lock:
+        if key not in _last_sequence:
+            # ลบตัวนับของวันก่อน ๆ ของผู้ใช้คนนี้ เพื่อไม่ให้ dict โตขึ้นเรื่อย ๆ
+            for old_key in [k for k in _last_sequence if k[0] == username]:
+                del _last_sequence[old_key]
+            if last_number is not None:
+                # ถูกลบไประหว่างทาง (ข้ามวันพอดี) ต้องอ่านโฟลเดอร์ใหม่
+                highest = _scan_highest_suffix(date_folder_path, base_filename_prefix)
+            _last_sequence[key] = highest
+            logging.info(f"Seeded filename sequence for {username} on {date_str} at {highest}.")
+
+        next_number = _last_sequence[key] + 1
+        if next_number > max_daily_images:
+            return None
+        _last_sequence[key] = next_number
+    return f"{base_filename_prefix}-{next_number:06}.jpg"
@@ -0,0 +1,132 @@
+import os
+import time
+import zlib
+import signal
+import atexit
+import logging
+import threading
+import multiprocessing
+
+# --- Sharded Worker Processes ---
+# process หน้าบ้าน (รับข้อความจาก Telegram) ส่งงานผ่าน job queue ไปยัง worker process ตาม hash ของ username
+# ผู้ใช้หนึ่งคนอยู่ใน shard เดียวเสมอ ลำดับงานของผู้ใช้จึงเหมือนเดิม และไฟล์ Excel ของผู้ใช้มีเจ้าของเพียง process เดียว
+MONITOR_INTERVAL_SECONDS = 5 # ตรวจว่า worker process ยังทำงานอยู่ ถ้าตายจะเริ่มใหม่
+STOP_TIMEOUT_SECONDS = 60 # ต้องมากกว่าเวลาที่ worker รองาน (SHUTDOWN_DRAIN_SECONDS) บวกเวลาเขียน Excel ตอนปิด
+
+_context = multiprocessing.get_context("spawn") # เหมือนกันทุกระบบ (Windows มีแค่ spawn)
+# ใช้ Semaphore แทน Event: Event มี lock ภายในที่ค้างถาวรถ้า process ถูก kill ระหว่าง wait แล้ว set() ของอีกฝั่งจะค้างตาม
+_wake_signals = []  # shard index -> Semaphore released by the front process when it submits a job for that shard
+_stop_signals = []  # shard index -> Semaphore released once to ask the worker to stop
+_processes = []
+_target = None
+_target_args = ()
+_processes_lock = threading.Lock()
+_monitor_thread = None
+_stopping = threading.Event()
+
+def get_shard(key, shard_count):
+    """
+    Returns the shard of a partition key (username). Stable across runs and processes,
+    unlike hash(), which is randomized per process.
+    """
+    if shard_count <= 1 or key is None:
+        return 0
+    return zlib.crc32(key.encode("utf-8")) % shard_count
+
+def get_shard_filename(path, shard_index):
+    """
+    Per-shard variant of a file name: bot_activity.log -> bot_activity.shard2.log
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard{shard_index}{extension}"
+
+def create_wake_signals(shard_count):
+    """
+    Creates one cross-process wake-up signal per shard, to be handed to the job queue before the workers start.
+    """
+    _wake_signals[:] = [_context.Semaphore(0) for _ in range(shard_count)]
+    _stop_signals[:] = [_context.Semaphore(0) for _ in range(shard_count)]
+    return list(_wake_signals)
+
+def _spawn(shard_index):
+    process = _context.Process(target=_target, name=f"shard-worker-{shard_index}",
+                               args=(shard_index, len(_wake_signals), _wake_signals[shard_index],
+                                     _stop_signals[shard_index], *_target_args))
+    process.start()
+    logging.info(f"Shard worker {shard_index} started (pid {process.pid}).")
+    return process
+
+def start_shard_workers(target, args=()):
+    """
+    Starts one process per shard (see create_wake_signals) running
+    target(shard_index, shard_count, wake_signal, stop_signal, *args), plus a thread that
+    restarts a shard whose process dies. target must be importable by the child (module level).
+    """
+    global _target, _target_args, _monitor_thread
+    if _processes:
+        return
+    _target = target
+    _target_args = tuple(args)
+    _stopping.clear()
+    with _processes_lock:
+        _processes[:] = [_spawn(shard_index) for shard_index in range(len(_wake_signals))]
+    _monitor_thread = threading.Thread(target=_monitor_loop, name="shard-monitor", daemon=True)
+    _monitor_thread.start()
+
+def _monitor_loop():
+    while not _stopping.wait(MONITOR_INTERVAL_SECONDS):
+        with _processes_lock:
+            for shard_index, process in enumerate(_processes):
+                if process.is_alive() or _stopping.is_set():
+                    continue
+                logging.error(f"❌ Shard worker {shard_index} exited with code {process.exitcode}, restarting.")
+                _processes[shard_index] = _spawn(shard_index)
+
+def get_alive_count():
+    with _processes_lock:
+        return sum(1 for process in _processes if process.is_alive())
+
+def wait_for_stop(stop_signal, poll_seconds=1.0):
+    """
+    Called in a worker process: blocks until the front process asks it to stop or goes away.
+    """
+    parent = multiprocessing.parent_process()
+    while not stop_signal.acquire(timeout=poll_seconds):
+        if parent is not None and not parent.is_alive():
+            logging.warning("Front process is gone, shard worker stopping.")
+            return
+
+def handle_stop_signals(stop_signal):
+    """
+    Called in a worker process (main thread): SIGTERM and SIGINT, which a service manager or Ctrl+C
+    send to the whole process group, become a stop request instead of killing the worker mid-job.
+    """
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stop_signal.release())
+
+def stop_shard_workers(timeout=None):
+    """
+    Asks every worker to finish its current jobs and exit, then waits for them,
+    at most timeout seconds in total. Jobs still pending stay in the job queue for the next start.
+    """
+    global _monitor_thread
+    if not _processes:
+        return
+    _stopping.set()
+    if _monitor_thread is not None:
+        _monitor_thread.join()
+        _monitor_thread = None
+    for stop_signal in _stop_signals:
+        stop_signal.release()
+    timeout = STOP_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    with _processes_lock:
+        for shard_index, process in enumerate(_processes):
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning(f"Shard worker {shard_index} did not stop in {timeout}s, terminating.")
+                process.terminate()
+                process.join()
+        _processes.clear()
+
+atexit.register(stop_shard_workers)
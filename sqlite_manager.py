@@ -1,19 +1,179 @@
+import time
+import queue
+import atexit
 import sqlite3
 import logging
+import threading
+from datetime import timedelta
+from contextlib import contextmanager
 
-# Constants (เหล่านี้จะถูกกำหนดในไฟล์หลัก และเข้าถึงได้จาก global scope)
-# เพื่อให้โมดูลนี้สามารถทำงานได้จริง ต้องมั่นใจว่าค่าเหล่านี้ถูกกำหนดใน main.py แล้ว
+import metrics_manager
+
+# --- SQLite Storage ---
+# ทุกการเข้าถึง ml_feedback.db ผ่านโมดูลนี้: หนึ่ง connection ต่อ thread (WAL) และ writer เบื้องหลังที่รวม insert เป็น transaction เดียว
 ML_FEEDBACK_DB = "ml_feedback.db" 
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+BATCH_WRITE_INTERVAL_SECONDS = 1.0 # รวม insert ที่เข้ามาในช่วงนี้เป็น transaction เดียว
+BATCH_WRITE_MAX_STATEMENTS = 500
+BATCH_WRITE_ATTEMPTS = 3 # ชุดที่เขียนไม่สำเร็จจะลองใหม่ก่อน แล้วค่อยเขียนทีละคำสั่ง
+
+_local = threading.local()
+_write_queue = queue.Queue()  # (sql, rows) waiting for the batch writer
+_batch_writer_thread = None
+_batch_writer_stop = threading.Event()
+
+def _get_connection():
+    """
+    Returns this thread's connection to ML_FEEDBACK_DB, opening it on first use.
+    Statements are cached per connection, so repeated queries are prepared once.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db_path != ML_FEEDBACK_DB:
+        conn = sqlite3.connect(ML_FEEDBACK_DB, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None,
+                               cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.db_path = ML_FEEDBACK_DB
+    return conn
+
+@contextmanager
+def _transaction():
+    """
+    Runs the block in one write transaction. BEGIN IMMEDIATE takes the write lock up front,
+    so concurrent writers wait on busy_timeout instead of failing with 'database is locked'.
+    """
+    conn = _get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _execute_batch(batch):
+    with _transaction() as conn:
+        for sql, rows in batch:
+            conn.executemany(sql, rows)
+
+def _write_batch_with_retry(batch):
+    """
+    Commits a batch, retrying it BATCH_WRITE_ATTEMPTS times (e.g. 'database is locked' past the busy timeout).
+    If it still fails, the statements are committed one by one, so one bad statement does not drop the rest.
+    """
+    for attempt in range(1, BATCH_WRITE_ATTEMPTS + 1):
+        try:
+            _execute_batch(batch)
+            return
+        except sqlite3.Error as e:
+            logging.warning(f"Error writing batch of {len(batch)} statement(s) to SQLite "
+                            f"(attempt {attempt}/{BATCH_WRITE_ATTEMPTS}): {e}")
+            if attempt < BATCH_WRITE_ATTEMPTS:
+                time.sleep(BATCH_WRITE_INTERVAL_SECONDS * attempt)
+    for statement in batch:
+        try:
+            _execute_batch([statement])
+        except sqlite3.Error as e:
+            logging.error(f"Dropping SQLite statement after {BATCH_WRITE_ATTEMPTS} failed batch attempts: {e}")
+            metrics_manager.increment("sqlite_writes_dropped_total")
+
+def _queue_write(sql, rows):
+    """
+    Hands the statement to the batch writer, or runs it right away when the writer is not running.
+    """
+    if _batch_writer_thread is not None and _batch_writer_thread.is_alive():
+        _write_queue.put((sql, rows))
+    else:
+        _execute_batch([(sql, rows)])
+
+def _batch_writer_loop():
+    while True:
+        try:
+            first = _write_queue.get(timeout=BATCH_WRITE_INTERVAL_SECONDS)
+        except queue.Empty:
+            if _batch_writer_stop.is_set():
+                return
+            continue
+
+        batch = [first]
+        deadline = time.monotonic() + BATCH_WRITE_INTERVAL_SECONDS
+        while len(batch) < BATCH_WRITE_MAX_STATEMENTS and not _batch_writer_stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_write_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        while len(batch) < BATCH_WRITE_MAX_STATEMENTS:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
 
-def initialize_sqlite_db():
+        started = time.perf_counter()
+        try:
+            _write_batch_with_retry(batch)
+            metrics_manager.observe("sqlite_batch_write_seconds", time.perf_counter() - started)
+        finally:
+            for _ in batch:
+                _write_queue.task_done()
+
+def get_pending_write_count():
+    return _write_queue.qsize()
+
+def start_batch_writer():
+    """
+    Starts the background thread that commits queued inserts once per BATCH_WRITE_INTERVAL_SECONDS.
+    """
+    global _batch_writer_thread
+    if _batch_writer_thread is not None and _batch_writer_thread.is_alive():
+        return
+    _batch_writer_stop.clear()
+    _batch_writer_thread = threading.Thread(target=_batch_writer_loop, name="sqlite-batch-writer", daemon=True)
+    _batch_writer_thread.start()
+    logging.info(f"SQLite batch writer started (interval {BATCH_WRITE_INTERVAL_SECONDS}s).")
+
+def flush_pending_writes():
+    """
+    Blocks until every queued write has been committed.
+    """
+    if _batch_writer_thread is not None and _batch_writer_thread.is_alive():
+        _write_queue.join()
+
+def stop_batch_writer():
+    """
+    Commits everything still queued and stops the writer thread.
+    """
+    global _batch_writer_thread
+    if _batch_writer_thread is None:
+        return
+    _batch_writer_stop.set()
+    _batch_writer_thread.join()
+    _batch_writer_thread = None
+    leftover = []
+    while True:
+        try:
+            leftover.append(_write_queue.get_nowait())
+        except queue.Empty:
+            break
+    if leftover:
+        _write_batch_with_retry(leftover)
+        for _ in leftover:
+            _write_queue.task_done()
+
+atexit.register(stop_batch_writer)
+
+def initialize_sqlite_db(db_path=None):
     """
     Initializes the SQLite database and creates the 'missed_timestamps' table if it doesn't exist.
     """
-    conn = None
+    global ML_FEEDBACK_DB
+    if db_path:
+        ML_FEEDBACK_DB = db_path
     try:
-        conn = sqlite3.connect(ML_FEEDBACK_DB)
-        cursor = conn.cursor()
-        cursor.execute('''
+        _get_connection().execute('''
             CREATE TABLE IF NOT EXISTS missed_timestamps (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 image_filename TEXT NOT NULL UNIQUE,
@@ -23,33 +183,516 @@ def initialize_sqlite_db():
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        conn.commit()
         logging.info(f"SQLite database '{ML_FEEDBACK_DB}' and table 'missed_timestamps' initialized.")
     except sqlite3.Error as e:
         logging.error(f"Error initializing SQLite database: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def insert_missed_timestamp_record(image_filename, timestamp_from_bot):
     """
-    Inserts a record into the 'missed_timestamps' table for images where OCR failed or was skipped.
+    Records an image where OCR failed or was skipped. The insert is committed by the batch writer;
+    filenames that are already recorded are ignored.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(ML_FEEDBACK_DB)
+        _queue_write('''
+            INSERT OR IGNORE INTO missed_timestamps (image_filename, timestamp_from_bot)
+            VALUES (?, ?)
+        ''', [(image_filename, timestamp_from_bot)])
+        logging.info(f"Recorded missed timestamp for '{image_filename}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Error inserting into missed_timestamps: {e}")
+
+# --- Processed Image Index (used by resume) ---
+def initialize_processed_index():
+    """
+    Creates the tables that record every saved image filename and the per-user resume checkpoint.
+    """
+    try:
+        conn = _get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT OR IGNORE INTO missed_timestamps (image_filename, timestamp_from_bot)
+            CREATE TABLE IF NOT EXISTS processed_images (
+                image_filename TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                recorded_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS resume_checkpoints (
+                username TEXT PRIMARY KEY,
+                last_reconciled_date TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS index_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        logging.info(f"Processed image index initialized in '{ML_FEEDBACK_DB}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Error initializing processed image index: {e}")
+
+def mark_images_processed(rows):
+    """
+    Records (image_filename, username) pairs as saved, committed before returning (not through the batch
+    writer, which may still hold or drop them). Already known filenames are ignored.
+    Used by the one-time bootstrap; photos saved by jobs go through record_saved_images.
+    Returns True once committed.
+    """
+    try:
+        with _transaction() as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO processed_images (image_filename, username)
+                VALUES (?, ?)
+            ''', list(rows))
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"Error updating processed image index: {e}")
+        return False
+
+def get_processed_filenames(filenames):
+    """
+    Returns the subset of filenames that are already in the processed image index.
+    """
+    filenames = list(filenames)
+    found = set()
+    try:
+        conn = _get_connection()
+        for i in range(0, len(filenames), 500):
+            chunk = filenames[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = conn.execute(
+                f"SELECT image_filename FROM processed_images WHERE image_filename IN ({placeholders})", chunk
+            )
+            found.update(row[0] for row in cursor)
+    except sqlite3.Error as e:
+        logging.error(f"Error reading processed image index: {e}")
+    return found
+
+def get_index_meta(key):
+    try:
+        conn = _get_connection()
+        row = conn.execute("SELECT value FROM index_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logging.error(f"Error reading index meta '{key}': {e}")
+        return None
+
+def set_index_meta(key, value):
+    try:
+        conn = _get_connection()
+        conn.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)", (key, value))
+    except sqlite3.Error as e:
+        logging.error(f"Error writing index meta '{key}': {e}")
+
+def get_resume_checkpoints():
+    """
+    Returns {username: last_reconciled_date} for every user with a checkpoint.
+    """
+    try:
+        conn = _get_connection()
+        return dict(conn.execute("SELECT username, last_reconciled_date FROM resume_checkpoints"))
+    except sqlite3.Error as e:
+        logging.error(f"Error reading resume checkpoints: {e}")
+        return {}
+
+def set_resume_checkpoint(username, last_reconciled_date):
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            INSERT OR REPLACE INTO resume_checkpoints (username, last_reconciled_date)
             VALUES (?, ?)
-        ''', (image_filename, timestamp_from_bot))
-        conn.commit()
-        if cursor.rowcount > 0:
-            logging.info(f"Inserted missed timestamp record for '{image_filename}' into SQLite.")
+        ''', (username, last_reconciled_date))
+    except sqlite3.Error as e:
+        logging.error(f"Error writing resume checkpoint for '{username}': {e}")
+
+
+# --- OCR ROI Statistics ---
+def initialize_roi_stats():
+    """
+    Creates the table that counts, per user and image resolution, how often each ROI was tried and produced a timestamp.
+    """
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS roi_stats (
+                username TEXT NOT NULL,
+                resolution TEXT NOT NULL,
+                roi_index INTEGER NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (username, resolution, roi_index)
+            )
+        ''')
+        logging.info(f"ROI statistics table initialized in '{ML_FEEDBACK_DB}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Error initializing ROI statistics: {e}")
+
+def record_roi_attempts(username, resolution, tried_rois, hit_roi_index):
+    """
+    Adds one attempt for every ROI that was OCR'd and one hit for the ROI that produced the timestamp.
+    """
+    if not tried_rois or not resolution:
+        return
+    try:
+        _queue_write('''
+            INSERT INTO roi_stats (username, resolution, roi_index, hits, attempts)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (username, resolution, roi_index)
+            DO UPDATE SET hits = hits + excluded.hits, attempts = attempts + 1
+        ''', [(username, resolution, roi_index, 1 if roi_index == hit_roi_index else 0) for roi_index in tried_rois])
+    except sqlite3.Error as e:
+        logging.error(f"Error recording ROI statistics for '{username}': {e}")
+
+def get_roi_stats(username, resolution=None):
+    """
+    Returns {roi_index: (hits, attempts)} for the user and resolution,
+    or summed over all of the user's resolutions when resolution is None.
+    """
+    try:
+        conn = _get_connection()
+        if resolution:
+            cursor = conn.execute(
+                "SELECT roi_index, hits, attempts FROM roi_stats WHERE username = ? AND resolution = ?",
+                (username, resolution))
         else:
-            logging.info(f"Record for '{image_filename}' already exists in SQLite (ignored).")
+            cursor = conn.execute(
+                "SELECT roi_index, SUM(hits), SUM(attempts) FROM roi_stats WHERE username = ? GROUP BY roi_index",
+                (username,))
+        return {roi_index: (hits, attempts) for roi_index, hits, attempts in cursor}
     except sqlite3.Error as e:
-        logging.error(f"Error inserting into missed_timestamps: {e}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        logging.error(f"Error reading ROI statistics for '{username}': {e}")
+        return {}
+
+
+# --- Image Hashes (duplicate detection) ---
+IMAGE_HASH_MAX_ROWS = 200000 # เก็บเฉพาะรูปที่เห็นล่าสุด รายการเก่าสุดจะถูกลบ (LRU)
+IMAGE_HASH_PRUNE_EVERY = 1000
+
+def initialize_image_hashes():
+    """
+    Creates the table mapping (username, content hash) to the stored filename and extracted timestamp.
+    """
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                username TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                perceptual_hash INTEGER,
+                image_filename TEXT NOT NULL,
+                extracted_timestamp TEXT,
+                last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (username, content_hash)
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_image_hashes_last_seen ON image_hashes (last_seen)")
+        logging.info(f"Image hash table initialized in '{ML_FEEDBACK_DB}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Error initializing image hash table: {e}")
+
+def get_image_hash_record(username, content_hash):
+    """
+    Returns the stored record for the photo (and marks it as recently seen), or None.
+    """
+    try:
+        conn = _get_connection()
+        row = conn.execute('''
+            SELECT perceptual_hash, image_filename, extracted_timestamp FROM image_hashes
+            WHERE username = ? AND content_hash = ?
+        ''', (username, content_hash)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE image_hashes SET last_seen = CURRENT_TIMESTAMP WHERE username = ? AND content_hash = ?",
+                     (username, content_hash))
+        return {"username": username, "content_hash": content_hash, "perceptual_hash": row[0],
+                "image_filename": row[1], "extracted_timestamp": row[2]}
+    except sqlite3.Error as e:
+        logging.error(f"Error reading image hash for '{username}': {e}")
+        return None
+
+def insert_image_hash_record(record):
+    try:
+        with _transaction() as conn:
+            cursor = conn.execute('''
+                INSERT OR REPLACE INTO image_hashes (username, content_hash, perceptual_hash, image_filename, extracted_timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (record["username"], record["content_hash"], record["perceptual_hash"],
+                  record["image_filename"], record["extracted_timestamp"]))
+            if cursor.lastrowid % IMAGE_HASH_PRUNE_EVERY == 0:
+                conn.execute('''
+                    DELETE FROM image_hashes WHERE rowid IN (
+                        SELECT rowid FROM image_hashes ORDER BY last_seen DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (IMAGE_HASH_MAX_ROWS,))
+    except sqlite3.Error as e:
+        logging.error(f"Error inserting image hash for '{record['image_filename']}': {e}")
+
+def delete_image_hash_record(username, content_hash, image_filename):
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            DELETE FROM image_hashes WHERE username = ? AND content_hash = ? AND image_filename = ?
+        ''', (username, content_hash, image_filename))
+    except sqlite3.Error as e:
+        logging.error(f"Error deleting image hash for '{image_filename}': {e}")
+
+def update_image_hash_timestamp(username, content_hash, extracted_timestamp):
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            UPDATE image_hashes SET extracted_timestamp = ?
+            WHERE username = ? AND content_hash = ?
+        ''', (extracted_timestamp, username, content_hash))
+    except sqlite3.Error as e:
+        logging.error(f"Error updating image hash timestamp for '{username}': {e}")
+
+
+# --- Image Records (stats / history) ---
+# สำเนาของแถวใน Excel พร้อม index สำหรับ /stats, /history และรายงาน โดยไม่ต้องเปิดไฟล์ Excel
+def initialize_image_records():
+    """
+    Creates the image_records table (indexed by filename and by (username, bot_timestamp)) and the
+    per-user/day counters. The counters are kept up to date by a trigger, so a record that is
+    inserted twice (INSERT OR IGNORE) is only counted once.
+    """
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS image_records (
+                image_filename TEXT PRIMARY KEY,
+                username TEXT NOT NULL COLLATE NOCASE,
+                bot_timestamp TEXT NOT NULL,
+                extracted_timestamp TEXT
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_image_records_user_time ON image_records (username, bot_timestamp)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS daily_image_counts (
+                username TEXT NOT NULL COLLATE NOCASE,
+                day TEXT NOT NULL,
+                photos INTEGER NOT NULL DEFAULT 0,
+                ocr_missed INTEGER NOT NULL DEFAULT 0,
+                first_bot_timestamp TEXT,
+                last_bot_timestamp TEXT,
+                PRIMARY KEY (username, day)
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_image_records_daily_counts AFTER INSERT ON image_records
+            BEGIN
+                INSERT INTO daily_image_counts (username, day, photos, ocr_missed, first_bot_timestamp, last_bot_timestamp)
+                VALUES (NEW.username, substr(NEW.bot_timestamp, 1, 10), 1,
+                        NEW.extracted_timestamp IS NULL OR NEW.extracted_timestamp = NEW.bot_timestamp,
+                        NEW.bot_timestamp, NEW.bot_timestamp)
+                ON CONFLICT (username, day) DO UPDATE SET
+                    photos = photos + 1,
+                    ocr_missed = ocr_missed + excluded.ocr_missed,
+                    first_bot_timestamp = min(first_bot_timestamp, excluded.first_bot_timestamp),
+                    last_bot_timestamp = max(last_bot_timestamp, excluded.last_bot_timestamp);
+            END
+        ''')
+        logging.info(f"Image record tables initialized in '{ML_FEEDBACK_DB}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Error initializing image records: {e}")
+
+def record_images(rows):
+    """
+    Records (username, bot_timestamp, image_filename, extracted_timestamp) rows through the batch writer.
+    Already recorded filenames are ignored. Used by the one-time bootstrap.
+    """
+    try:
+        _queue_write('''
+            INSERT OR IGNORE INTO image_records (username, bot_timestamp, image_filename, extracted_timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', list(rows))
+    except sqlite3.Error as e:
+        logging.error(f"Error recording image metadata: {e}")
+
+def record_saved_images(rows):
+    """
+    Records (username, bot_timestamp, image_filename, extracted_timestamp) rows of photos just written to a
+    ledger in the processed index and the image records, committed before returning: once the job that
+    saved them is done, resume must see them. Raises sqlite3.Error so the job is retried.
+    """
+    rows = list(rows)
+    try:
+        with _transaction() as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO processed_images (image_filename, username)
+                VALUES (?, ?)
+            ''', [(image_filename, username) for username, _, image_filename, _ in rows])
+            conn.executemany('''
+                INSERT OR IGNORE INTO image_records (username, bot_timestamp, image_filename, extracted_timestamp)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+    except sqlite3.Error as e:
+        logging.error(f"Error recording {len(rows)} saved image(s) in the processed index: {e}")
+        raise
+
+def get_image_record(image_filename):
+    """
+    Returns (username, bot_timestamp, image_filename, extracted_timestamp) for the filename, or None.
+    """
+    try:
+        conn = _get_connection()
+        return conn.execute('''
+            SELECT username, bot_timestamp, image_filename, extracted_timestamp FROM image_records
+            WHERE image_filename = ?
+        ''', (image_filename,)).fetchone()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading image record '{image_filename}': {e}")
+        return None
+
+def get_image_history(username, limit=10, before=None):
+    """
+    Returns the user's latest records, newest first, as (bot_timestamp, image_filename, extracted_timestamp).
+    With before (a bot timestamp string), only records older than it are returned.
+    """
+    try:
+        conn = _get_connection()
+        if before:
+            cursor = conn.execute('''
+                SELECT bot_timestamp, image_filename, extracted_timestamp FROM image_records
+                WHERE username = ? AND bot_timestamp < ?
+                ORDER BY bot_timestamp DESC LIMIT ?
+            ''', (username, before, limit))
+        else:
+            cursor = conn.execute('''
+                SELECT bot_timestamp, image_filename, extracted_timestamp FROM image_records
+                WHERE username = ?
+                ORDER BY bot_timestamp DESC LIMIT ?
+            ''', (username, limit))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading image history for '{username}': {e}")
+        return []
+
+def get_daily_image_counts(username, start_day, end_day):
+    """
+    Returns [(day, photos, ocr_missed, first_bot_timestamp, last_bot_timestamp)] for the user,
+    for days from start_day to end_day (YYYY-MM-DD, inclusive) that have records.
+    """
+    try:
+        conn = _get_connection()
+        return conn.execute('''
+            SELECT day, photos, ocr_missed, first_bot_timestamp, last_bot_timestamp FROM daily_image_counts
+            WHERE username = ? AND day BETWEEN ? AND ?
+            ORDER BY day
+        ''', (username, start_day, end_day)).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading daily image counts for '{username}': {e}")
+        return []
+
+def get_image_count_totals(start_day, end_day):
+    """
+    Returns [(username, photos, ocr_missed, last_bot_timestamp)] summed over start_day..end_day, busiest user first.
+    """
+    try:
+        conn = _get_connection()
+        return conn.execute('''
+            SELECT username, SUM(photos), SUM(ocr_missed), MAX(last_bot_timestamp) FROM daily_image_counts
+            WHERE day BETWEEN ? AND ?
+            GROUP BY username ORDER BY SUM(photos) DESC, username
+        ''', (start_day, end_day)).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading image count totals: {e}")
+        return []
+
+def iter_image_records(start_date, end_date, usernames=None):
+    """
+    Yields [username, bot_timestamp, image_filename, extracted_timestamp] for records whose bot timestamp
+    falls within start_date..end_date (inclusive), ordered by user and time.
+    """
+    conn = _get_connection()
+    start_text = start_date.isoformat()
+    end_text = (end_date + timedelta(days=1)).isoformat()
+    if usernames:
+        for username in usernames:
+            cursor = conn.execute('''
+                SELECT username, bot_timestamp, image_filename, extracted_timestamp FROM image_records
+                WHERE username = ? AND bot_timestamp >= ? AND bot_timestamp < ?
+                ORDER BY bot_timestamp
+            ''', (username, start_text, end_text))
+            for row in cursor:
+                yield list(row)
+    else:
+        cursor = conn.execute('''
+            SELECT username, bot_timestamp, image_filename, extracted_timestamp FROM image_records
+            WHERE bot_timestamp >= ? AND bot_timestamp < ?
+            ORDER BY username, bot_timestamp
+        ''', (start_text, end_text))
+        for row in cursor:
+            yield list(row)
+
+
+# --- Image Storage Tiers ---
+def initialize_storage_index():
+    """
+    Creates the tables that record which day folders were recompressed and where archived images live.
+    """
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS recompressed_days (
+                username TEXT NOT NULL,
+                day TEXT NOT NULL,
+                bytes_before INTEGER NOT NULL,
+                bytes_after INTEGER NOT NULL,
+                recompressed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (username, day)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS archived_images (
+                image_filename TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                archive_path TEXT NOT NULL,
+                member_name TEXT NOT NULL,
+                archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        logging.info(f"Image storage index initialized in '{ML_FEEDBACK_DB}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Error initializing image storage index: {e}")
+
+def get_recompressed_days(username):
+    try:
+        conn = _get_connection()
+        return {row[0] for row in conn.execute("SELECT day FROM recompressed_days WHERE username = ?", (username,))}
+    except sqlite3.Error as e:
+        logging.error(f"Error reading recompressed days for '{username}': {e}")
+        return set()
+
+def mark_day_recompressed(username, day, bytes_before, bytes_after):
+    try:
+        conn = _get_connection()
+        conn.execute('''
+            INSERT OR REPLACE INTO recompressed_days (username, day, bytes_before, bytes_after)
+            VALUES (?, ?, ?, ?)
+        ''', (username, day, bytes_before, bytes_after))
+    except sqlite3.Error as e:
+        logging.error(f"Error marking {day} recompressed for '{username}': {e}")
+
+def record_archived_images(rows):
+    """
+    Records (image_filename, username, archive_path, member_name) rows. Committed before returning
+    (not through the batch writer), because the originals are deleted right after.
+    """
+    with _transaction() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO archived_images (image_filename, username, archive_path, member_name)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+def get_archived_image(image_filename):
+    """
+    Returns (archive_path, member_name) for an archived image, or None.
+    """
+    try:
+        conn = _get_connection()
+        return conn.execute("SELECT archive_path, member_name FROM archived_images WHERE image_filename = ?",
+                            (image_filename,)).fetchone()
+    except sqlite3.Error as e:
+        logging.error(f"Error reading archive location of '{image_filename}': {e}")
+        return None
@@ -0,0 +1,49 @@
+import sys
+import time
+import logging
+
+# --- Startup Profiler ---
+# จับเวลาแต่ละช่วงของการเริ่มโปรแกรม (import, init) จนถึง run_polling
+# สำหรับรายละเอียดราย import ใช้: python -X importtime TelegrambotTimestamp.py --startup-report
+STARTUP_REPORT_FLAG = "--startup-report"
+HEAVY_MODULES = ("cv2", "numpy", "pytesseract", "PIL", "openpyxl", "tesserocr", "telegram")
+
+_started = time.perf_counter()
+_marks = []  # (label, perf_counter) in order
+
+def is_report_requested(argv=None):
+    return STARTUP_REPORT_FLAG in (sys.argv if argv is None else argv)
+
+def mark(label):
+    """
+    Records the end of a startup phase; its duration is the time since the previous mark.
+    """
+    _marks.append((label, time.perf_counter()))
+
+def get_elapsed_seconds():
+    return time.perf_counter() - _started
+
+def _get_peak_rss_mib():
+    try:
+        import resource
+    except ImportError:
+        return None # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+def format_report():
+    lines = ["Startup report:"]
+    previous = _started
+    for label, at in _marks:
+        lines.append(f"  {label:<32} {(at - previous) * 1000:8.1f} ms")
+        previous = at
+    lines.append(f"  {'total':<32} {(previous - _started) * 1000:8.1f} ms")
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    lines.append(f"  heavy modules loaded: {', '.join(loaded) if loaded else 'none'}")
+    peak_rss = _get_peak_rss_mib()
+    if peak_rss is not None:
+        lines.append(f"  peak RSS: {peak_rss:.1f} MiB")
+    return "\n".join(lines)
+
+def log_startup_time():
+    logging.info(f"Startup finished in {get_elapsed_seconds() * 1000:.0f} ms.")
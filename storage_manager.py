@@ -0,0 +1,318 @@
+import os
+import re
+import time
+import logging
+import zipfile
+import argparse
+import threading
+from datetime import date, timedelta
+
+import sqlite_manager
+import metrics_manager
+import resume_manager
+
+# --- Image Storage Tiering ---
+# รูปในโฟลเดอร์รายวันที่เก่ากว่ากำหนดจะถูกบีบอัด JPEG ใหม่ และเดือนที่ผ่านไปแล้วจะถูกรวมเป็น zip หนึ่งไฟล์ต่อผู้ใช้ต่อเดือน
+# ทำเฉพาะวันที่ resume ตรวจครบแล้ว (ไม่เกิน checkpoint ของผู้ใช้) และยังเรียกรูปได้จากชื่อไฟล์ log ผ่าน read_image
+IMAGE_FOLDER = "image_folder"
+RECOMPRESS_ENABLED = True
+RECOMPRESS_AFTER_DAYS = 14
+RECOMPRESS_JPEG_QUALITY = 75
+RECOMPRESS_MIN_SAVING = 0.10 # ไม่เขียนทับถ้าไฟล์เล็กลงน้อยกว่า 10%
+ARCHIVE_ENABLED = True
+ARCHIVE_AFTER_DAYS = 45 # เดือนที่วันสุดท้ายเก่ากว่านี้จะถูกรวมเป็น zip
+TIERING_INTERVAL_SECONDS = 6 * 60 * 60
+TIERING_START_DELAY_SECONDS = 10 * 60 # ไม่แย่ง CPU/ดิสก์ตอนบอทเพิ่งเริ่ม
+
+DATE_FOLDER_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+LOG_FILENAME_PATTERN = re.compile(r'^(?P<username>.+)-log(?P<day>\d{4}-\d{2}-\d{2})-\d{6}\.\w+$')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+_stop_event = threading.Event()
+_tiering_thread = None
+
+def get_archive_path(image_folder, username, month):
+    """
+    Returns the zip that holds one user's images for one month.
+    Format: image_folder/username/YYYY-MM-username.zip
+    """
+    return os.path.join(image_folder, username, f"{month}-{username}.zip")
+
+def _list_day_folders(user_path):
+    return sorted(name for name in os.listdir(user_path)
+                  if DATE_FOLDER_PATTERN.match(name) and os.path.isdir(os.path.join(user_path, name)))
+
+def _list_images(day_path):
+    return sorted(name for name in os.listdir(day_path) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+# --- Recompression ---
+def recompress_image(image_path, quality=None):
+    """
+    Re-encodes one JPEG at the given quality and replaces the file when that saves at least
+    RECOMPRESS_MIN_SAVING. Returns (bytes_before, bytes_after).
+    """
+    import cv2 # loaded only when tiering runs
+    import numpy as np
+    quality = quality or RECOMPRESS_JPEG_QUALITY
+    with open(image_path, "rb") as f: # ไม่ใช้ cv2.imread เพราะอ่าน path ภาษาไทยบน Windows ไม่ได้
+        data = f.read()
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return len(data), len(data)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok or len(encoded) > len(data) * (1 - RECOMPRESS_MIN_SAVING):
+        return len(data), len(data)
+
+    stat = os.stat(image_path)
+    temp_path = image_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(encoded.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns)) # เก็บเวลาเดิมไว้ให้ resume เทียบได้เหมือนเดิม
+    os.replace(temp_path, image_path)
+    return len(data), len(encoded)
+
+def recompress_day(day_path, quality=None):
+    """
+    Recompresses every JPEG in one day folder. Returns (bytes_before, bytes_after) for the folder.
+    """
+    bytes_before = bytes_after = 0
+    for name in _list_images(day_path):
+        image_path = os.path.join(day_path, name)
+        if not name.lower().endswith(JPEG_EXTENSIONS):
+            size = os.path.getsize(image_path)
+            bytes_before += size
+            bytes_after += size
+            continue
+        try:
+            before, after = recompress_image(image_path, quality)
+        except Exception as e:
+            logging.error(f"Error recompressing '{image_path}': {e}")
+            before = after = os.path.getsize(image_path)
+        bytes_before += before
+        bytes_after += after
+    return bytes_before, bytes_after
+
+# --- Monthly Archives ---
+def archive_month(image_folder, username, month, days):
+    """
+    Moves the given day folders of one month into the user's monthly zip, records every image in the
+    archive index and then deletes the originals. Returns the number of images archived.
+    The zip is written to a temporary file and swapped in with os.replace, so a crash never leaves
+    a half-written archive; images already in an existing archive for the month are carried over.
+    """
+    user_path = os.path.join(image_folder, username)
+    archive_path = get_archive_path(image_folder, username, month)
+    temp_path = archive_path + ".tmp"
+    index_rows = []
+    archived_files = []
+
+    try:
+        # JPEG บีบอัดด้วย deflate ไม่ได้อีกแล้ว เก็บแบบ STORED ไม่เสีย CPU
+        with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_STORED) as new_archive:
+            existing_members = set()
+            if os.path.exists(archive_path):
+                with zipfile.ZipFile(archive_path, "r") as old_archive:
+                    for info in old_archive.infolist():
+                        new_archive.writestr(info, old_archive.read(info))
+                        existing_members.add(info.filename)
+            for day in days:
+                day_path = os.path.join(user_path, day)
+                for name in _list_images(day_path):
+                    member_name = f"{day}/{name}"
+                    image_path = os.path.join(day_path, name)
+                    if member_name not in existing_members:
+                        new_archive.write(image_path, member_name)
+                    index_rows.append((name, username, archive_path, member_name))
+                    archived_files.append(image_path)
+        with open(temp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, archive_path)
+    except Exception as e:
+        logging.error(f"❌ Error archiving {month} for '{username}': {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return 0
+
+    sqlite_manager.record_archived_images(index_rows) # ต้องบันทึกก่อนลบไฟล์ต้นฉบับ
+    for image_path in archived_files:
+        os.remove(image_path)
+    for day in days:
+        try:
+            os.rmdir(os.path.join(user_path, day))
+        except OSError:
+            logging.warning(f"Day folder '{os.path.join(user_path, day)}' still has other files, left in place.")
+    logging.info(f"🗄️ Archived {len(archived_files)} image(s) of {month} for '{username}' into '{archive_path}'.")
+    return len(archived_files)
+
+# --- Tiering Pass ---
+def run_storage_tiering(image_folder=None, today=None):
+    """
+    Runs one tiering pass over every user: recompresses day folders older than RECOMPRESS_AFTER_DAYS
+    and archives months whose last day is older than ARCHIVE_AFTER_DAYS. Only days on or before the
+    user's resume checkpoint are touched; the checkpoints are reconciled against the processed index
+    first. Returns a summary dict.
+    """
+    image_folder = image_folder or IMAGE_FOLDER
+    today = today or date.today()
+    recompress_before = (today - timedelta(days=RECOMPRESS_AFTER_DAYS)).isoformat()
+    archive_before = (today - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    summary = {"days_recompressed": 0, "bytes_saved": 0, "months_archived": 0, "images_archived": 0}
+    if not os.path.isdir(image_folder):
+        return summary
+
+    resume_manager.reconcile_resume_checkpoints(image_folder, today.isoformat()) # resume เลื่อน checkpoint แค่ตอนเริ่มบอท
+    checkpoints = sqlite_manager.get_resume_checkpoints()
+    with metrics_manager.timed("storage_tiering_seconds"):
+        for username in sorted(os.listdir(image_folder)):
+            user_path = os.path.join(image_folder, username)
+            checkpoint = checkpoints.get(username, "")
+            if not os.path.isdir(user_path) or not checkpoint:
+                continue
+            all_days = _list_day_folders(user_path)
+            days = [day for day in all_days if day <= checkpoint]
+
+            if RECOMPRESS_ENABLED:
+                recompressed_days = sqlite_manager.get_recompressed_days(username)
+                for day in days:
+                    if day >= recompress_before or day in recompressed_days:
+                        continue
+                    bytes_before, bytes_after = recompress_day(os.path.join(user_path, day))
+                    sqlite_manager.mark_day_recompressed(username, day, bytes_before, bytes_after)
+                    summary["days_recompressed"] += 1
+                    summary["bytes_saved"] += bytes_before - bytes_after
+                    metrics_manager.increment("storage_bytes_saved_total", bytes_before - bytes_after)
+
+            if ARCHIVE_ENABLED:
+                months = {}
+                for day in days:
+                    months.setdefault(day[:7], []).append(day)
+                for month, month_days in sorted(months.items()):
+                    # รวมได้เมื่อเดือนผ่านไปนานพอ และทุกวันของเดือนนั้นไม่เกิน checkpoint
+                    if not _is_month_finished(month, archive_before) or any(
+                            day[:7] == month and day > checkpoint for day in all_days):
+                        continue
+                    archived = archive_month(image_folder, username, month, month_days)
+                    if archived:
+                        summary["months_archived"] += 1
+                        summary["images_archived"] += archived
+                        metrics_manager.increment("images_archived_total", archived)
+
+    logging.info(f"Storage tiering pass finished: {summary}")
+    return summary
+
+def _is_month_finished(month, archive_before):
+    year, month_number = int(month[:4]), int(month[5:7])
+    next_month = date(year + month_number // 12, month_number % 12 + 1, 1)
+    return (next_month - timedelta(days=1)).isoformat() < archive_before
+
+# --- Retrieval ---
+def read_image(image_filename, image_folder=None):
+    """
+    Returns the bytes of an image by its log filename, whether it is still in its day folder or
+    already archived, or None if it cannot be found.
+    """
+    image_folder = image_folder or IMAGE_FOLDER
+    match = LOG_FILENAME_PATTERN.match(image_filename)
+    if match:
+        image_path = os.path.join(image_folder, match.group("username"), match.group("day"), image_filename)
+        try:
+            with open(image_path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+    location = sqlite_manager.get_archived_image(image_filename)
+    if location is None:
+        return None
+    archive_path, member_name = location
+    try:
+        with zipfile.ZipFile(archive_path, "r") as archive:
+            return archive.read(member_name)
+    except (FileNotFoundError, KeyError) as e:
+        logging.error(f"Archived image '{image_filename}' missing from '{archive_path}': {e}")
+        return None
+
+def get_folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+# --- Background Thread ---
+def _tiering_loop(image_folder):
+    if _stop_event.wait(TIERING_START_DELAY_SECONDS):
+        return
+    while True:
+        try:
+            run_storage_tiering(image_folder)
+        except Exception as e:
+            logging.error(f"❌ Storage tiering error: {e}")
+        if _stop_event.wait(TIERING_INTERVAL_SECONDS):
+            return
+
+def start_storage_tiering(image_folder=None):
+    """
+    Starts the background thread that runs a tiering pass every TIERING_INTERVAL_SECONDS.
+    """
+    global _tiering_thread
+    if _tiering_thread is not None:
+        return
+    _stop_event.clear()
+    _tiering_thread = threading.Thread(target=_tiering_loop, args=(image_folder or IMAGE_FOLDER,),
+                                       name="storage-tiering", daemon=True)
+    _tiering_thread.start()
+    logging.info(f"Storage tiering started (recompress after {RECOMPRESS_AFTER_DAYS} days at quality "
+                 f"{RECOMPRESS_JPEG_QUALITY}, archive after {ARCHIVE_AFTER_DAYS} days).")
+
+def stop_storage_tiering():
+    global _tiering_thread
+    if _tiering_thread is None:
+        return
+    _stop_event.set()
+    _tiering_thread.join()
+    _tiering_thread = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompress and archive old images, or fetch one image by its log filename.")
+    parser.add_argument("--image-folder", default=IMAGE_FOLDER)
+    parser.add_argument("--db", default=sqlite_manager.ML_FEEDBACK_DB)
+    parser.add_argument("--excel-folder", default="Excel Files",
+                        help="builds the processed index from these workbooks if the bot never has (for --run)")
+    parser.add_argument("--run", action="store_true", help="run one tiering pass now")
+    parser.add_argument("--get", metavar="FILENAME", help="write the image with this log filename to --output")
+    parser.add_argument("--output", default=None, help="output path for --get (default: the filename)")
+    args = parser.parse_args()
+
+    # ตารางเดียวกับที่บอทสร้างตอนเริ่ม: รอบ tiering อ่าน processed index และ resume checkpoint ด้วย
+    sqlite_manager.initialize_sqlite_db(args.db)
+    sqlite_manager.initialize_processed_index()
+    sqlite_manager.initialize_roi_stats()
+    sqlite_manager.initialize_image_hashes()
+    sqlite_manager.initialize_image_records()
+    sqlite_manager.initialize_storage_index()
+    if args.get:
+        data = read_image(args.get, args.image_folder)
+        if data is None:
+            parser.exit(1, f"'{args.get}' not found\n")
+        with open(args.output or args.get, "wb") as f:
+            f.write(data)
+        print(f"'{args.get}' written to '{args.output or args.get}' ({len(data)} bytes)")
+    elif args.run:
+        if os.path.isdir(args.excel_folder):
+            resume_manager.bootstrap_processed_index(args.excel_folder) # ไม่ทำอะไรถ้าบอทสร้าง index ไว้แล้ว
+        else:
+            logging.warning(f"Excel folder '{args.excel_folder}' not found; only days already in the processed index are tiered.")
+        size_before = get_folder_size(args.image_folder)
+        started = time.perf_counter()
+        summary = run_storage_tiering(args.image_folder)
+        size_after = get_folder_size(args.image_folder)
+        print(f"{summary} in {time.perf_counter() - started:.1f}s; "
+              f"'{args.image_folder}' {size_before / 2**20:.1f} MiB -> {size_after / 2**20:.1f} MiB")
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# โมดูลของบอทอยู่ที่ root ของ repository ไม่ได้ติดตั้งเป็น package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite_manager
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """
+    A fresh SQLite database with the processed index and image record tables, as the bot creates them.
+    """
+    sqlite_manager.initialize_sqlite_db(str(tmp_path / "ml_feedback.db"))
+    sqlite_manager.initialize_processed_index()
+    sqlite_manager.initialize_image_records()
+    return sqlite_manager.ML_FEEDBACK_DB
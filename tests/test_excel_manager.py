@@ -0,0 +1,46 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+from openpyxl import load_workbook
+
+import excel_manager
+import sqlite_manager
+
+
+def _ledger_rows(excel_file_path):
+    return list(excel_manager.iter_ledger_rows(excel_manager.get_ledger_file_path(excel_file_path)))
+
+
+def _workbook_rows(excel_file_path):
+    ws = load_workbook(excel_file_path)[excel_manager.SHEET_NAME]
+    return [list(row) for row in ws.iter_rows(min_row=2, values_only=True)]
+
+
+def test_replay_after_crash_between_ledger_append_and_index_commit(sqlite_db, tmp_path, monkeypatch):
+    base_folder = str(tmp_path / "Excel Files")
+    now = datetime(2024, 5, 1, 10, 20, 30)
+    row = ["alice", "2024-05-01 10:20:30", "alice_20240501_00001.jpg", "2024-05-01 10:20:00"]
+    excel_file_path = excel_manager.get_local_excel_file_path("alice", now, base_folder)
+
+    # ล่มหลังเขียน ledger แต่ก่อน commit processed index
+    def crash(rows):
+        raise sqlite3.OperationalError("simulated crash")
+    with monkeypatch.context() as m:
+        m.setattr(sqlite_manager, "record_saved_images", crash)
+        with pytest.raises(sqlite3.OperationalError):
+            excel_manager.append_to_local_excel(*row, now, base_folder)
+    assert _ledger_rows(excel_file_path) == [row]
+    assert not sqlite_manager.get_processed_filenames([row[2]])
+
+    # เริ่มใหม่: flusher รวม ledger เข้า workbook และเลื่อน offset ก่อน job ถูกเล่นซ้ำ
+    excel_manager.start_write_behind_flusher(base_folder)
+    excel_manager.stop_write_behind_flusher()
+    assert excel_manager.read_unflushed_rows(excel_file_path) == []
+
+    excel_manager.append_to_local_excel(*row, now, base_folder)
+    excel_manager.flush_workbook(excel_file_path)
+
+    assert _ledger_rows(excel_file_path) == [row]
+    assert _workbook_rows(excel_file_path) == [row]
+    assert sqlite_manager.get_processed_filenames([row[2]]) == {row[2]}
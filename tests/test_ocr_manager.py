@@ -0,0 +1,41 @@
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+import ocr_manager
+
+
+def _rotate(image, angle):
+    h, w = image.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h), borderValue=(255, 255, 255))
+
+
+def _text_block(width, height):
+    """
+    Dark timestamp-like text lines on a white background, level.
+    """
+    image = np.full((height, width, 3), 255, np.uint8)
+    scale = width / 560
+    for i in range(4):
+        cv2.putText(image, "2024-05-12 13:45:10 GPS", (int(width * 0.09), int(height * 0.33) + int(60 * scale) * i),
+                    cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), max(1, int(2.5 * scale)))
+    return image
+
+
+@pytest.mark.parametrize("size", [(900, 600), (3000, 2000)]) # ภาพใหญ่กว่า DESKEW_SAMPLE_MAX_SIDE ถูกย่อก่อนประเมิน
+@pytest.mark.parametrize("skew", [-10, -3, 3, 10])
+def test_deskew_angle_rotates_skewed_text_back_to_level(size, skew):
+    image = _rotate(_text_block(*size), skew)
+
+    angle = ocr_manager.estimate_deskew_angle(image)
+
+    # preprocess_image_for_ocr หมุนด้วย getRotationMatrix2D(center, angle) จึงต้องได้มุมตรงข้ามกับที่เอียง
+    assert angle == pytest.approx(-skew, abs=0.5)
+    assert abs(ocr_manager.estimate_deskew_angle(_rotate(image, angle))) < ocr_manager.MIN_DESKEW_ANGLE
+
+
+def test_deskew_angle_of_level_or_blank_image_is_zero():
+    assert abs(ocr_manager.estimate_deskew_angle(_text_block(900, 600))) < ocr_manager.MIN_DESKEW_ANGLE
+    assert ocr_manager.estimate_deskew_angle(np.full((600, 900, 3), 255, np.uint8)) == 0.0
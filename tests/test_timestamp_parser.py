@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+import timestamp_parser
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("12/05/2024 13:45:10", datetime(2024, 5, 12, 13, 45, 10)),
+    ("12-05-2024 13:45", datetime(2024, 5, 12, 13, 45)),
+    ("12.05.2024 13:45:10", datetime(2024, 5, 12, 13, 45, 10)),
+    ("2024-05-12 13:45:10", datetime(2024, 5, 12, 13, 45, 10)),
+    ("2024/05/12 13:45", datetime(2024, 5, 12, 13, 45)),
+    ("2024.05.12 07:05", datetime(2024, 5, 12, 7, 5)),
+    ("2024-05-12T01:02:03", datetime(2024, 5, 12, 1, 2, 3)),
+    ("05/13/2024 13:45:10", datetime(2024, 5, 13, 13, 45, 10)),
+    ("12/05/24 13:45:10", datetime(2024, 5, 12, 13, 45, 10)),
+    ("12-05-24 13:45", datetime(2024, 5, 12, 13, 45)),
+    ("13:45:10 12/05/2024", datetime(2024, 5, 12, 13, 45, 10)),
+    ("12 May 2024 10:11:12", datetime(2024, 5, 12, 10, 11, 12)),
+    ("3 Sept 2024 10:11", datetime(2024, 9, 3, 10, 11)),
+    ("12/05/24 01:45 PM", datetime(2024, 5, 12, 13, 45)),
+    ("12/05/24 12:05:09 AM", datetime(2024, 5, 12, 0, 5, 9)),
+    ("GPS 13.7563N 100.5018E\n12/05/2024 13:45:10 Bangkok", datetime(2024, 5, 12, 13, 45, 10)),
+    ("Lat 13.75 ~ 2024-05-12 13:45:10 ~ note", datetime(2024, 5, 12, 13, 45, 10)),
+    ("99/99/2024 13:45:10 then 12/05/2024 13:45:10", datetime(2024, 5, 12, 13, 45, 10)),
+])
+def test_parses_gregorian_formats(text, expected):
+    assert timestamp_parser.parse_timestamp(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("12/05/2567 13:45:10", datetime(2024, 5, 12, 13, 45, 10)),
+    ("13:45:10 12.05.2567", datetime(2024, 5, 12, 13, 45, 10)),
+    ("2567-05-12 08:00:00", datetime(2024, 5, 12, 8, 0)),
+    ("12/05/2567 เวลา 13:45 น.", datetime(2024, 5, 12, 13, 45)),
+    ("1/5/2567 เวลา 9:05 น.", datetime(2024, 5, 1, 9, 5)),
+    ("29/02/2567 10:00", datetime(2024, 2, 29, 10, 0)), # 2567 = ค.ศ. 2024 ปีอธิกสุรทิน
+    ("29/02/2566 10:00", None),
+])
+def test_converts_buddhist_era_years(text, expected):
+    assert timestamp_parser.parse_timestamp(text) == expected
+
+
+@pytest.mark.parametrize("month_name, month", sorted(timestamp_parser.THAI_MONTHS.items(), key=lambda item: item[1]))
+def test_parses_every_thai_month_name(month_name, month):
+    assert timestamp_parser.parse_timestamp(f"5 {month_name} 2567 08:00:00") == datetime(2024, month, 5, 8, 0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5 พ.ค. 2567 08:00:00", datetime(2024, 5, 5, 8, 0)),
+    ("5 ม.ค. 2568 08:00", datetime(2025, 1, 5, 8, 0)),
+    ("21 ธันวาคม 2567 17:30:00", datetime(2024, 12, 21, 17, 30)),
+    ("12พฤศจิกายน2566 เวลา 23:59:59 น.", datetime(2023, 11, 12, 23, 59, 59)),
+])
+def test_parses_thai_month_names_in_context(text, expected):
+    assert timestamp_parser.parse_timestamp(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "no timestamp here",
+    "12/05/2024",
+    "13:45",
+    "12/05/2024 25:61:00",
+    "12/05/2024 24:00",
+    "12/05/2024 1:5",
+    "12/05/2024 13:45 PM",
+    "31/02/2024 10:00",
+    "00/05/2024 10:00",
+    "2024-13-45 10:00:00",
+    "5 Foo 2024 10:00",
+])
+def test_rejects_malformed_input(text):
+    assert timestamp_parser.parse_timestamp(text) is None
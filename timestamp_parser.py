@@ -0,0 +1,100 @@
+import re
+from datetime import datetime
+
+# --- Timestamp Parser ---
+# แปลงข้อความจาก OCR เป็น datetime ด้วย regex ที่ compile ไว้แล้ว และดึงค่าแต่ละช่องโดยตรง (ไม่ลอง strptime ทีละรูปแบบ)
+BUDDHIST_ERA_OFFSET = 543
+BUDDHIST_ERA_MIN_YEAR = 2400 # ปีที่มากกว่านี้ถือเป็น พ.ศ.
+TWO_DIGIT_YEAR_BASE = 2000
+
+ENGLISH_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+THAI_MONTHS = {
+    "ม.ค.": 1, "ก.พ.": 2, "มี.ค.": 3, "เม.ย.": 4, "พ.ค.": 5, "มิ.ย.": 6,
+    "ก.ค.": 7, "ส.ค.": 8, "ก.ย.": 9, "ต.ค.": 10, "พ.ย.": 11, "ธ.ค.": 12,
+    "มกราคม": 1, "กุมภาพันธ์": 2, "มีนาคม": 3, "เมษายน": 4, "พฤษภาคม": 5, "มิถุนายน": 6,
+    "กรกฎาคม": 7, "สิงหาคม": 8, "กันยายน": 9, "ตุลาคม": 10, "พฤศจิกายน": 11, "ธันวาคม": 12,
+}
+
+_TIME = r'(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?(?:\s*(?P<ampm>[AaPp][Mm]))?'
+_TIME_SUFFIX = r'(?:\s*น\.)?'
+_TIME_PREFIX = r'\s*(?:เวลา\s*|T)?'
+_SEP = r'[-./]'
+_ENGLISH_MONTH = r'(?P<month_name>(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?)'
+_THAI_MONTH = '(?P<month_name>' + '|'.join(re.escape(name) for name in sorted(THAI_MONTHS, key=len, reverse=True)) + ')'
+
+# ลำดับมีผล: รูปแบบที่เจาะจงกว่าอยู่ก่อน (ปี 4 หลักก่อนปี 2 หลัก, วัน/เดือน/ปี ก่อน เดือน/วัน/ปี)
+_PATTERNS = [
+    # 2024-05-12 13:45:10, 2024/05/12 13:45, 2024-05-12T13:45:10
+    re.compile(r'(?P<year>\d{4})' + _SEP + r'(?P<month>\d{1,2})' + _SEP + r'(?P<day>\d{1,2})' + _TIME_PREFIX + _TIME),
+    # 12/05/2024 13:45:10, 12-05-2567 เวลา 13:45 น.
+    re.compile(r'(?P<day>\d{1,2})' + _SEP + r'(?P<month>\d{1,2})' + _SEP + r'(?P<year>\d{4})' + _TIME_PREFIX + _TIME + _TIME_SUFFIX),
+    # 13:45:10 12/05/2024
+    re.compile(_TIME + r'\s+(?P<day>\d{1,2})' + _SEP + r'(?P<month>\d{1,2})' + _SEP + r'(?P<year>\d{4})'),
+    # 12 May 2024 13:45:10
+    re.compile(r'(?P<day>\d{1,2})\s+' + _ENGLISH_MONTH + r'\s+(?P<year>\d{4})' + _TIME_PREFIX + _TIME, re.IGNORECASE),
+    # 12 พ.ค. 2567 13:45:10
+    re.compile(r'(?P<day>\d{1,2})\s*' + _THAI_MONTH + r'\s*(?P<year>\d{4})' + _TIME_PREFIX + _TIME + _TIME_SUFFIX),
+    # 12/05/24 01:45 PM
+    re.compile(r'(?P<day>\d{1,2})' + _SEP + r'(?P<month>\d{1,2})' + _SEP + r'(?P<year>\d{2})' + _TIME_PREFIX + _TIME + _TIME_SUFFIX),
+]
+
+def _to_gregorian_year(year_text):
+    year = int(year_text)
+    if len(year_text) == 2:
+        return TWO_DIGIT_YEAR_BASE + year
+    if year >= BUDDHIST_ERA_MIN_YEAR:
+        return year - BUDDHIST_ERA_OFFSET
+    return year
+
+def _month_from_name(month_name):
+    month = THAI_MONTHS.get(month_name)
+    if month is None:
+        month = ENGLISH_MONTHS.get(month_name[:3].lower())
+    return month
+
+def _build_datetime(fields):
+    """
+    Turns the named groups of a match into a datetime, or None if the fields are out of range.
+    When day/month cannot be valid as given but swapped they can (13/05 vs 05/13), they are swapped,
+    which covers US-style month-first dates.
+    """
+    month_name = fields.get("month_name")
+    month = _month_from_name(month_name) if month_name else int(fields["month"])
+    day = int(fields["day"])
+    year = _to_gregorian_year(fields["year"])
+    hour = int(fields["hour"])
+    minute = int(fields["minute"])
+    second = int(fields["second"]) if fields.get("second") else 0
+
+    ampm = fields.get("ampm")
+    if ampm:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if ampm.lower() == "pm" else 0)
+
+    if month is None:
+        return None
+    if month > 12 and not month_name and day <= 12:
+        day, month = month, day
+    try:
+        return datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return None
+
+def parse_timestamp(text):
+    """
+    Returns the first timestamp found in text as a datetime, or None.
+    Handles day/month/year, year/month/day, time-first, English and Thai month names,
+    Buddhist-era years and 12-hour clocks.
+    """
+    if not text or ":" not in text:
+        return None
+    for pattern in _PATTERNS:
+        for match in pattern.finditer(text):
+            dt = _build_datetime(match.groupdict())
+            if dt is not None:
+                return dt
+    return None